@@ -1,6 +1,16 @@
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
 
 
 class ApiConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "api"
+
+    def ready(self):
+        if settings.GEMINI_WARMUP:
+            from .utils.ai_detector import get_detector
+
+            # Off the boot path: the worker can take requests while it warms up
+            threading.Thread(target=lambda: get_detector().warm_up(), daemon=True).start()
@@ -0,0 +1,113 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api import views
+from api.models import AnalysisJob
+from api.utils import job_queue, text_chunker
+
+
+class Command(BaseCommand):
+    help = (
+        "Run queued analysis jobs. Start several workers to scale out; "
+        "jobs left running by a stopped worker are picked up again."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--threads",
+            type=int,
+            default=settings.JOB_WORKER_THREADS,
+            help="Jobs (or text batches) analyzed concurrently by this worker",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.JOB_WORKER_BATCH_SIZE,
+            help="Jobs claimed per round",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=settings.JOB_POLL_INTERVAL,
+            help="Seconds to sleep when the queue is empty",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty",
+        )
+
+    def handle(self, *args, **options):
+        pool = ThreadPoolExecutor(max_workers=options["threads"], thread_name_prefix="analysis-job")
+        self.stdout.write(f"Analysis worker started with {options['threads']} threads")
+        last_pruned = 0.0
+
+        try:
+            while True:
+                requeued = job_queue.requeue_expired()
+                if requeued:
+                    self.stdout.write(f"Requeued {requeued} interrupted jobs")
+                if time.monotonic() - last_pruned > 3600:
+                    job_queue.prune()
+                    last_pruned = time.monotonic()
+
+                jobs = job_queue.claim(options["batch_size"])
+                if jobs:
+                    self._run(pool, jobs)
+                elif options["once"]:
+                    break
+                else:
+                    time.sleep(options["poll_interval"])
+        except KeyboardInterrupt:
+            # Claimed jobs not yet finished are requeued once their lease expires
+            self.stdout.write("Analysis worker stopped")
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, pool, jobs):
+        """
+        Run one round of claimed jobs. Jobs for the same input share one
+        analysis, and short texts in the same language share batched model
+        calls.
+        """
+        by_key = {}
+        for job in jobs:
+            by_key.setdefault(job.cache_key, []).append(job)
+
+        short_texts = {}
+        tasks = []
+        for cache_key, same_jobs in by_key.items():
+            job = same_jobs[0]
+            if job.kind == AnalysisJob.TEXT and not text_chunker.is_long_text(job.text):
+                short_texts.setdefault(job.language, []).append(cache_key)
+            elif job.kind == AnalysisJob.TEXT:
+                tasks.append(([cache_key], pool.submit(
+                    lambda job=job: [views.analyze_text_content(job.text, job.language, job.cache_key)]
+                )))
+            else:
+                tasks.append(([cache_key], pool.submit(
+                    lambda job=job: [views.analyze_image_content(bytes(job.payload), job.mime_type, job.cache_key)]
+                )))
+
+        for language, cache_keys in short_texts.items():
+            texts = [by_key[cache_key][0].text for cache_key in cache_keys]
+            tasks.append((cache_keys, pool.submit(views.analyze_text_contents, texts, language)))
+
+        for cache_keys, future in tasks:
+            try:
+                results = future.result()
+            except Exception as e:
+                self.stderr.write(f"Analysis job error: {e}")
+                for cache_key in cache_keys:
+                    for job in by_key[cache_key]:
+                        job_queue.fail(job, e)
+                continue
+
+            for cache_key, result in zip(cache_keys, results):
+                for job in by_key[cache_key]:
+                    job_queue.complete(job, result)
+
+        self.stdout.write(f"Finished {len(jobs)} jobs ({len(by_key)} unique)")
@@ -0,0 +1,69 @@
+import random
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.models import AnalysisVerdict
+from api.utils.triage import TriageClassifier
+
+
+class Command(BaseCommand):
+    help = "Train the local triage classifier from stored Gemini verdicts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            default=settings.TRIAGE_MODEL_PATH,
+            help="Where to write the model (default: TRIAGE_MODEL_PATH)",
+        )
+        parser.add_argument(
+            "--min-confidence",
+            type=int,
+            default=60,
+            help="Ignore verdicts Gemini was less confident about",
+        )
+        parser.add_argument(
+            "--holdout",
+            type=float,
+            default=0.1,
+            help="Fraction of verdicts held out to report triage quality",
+        )
+
+    def handle(self, *args, **options):
+        samples = list(
+            AnalysisVerdict.objects.filter(confidence__gte=options["min_confidence"])
+            .values_list("text", "risk_level", "category")
+        )
+        if not samples:
+            raise CommandError("No stored verdicts to train on (is TRIAGE_RECORD_VERDICTS enabled?)")
+
+        random.Random(0).shuffle(samples)
+        holdout_size = int(len(samples) * options["holdout"])
+        holdout, training = samples[:holdout_size], samples[holdout_size:]
+
+        classifier = TriageClassifier.train(training)
+        self.stdout.write(f"Trained on {len(training)} verdicts")
+
+        if holdout:
+            self._report(classifier, holdout)
+
+        classifier.save(options["output"])
+        self.stdout.write(self.style.SUCCESS(f"Model written to {options['output']}"))
+
+    def _report(self, classifier, holdout):
+        answered = correct = 0
+        missed_high_risk = 0
+        for text, risk_level, _ in holdout:
+            verdict = classifier.triage(text)
+            if verdict is None:
+                continue
+            answered += 1
+            correct += verdict["risk_level"] == risk_level
+            # Benign answers for texts Gemini called HIGH/CRITICAL are the costly mistake
+            missed_high_risk += verdict["risk_level"] == "LOW" and risk_level in ("HIGH", "CRITICAL")
+
+        self.stdout.write(
+            f"Holdout: {len(holdout)} verdicts, answered locally {answered} "
+            f"({answered / len(holdout):.0%}), accuracy on answered "
+            f"{(correct / answered if answered else 0):.1%}, high-risk marked benign {missed_high_risk}"
+        )
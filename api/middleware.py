@@ -0,0 +1,50 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .utils import metrics
+
+
+class ServerTimingMiddleware:
+    """
+    Time every request, count it per view and status, and report the time
+    spent in each instrumented stage in a Server-Timing header
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = metrics.end_request(token)
+        return self._finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = metrics.end_request(token)
+        return self._finish(request, response, timings, started)
+
+    def _finish(self, request, response, timings, started):
+        total = time.perf_counter() - started
+        match = getattr(request, "resolver_match", None)
+        view = match.view_name if match else "unmatched"
+        metrics.REQUEST_SECONDS.observe(total, view)
+        metrics.REQUESTS.inc(view, str(response.status_code))
+        response["Server-Timing"] = metrics.server_timing(timings, total)
+        metrics.flush()
+        return response
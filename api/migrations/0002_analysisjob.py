@@ -0,0 +1,38 @@
+# Generated by Django 5.2.8 on 2026-10-17 03:14
+
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnalysisJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('kind', models.CharField(choices=[('text', 'Text'), ('image', 'Image')], max_length=8)),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=8)),
+                ('priority', models.SmallIntegerField(default=0)),
+                ('cache_key', models.CharField(db_index=True, max_length=128)),
+                ('language', models.CharField(default='en', max_length=16)),
+                ('text', models.TextField(blank=True)),
+                ('payload', models.BinaryField(null=True)),
+                ('mime_type', models.CharField(blank=True, max_length=64)),
+                ('result', models.JSONField(null=True)),
+                ('error', models.TextField(blank=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(null=True)),
+                ('finished_at', models.DateTimeField(null=True)),
+                ('lease_expires_at', models.DateTimeField(null=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', '-priority', 'created_at'], name='analysisjob_queue_idx')],
+            },
+        ),
+    ]
@@ -1,3 +1,60 @@
+import uuid
+
 from django.db import models
 
 # Create your models here.
+
+
+class AnalysisVerdict(models.Model):
+    """A Gemini text verdict kept as training data for the local triage model"""
+
+    text = models.TextField()
+    language = models.CharField(max_length=16, default='en')
+    risk_level = models.CharField(max_length=16)
+    category = models.CharField(max_length=100)
+    confidence = models.PositiveSmallIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    def __str__(self):
+        return f"{self.risk_level} / {self.category}"
+
+
+class AnalysisJob(models.Model):
+    """A queued text or image analysis, executed by the analysis worker"""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+
+    TEXT = 'text'
+    IMAGE = 'image'
+    KIND_CHOICES = [(TEXT, 'Text'), (IMAGE, 'Image')]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    kind = models.CharField(max_length=8, choices=KIND_CHOICES)
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default=QUEUED)
+    priority = models.SmallIntegerField(default=0)
+    cache_key = models.CharField(max_length=128, db_index=True)
+    language = models.CharField(max_length=16, default='en')
+    # Inputs are cleared once the job has finished
+    text = models.TextField(blank=True)
+    payload = models.BinaryField(null=True)
+    mime_type = models.CharField(max_length=64, blank=True)
+    result = models.JSONField(null=True)
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True)
+    finished_at = models.DateTimeField(null=True)
+    lease_expires_at = models.DateTimeField(null=True)
+
+    class Meta:
+        indexes = [
+            # Next-job lookup: queued jobs, highest priority, oldest first
+            models.Index(fields=['status', '-priority', 'created_at'], name='analysisjob_queue_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} job {self.pk} ({self.status})"
@@ -0,0 +1,24 @@
+import json
+
+from rest_framework.renderers import BaseRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+
+class EventStreamRenderer(BaseRenderer):
+    """
+    Lets views that answer with server-sent events pass content negotiation
+    for clients sending `Accept: text/event-stream`. Responses that are not
+    streamed (errors, long texts) are sent as a single 'error' or 'done'
+    event so the client still gets a well-formed stream.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        response = (renderer_context or {}).get('response')
+        event = 'error' if response is not None and response.status_code >= 400 else 'done'
+        payload = json.dumps(data, cls=JSONEncoder, ensure_ascii=False)
+        return f"event: {event}\ndata: {payload}\n\n".encode(self.charset)
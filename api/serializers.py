@@ -1,8 +1,32 @@
+from django.conf import settings
 from rest_framework import serializers
 
 class AbuseAnalysisSerializer(serializers.Serializer):
-    text = serializers.CharField(required=True)
-    language = serializers.CharField(default='en')
+    text = serializers.CharField(required=True, max_length=settings.TEXT_MAX_CHARS)
+    language = serializers.CharField(default='en', max_length=16)
+
+class BatchAnalysisSerializer(serializers.Serializer):
+    texts = serializers.ListField(
+        child=serializers.CharField(max_length=settings.LONG_TEXT_THRESHOLD),
+        allow_empty=False,
+        max_length=settings.BATCH_MAX_TEXTS,
+    )
+    language = serializers.CharField(default='en', max_length=16)
+
+class JobSubmitSerializer(serializers.Serializer):
+    text = serializers.CharField(required=False, max_length=settings.TEXT_MAX_CHARS)
+    language = serializers.CharField(default='en', max_length=16)
+    priority = serializers.ChoiceField(choices=['low', 'normal', 'high'], default='normal')
+
+class ConversationSessionSerializer(serializers.Serializer):
+    language = serializers.CharField(default='en', max_length=16)
+
+class ConversationMessagesSerializer(serializers.Serializer):
+    messages = serializers.ListField(
+        child=serializers.CharField(max_length=settings.CONVERSATION_MESSAGE_MAX_CHARS),
+        allow_empty=False,
+        max_length=settings.CONVERSATION_MAX_MESSAGES_PER_APPEND,
+    )
     
 class AnalysisResponseSerializer(serializers.Serializer):
     risk_level = serializers.CharField()
@@ -11,4 +35,5 @@ class AnalysisResponseSerializer(serializers.Serializer):
     explanation = serializers.CharField()
     immediate_actions = serializers.ListField(child=serializers.CharField())
     detected_text = serializers.CharField(required=False, allow_blank=True) 
+    evidence = serializers.ListField(child=serializers.DictField(), required=False)
        
\ No newline at end of file
@@ -3,8 +3,19 @@ from . import views
 
 urlpatterns = [
     path('analyze/text/', views.analyze_text, name='analyze_text'),
+    path('analyze/text/batch/', views.analyze_text_batch, name='analyze_text_batch'),
     path('analyze/image/', views.analyze_image, name='analyze_image'),
+    path('analyze/images/', views.analyze_images, name='analyze_images'),
+    path('jobs/', views.submit_job, name='submit_job'),
+    path('jobs/<uuid:job_id>/', views.job_detail, name='job_detail'),
+    path('conversations/', views.create_conversation, name='create_conversation'),
+    path('conversations/<str:session_id>/', views.conversation_detail, name='conversation_detail'),
+    path('conversations/<str:session_id>/messages/', views.append_conversation_messages, name='append_conversation_messages'),
+    path('async/analyze/text/', views.analyze_text_async, name='analyze_text_async'),
+    path('async/analyze/image/', views.analyze_image_async, name='analyze_image_async'),
     path('resources/support/', views.support_resources, name='support_resources'),
     path('resources/tips/', views.safety_tips, name='safety_tips'),
     path('health/', views.health_check, name='health_check'),
+    path('stats/', views.service_stats, name='service_stats'),
+    path('metrics/', views.prometheus_metrics, name='prometheus_metrics'),
 ]
\ No newline at end of file
@@ -0,0 +1,373 @@
+import asyncio
+import contextvars
+import functools
+import heapq
+import inspect
+import itertools
+import math
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from .keyword_matcher import get_lexicon
+from .report import RISK_ORDER
+
+# Priorities of queued model work; higher is served first
+PRIORITY_NORMAL = 0
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of being queued any longer"""
+
+    def __init__(self, retry_after):
+        super().__init__("Service is overloaded")
+        self.retry_after = retry_after
+
+
+class RateLimited(Exception):
+    """Raised when a client's token bucket cannot pay for a request's model work"""
+
+    def __init__(self, retry_after):
+        super().__init__("Too many requests")
+        self.retry_after = retry_after
+
+
+_stats_lock = threading.Lock()
+_stats = {
+    "rate_limited": 0,
+    "admitted": 0,
+    "queued": 0,
+    "shed": 0,
+}
+
+
+def _count(stat):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+class RateLimiter:
+    """
+    Per-client token buckets kept in a SQLite file, so every worker process
+    on the host draws from the same bucket
+    """
+
+    def __init__(self, path, capacity, refill_rate):
+        self._path = str(path)
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+        self._connections = threading.local()
+        self._calls = itertools.count()
+
+    def _connection(self):
+        connection = getattr(self._connections, "connection", None)
+        if connection is None or self._connections.pid != os.getpid():
+            connection = sqlite3.connect(self._path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS token_buckets ("
+                "client TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._connections.connection = connection
+            self._connections.pid = os.getpid()
+        return connection
+
+    def take(self, client, cost=1):
+        """Spend cost tokens; returns 0 if allowed, else seconds until it would be"""
+        connection = self._connection()
+        now = time.time()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                "SELECT tokens, updated FROM token_buckets WHERE client = ?", (client,)
+            ).fetchone()
+            tokens = self.capacity
+            if row is not None:
+                tokens = min(self.capacity, row[0] + (now - row[1]) * self.refill_rate)
+
+            wait = 0.0
+            if tokens >= cost:
+                tokens -= cost
+            else:
+                wait = (cost - tokens) / self.refill_rate
+            connection.execute(
+                "INSERT OR REPLACE INTO token_buckets (client, tokens, updated) VALUES (?, ?, ?)",
+                (client, tokens, now),
+            )
+            # Buckets idle long enough to be full again carry no information
+            if next(self._calls) % 1000 == 0:
+                connection.execute(
+                    "DELETE FROM token_buckets WHERE updated < ?",
+                    (now - self.capacity / self.refill_rate,),
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return wait
+
+
+class _Waiter:
+    def __init__(self):
+        self.event = threading.Event()
+        self.granted = False
+
+
+class PriorityGate:
+    """
+    Bounds the model work running in this process. Requests beyond
+    max_active wait in a bounded queue, highest priority first; when the
+    queue is full the lowest-priority request is shed, and nobody waits
+    longer than wait_timeout.
+    """
+
+    def __init__(self, max_active, max_waiting, wait_timeout, retry_after):
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+        self.retry_after = retry_after
+        self._lock = threading.Lock()
+        self._active = 0
+        self._waiting = []  # heap of (-priority, arrival, waiter)
+        self._arrivals = itertools.count()
+
+    def try_acquire(self):
+        with self._lock:
+            if self._active < self.max_active and not self._waiting:
+                self._active += 1
+                return True
+        return False
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        if self.try_acquire():
+            return
+
+        with self._lock:
+            if self._active < self.max_active and not self._waiting:
+                self._active += 1
+                return
+            if len(self._waiting) >= self.max_waiting:
+                lowest = max(self._waiting, default=None)
+                if lowest is None or -lowest[0] >= priority:
+                    raise Overloaded(self.retry_after)
+                # Make room by shedding the least urgent waiter
+                self._waiting.remove(lowest)
+                heapq.heapify(self._waiting)
+                lowest[2].event.set()
+            waiter = _Waiter()
+            heapq.heappush(self._waiting, (-priority, next(self._arrivals), waiter))
+        _count("queued")
+
+        waiter.event.wait(self.wait_timeout)
+        with self._lock:
+            if waiter.granted:
+                return
+            # Timed out or shed; leave the queue if still in it
+            self._waiting = [entry for entry in self._waiting if entry[2] is not waiter]
+            heapq.heapify(self._waiting)
+        raise Overloaded(self.retry_after)
+
+    def release(self):
+        with self._lock:
+            if self._waiting:
+                # Hand the slot straight to the most urgent waiter
+                _, _, waiter = heapq.heappop(self._waiting)
+                waiter.granted = True
+                waiter.event.set()
+            else:
+                self._active -= 1
+
+    def stats(self):
+        with self._lock:
+            return {"active": self._active, "waiting": len(self._waiting)}
+
+
+_limiter = RateLimiter(
+    settings.ADMISSION_DB_PATH,
+    capacity=settings.ADMISSION_BUCKET_CAPACITY,
+    refill_rate=settings.ADMISSION_BUCKET_REFILL_RATE,
+)
+_gate = PriorityGate(
+    max_active=settings.ADMISSION_MAX_ACTIVE,
+    max_waiting=settings.ADMISSION_MAX_QUEUED,
+    wait_timeout=settings.ADMISSION_QUEUE_TIMEOUT,
+    retry_after=settings.ADMISSION_RETRY_AFTER,
+)
+# Async requests that have to queue wait for the gate on these threads
+_wait_pool = ThreadPoolExecutor(
+    max_workers=settings.ADMISSION_MAX_QUEUED + 1,
+    thread_name_prefix="admission-wait",
+)
+
+
+class _Charge:
+    """The token cost a request owes, paid the first time it needs model work"""
+
+    def __init__(self, client, cost):
+        self.client = client
+        self.cost = cost
+        self.lock = threading.Lock()
+        self.paid = False
+        self.wait = 0.0
+
+
+# Set by controlled() for the request being handled
+_pending_charge = contextvars.ContextVar("admission_charge", default=None)
+
+
+def charge():
+    """
+    Spend the current request's tokens, once per request, when it first
+    misses the cache. Cache hits never touch the bucket. Raises RateLimited
+    when the client's bucket is empty.
+    """
+    pending = _pending_charge.get()
+    if pending is None or not settings.ADMISSION_ENABLED:
+        return
+    with pending.lock:
+        if not pending.paid:
+            pending.paid = True
+            pending.wait = _limiter.take(pending.client, pending.cost)
+            if pending.wait:
+                _count("rate_limited")
+    if pending.wait:
+        raise RateLimited(pending.wait)
+
+
+async def acharge():
+    """Async counterpart of charge (the bucket lives in SQLite)"""
+    pending = _pending_charge.get()
+    if pending is not None and not pending.paid:
+        await asyncio.to_thread(charge)
+    else:
+        charge()
+
+
+def _release_if_acquired(future):
+    if not future.cancelled() and future.exception() is None:
+        _gate.release()
+
+
+def text_priority(text, language="en"):
+    """Likely high-risk texts (by the keyword lexicon) are served first"""
+    matches = get_lexicon(language).match(text)
+    if not matches:
+        return PRIORITY_NORMAL
+    return max(RISK_ORDER.get(category["risk_level"], 0) for category, _, _ in matches)
+
+
+def degrades():
+    """Whether shed requests get the keyword-only verdict instead of a 429"""
+    return settings.ADMISSION_SHED_MODE == "fallback"
+
+
+@contextmanager
+def admitted(priority=PRIORITY_NORMAL):
+    """
+    Charge the request and hold one of the gate's slots; raises RateLimited
+    or Overloaded when shed
+    """
+    if not settings.ADMISSION_ENABLED:
+        yield
+        return
+    charge()
+    try:
+        _gate.acquire(priority)
+    except Overloaded:
+        _count("shed")
+        raise
+    _count("admitted")
+    try:
+        yield
+    finally:
+        _gate.release()
+
+
+def run(analyze, priority=PRIORITY_NORMAL):
+    """Run analyze() once the gate admits it"""
+    with admitted(priority):
+        return analyze()
+
+
+async def arun(analyze, priority=PRIORITY_NORMAL):
+    """Async counterpart of run; analyze is a coroutine function"""
+    if not settings.ADMISSION_ENABLED:
+        return await analyze()
+    await acharge()
+    try:
+        if not _gate.try_acquire():
+            # Only contended requests spend a thread waiting for their turn
+            waiting = _wait_pool.submit(_gate.acquire, priority)
+            try:
+                await asyncio.wrap_future(waiting)
+            except asyncio.CancelledError:
+                # Client went away; give the slot back once it is granted
+                waiting.add_done_callback(_release_if_acquired)
+                raise
+    except Overloaded:
+        _count("shed")
+        raise
+    _count("admitted")
+    try:
+        return await analyze()
+    finally:
+        _gate.release()
+
+
+def client_id(request):
+    if settings.ADMISSION_TRUST_X_FORWARDED_FOR:
+        forwarded = request.META.get("HTTP_X_FORWARDED_FOR")
+        if forwarded:
+            return forwarded.split(",")[0].strip()
+    return request.META.get("REMOTE_ADDR", "")
+
+
+def _too_many_requests(retry_after, message):
+    response = JsonResponse({"error": message}, status=429)
+    response["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def controlled(cost=1):
+    """
+    Rate-limit a view per client: cost tokens are charged when the request
+    first needs model work (see charge). RateLimited and Overloaded raised
+    while it runs become a 429 with Retry-After.
+    """
+    def decorator(view):
+        if inspect.iscoroutinefunction(view):
+            @functools.wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                token = _pending_charge.set(_Charge(client_id(request), cost))
+                try:
+                    return await view(request, *args, **kwargs)
+                except (RateLimited, Overloaded) as e:
+                    return _too_many_requests(e.retry_after, str(e))
+                finally:
+                    _pending_charge.reset(token)
+        else:
+            @functools.wraps(view)
+            def wrapper(request, *args, **kwargs):
+                token = _pending_charge.set(_Charge(client_id(request), cost))
+                try:
+                    return view(request, *args, **kwargs)
+                except (RateLimited, Overloaded) as e:
+                    return _too_many_requests(e.retry_after, str(e))
+                finally:
+                    _pending_charge.reset(token)
+        return wrapper
+    return decorator
+
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    result.update(_gate.stats())
+    return result
@@ -1,25 +1,38 @@
 import os
 import google.generativeai as genai
+import google.ai.generativelanguage as glm
 import re
 from django.conf import settings
 import base64
+import asyncio
+import logging
+import threading
+import time
+import weakref
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-class AbuseDetector:
-    def __init__(self):
-        self.api_key = settings.GEMINI_API_KEY
-        if self.api_key:
-            genai.configure(api_key=self.api_key)
-        else:
-            print("Warning: GEMINI_API_KEY is not set. AI detection will not work.")  
-    
-    def analyze_text(self, text):
-        if not self.api_key:
-            return self._fallback_analysis(text)
-        
-        try:
-            model = genai.GenerativeModel("gemini-2.5-flash")  # Use flash for faster responses
-            
-            prompt = f"""
+from asgiref.sync import sync_to_async
+
+from ..models import AnalysisVerdict
+from . import metrics, structured_output
+from .credential_pool import CredentialPool, CredentialsExhausted, is_quota_error
+from .keyword_matcher import get_lexicon
+from .model_router import ModelRouter
+from .resilience import (
+    CircuitBreaker, CircuitOpenError, Deadline, DeadlineExceeded, LatencyTracker,
+    is_upstream_failure,
+)
+from .triage import RISK_LEVELS, get_triage_classifier
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever a prompt changes so results cached for the old prompt are not reused
+PROMPT_VERSION = 2
+
+# Prompts are split around the analyzed content and joined per request,
+# so no template is re-formatted on the hot path. Each prompt has a
+# line-based and a JSON (structured output) response-format section.
+TEXT_PROMPT_HEAD = """
             Analyze the following text for digital abuse. Your task is to detect abusive or harmful behavior and provide a clear, structured safety report.
 
             Evaluate the text across these categories:
@@ -32,7 +45,9 @@ class AbuseDetector:
             - Sextortion Attempts
 
             TEXT TO ANALYZE:
-            "{text}"
+            \""""
+
+TEXT_FORMAT_LINES = """\"
 
             RESPONSE FORMAT (must follow exactly):
             RISK_LEVEL: [LOW | MEDIUM | HIGH | CRITICAL]
@@ -40,7 +55,20 @@ class AbuseDetector:
             CONFIDENCE: [0-100]
             EXPLANATION: [Short explanation of why the text is abusive or harmful]
             IMMEDIATE_ACTIONS: Action 1, Action 2, Action 3, Action 4
+"""
+
+TEXT_FORMAT_JSON = """\"
+
+            RESPONSE FORMAT:
+            Respond with one JSON object with these fields:
+            risk_level: LOW, MEDIUM, HIGH or CRITICAL
+            category: primary identified category
+            confidence: integer from 0 to 100
+            explanation: short explanation of why the text is abusive or harmful
+            immediate_actions: list of up to 4 short actions
+"""
 
+TEXT_PROMPT_RULES = """
             RULES:
             - Always infer the language of the text and write IMMEDIATE_ACTIONS in that same language.
             - IMMEDIATE_ACTIONS must be short, clear, and actionable (no long paragraphs).
@@ -49,28 +77,66 @@ class AbuseDetector:
             
             If no abusive content is detected, set RISK_LEVEL to LOW and explain.
 
-            """      
-            
-            response = model.generate_content(prompt)
-            return self._parse_response(response.text)
-            
-        except Exception as e:
-            print(f"AI analysis error: {e}")
-            return self._fallback_analysis(text)
-    
-    def analyze_image(self, image_file):
-        """Analyze image directly using Gemini Vision"""
-        if not self.api_key:
-            return self._fallback_analysis("")
-        
-        try:
-            # Read image file
-            image_bytes = image_file.read()
-            
-            # Create the vision model
-            model = genai.GenerativeModel("gemini-2.5-flash")
+            """
+
+BATCH_PROMPT_HEAD = """
+            Analyze each of the following messages INDEPENDENTLY for digital abuse. Your task is to detect abusive or harmful behavior and provide a clear, structured safety report for every message.
+
+            Evaluate each message across these categories:
+            - Cyberbullying / Harassment
+            - Sexual Harassment
+            - Threats of Violence
+            - Hate Speech
+            - Coercion / Manipulation
+            - Stalking Behavior
+            - Sextortion Attempts
+
+            Each message is wrapped in <item id="N"> ... </item> tags.
+
+            MESSAGES TO ANALYZE:
+"""
+
+BATCH_FORMAT_LINES = """
+
+            RESPONSE FORMAT (must follow exactly, one block per item, in the same order):
+            ### ITEM N
+            RISK_LEVEL: [LOW | MEDIUM | HIGH | CRITICAL]
+            CATEGORY: [Primary identified category]
+            CONFIDENCE: [0-100]
+            EXPLANATION: [Short explanation of why the text is abusive or harmful]
+            IMMEDIATE_ACTIONS: Action 1, Action 2, Action 3, Action 4
+"""
+
+BATCH_FORMAT_JSON = """
+
+            RESPONSE FORMAT:
+            Respond with a JSON array holding one object per item, in the same order, with these fields:
+            item: the id from the item's tag
+            risk_level: LOW, MEDIUM, HIGH or CRITICAL
+            category: primary identified category
+            confidence: integer from 0 to 100
+            explanation: short explanation of why the message is abusive or harmful
+            immediate_actions: list of up to 4 short actions
+"""
+
+BATCH_PROMPT_RULES = """
+            RULES:
+            - Produce exactly one block for every item id, using the id from its tag.
+            - Always infer the language of each message and write its IMMEDIATE_ACTIONS in that same language.
+            - IMMEDIATE_ACTIONS must be short, clear, and actionable (no long paragraphs).
+            - Keep the explanation concise and focused on the harmful behavior detected.
+            - If multiple categories apply, choose the one with the strongest risk as the primary category.
             
-            prompt = """
+            If no abusive content is detected in a message, set its RISK_LEVEL to LOW and explain.
+
+            """
+
+TEXT_PROMPT_TAIL = TEXT_FORMAT_LINES + TEXT_PROMPT_RULES
+TEXT_PROMPT_TAIL_JSON = TEXT_FORMAT_JSON + TEXT_PROMPT_RULES
+BATCH_PROMPT_TAIL = BATCH_FORMAT_LINES + BATCH_PROMPT_RULES
+BATCH_PROMPT_TAIL_JSON = BATCH_FORMAT_JSON + BATCH_PROMPT_RULES
+
+IMAGE_PROMPT_HEAD = """
             Analyze this image for any digital abuse content. Look for:
             - Threatening messages or text
             - Harassing content
@@ -80,14 +146,27 @@ class AbuseDetector:
             - Stalking behavior indicators
             - Sextortion attempts
             
-            Provide response in this exact format:
+"""
+
+IMAGE_FORMAT_LINES = """            Provide response in this exact format:
             RISK_LEVEL: [LOW/MEDIUM/HIGH/CRITICAL]
             CATEGORY: [Primary category]
             CONFIDENCE: [0-100]
             EXPLANATION: [Brief explanation of what was found in the image]
             IMMEDIATE_ACTIONS: [Action 1], [Action 2], [Action 3], [Action 4]
             
-            RULES:
+"""
+
+IMAGE_FORMAT_JSON = """            Respond with one JSON object with these fields:
+            risk_level: LOW, MEDIUM, HIGH or CRITICAL
+            category: primary category
+            confidence: integer from 0 to 100
+            explanation: brief explanation of what was found in the image
+            immediate_actions: list of up to 4 short actions
+            
+"""
+
+IMAGE_PROMPT_RULES = """            RULES:
             - Always infer the language of the text and write IMMEDIATE_ACTIONS in that same language.
             - IMMEDIATE_ACTIONS must be short, clear, and actionable (no long paragraphs).
             - Keep the explanation concise and focused on the harmful behavior detected.
@@ -96,76 +175,912 @@ class AbuseDetector:
             If no abusive content is detected, set RISK_LEVEL to LOW and explain.
             
             """
+
+IMAGE_PROMPT = IMAGE_PROMPT_HEAD + IMAGE_FORMAT_LINES + IMAGE_PROMPT_RULES
+IMAGE_PROMPT_JSON = IMAGE_PROMPT_HEAD + IMAGE_FORMAT_JSON + IMAGE_PROMPT_RULES
+
+CONVERSATION_PROMPT_HEAD = """
+            You are monitoring an ongoing conversation for digital abuse. Give a verdict on the NEW MESSAGES only, but use the summary and the earlier messages as context: escalating patterns (repeated unwanted contact, grooming, threats building up over time) make new messages riskier.
+
+            Evaluate the new messages across these categories:
+            - Cyberbullying / Harassment
+            - Sexual Harassment
+            - Threats of Violence
+            - Hate Speech
+            - Coercion / Manipulation
+            - Stalking Behavior
+            - Sextortion Attempts
+
+            CONVERSATION SUMMARY SO FAR:
+            """
+
+CONVERSATION_PROMPT_CONTEXT = """
+
+            EARLIER MESSAGES (context only):
+"""
+
+CONVERSATION_PROMPT_NEW = """
+
+            NEW MESSAGES:
+"""
+
+CONVERSATION_FORMAT_LINES = """
+
+            RESPONSE FORMAT (must follow exactly):
+            RISK_LEVEL: [LOW | MEDIUM | HIGH | CRITICAL]
+            CATEGORY: [Primary identified category]
+            CONFIDENCE: [0-100]
+            EXPLANATION: [Short explanation of why the new messages are abusive or harmful]
+            IMMEDIATE_ACTIONS: Action 1, Action 2, Action 3, Action 4
+            SUMMARY: [Updated summary of the whole conversation, on one line]
+"""
+
+CONVERSATION_FORMAT_JSON = """
+
+            RESPONSE FORMAT:
+            Respond with one JSON object with these fields:
+            risk_level: LOW, MEDIUM, HIGH or CRITICAL
+            category: primary identified category
+            confidence: integer from 0 to 100
+            explanation: short explanation of why the new messages are abusive or harmful
+            immediate_actions: list of up to 4 short actions
+            summary: updated summary of the whole conversation
+"""
+
+CONVERSATION_PROMPT_RULES = """
+            RULES:
+            - Always infer the language of the messages and write IMMEDIATE_ACTIONS in that same language.
+            - IMMEDIATE_ACTIONS must be short, clear, and actionable (no long paragraphs).
+            - Keep the explanation concise and focused on the harmful behavior detected.
+            - If multiple categories apply, choose the one with the strongest risk as the primary category.
+            - The summary replaces the previous one: at most 3 sentences, keeping only what matters for judging future messages (who is involved, threats, demands, patterns).
+
+            If no abusive content is detected in the new messages, set RISK_LEVEL to LOW and explain.
+
+            """
+
+CONVERSATION_SUMMARY_LINE = re.compile(r"^\s*SUMMARY:\s*(.*)$", re.MULTILINE)
+
+BATCH_ITEM_MARKER = re.compile(r"^[\s#*]*ITEM\s+(\d+)[\s#*:]*$", re.MULTILINE)
+# Opening or closing item tags inside a message, which could fake another item
+BATCH_ITEM_TAG = re.compile(r"<(?=\s*/?\s*item\b)", re.IGNORECASE)
+
+# Rough allowance for the tags and the per-item answer block
+BATCH_ITEM_OVERHEAD_TOKENS = 80
+# What Gemini bills for one (small) image part
+IMAGE_TOKENS = 258
+
+
+def _estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token) used for batch packing"""
+    return len(text) // 4 + 1
+
+
+def _estimate_prompt_tokens(contents):
+    if isinstance(contents, str):
+        return _estimate_tokens(contents)
+    return sum(_estimate_tokens(part) if isinstance(part, str) else IMAGE_TOKENS for part in contents)
+
+
+def _extra_tokens(response, estimated):
+    """Tokens the call really used beyond the prompt estimate, when reported"""
+    usage = getattr(response, "usage_metadata", None)
+    total = getattr(usage, "total_token_count", None)
+    return total - estimated if total else 0
+
+
+# One semaphore per event loop: asyncio primitives cannot be shared across loops
+_upstream_semaphores = weakref.WeakKeyDictionary()
+
+
+def _upstream_slot():
+    """
+    Limit the number of in-flight async Gemini calls in this process
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = _upstream_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = asyncio.Semaphore(settings.GEMINI_MAX_CONCURRENT_REQUESTS)
+        _upstream_semaphores[loop] = semaphore
+    return semaphore
+
+
+_credentials = CredentialPool.from_keys(
+    settings.GEMINI_API_KEYS or [key for key in [settings.GEMINI_API_KEY] if key],
+    cooldown=settings.GEMINI_KEY_COOLDOWN,
+    max_cooldown=settings.GEMINI_KEY_MAX_COOLDOWN,
+    rpm_limit=settings.GEMINI_KEY_RPM_LIMIT,
+    tpm_limit=settings.GEMINI_KEY_TPM_LIMIT,
+)
+_breaker = CircuitBreaker(
+    failure_threshold=settings.GEMINI_BREAKER_FAILURE_THRESHOLD,
+    reset_timeout=settings.GEMINI_BREAKER_RESET_TIMEOUT,
+)
+_latency = LatencyTracker()
+_router = ModelRouter()
+_hedge_pool = ThreadPoolExecutor(
+    max_workers=settings.GEMINI_HEDGE_MAX_WORKERS,
+    thread_name_prefix="gemini-hedge",
+)
+# Chunks of one long text are analyzed concurrently, bounded per process
+_chunk_pool = ThreadPoolExecutor(
+    max_workers=settings.LONG_TEXT_MAX_WORKERS,
+    thread_name_prefix="gemini-chunk",
+)
+_hedge_lock = threading.Lock()
+_hedge_stats = {"hedged_calls": 0, "hedge_wins": 0}
+
+
+def _hedge_delay():
+    """Seconds to wait before hedging, or None when hedging is off or unwarmed"""
+    if not settings.GEMINI_HEDGE_ENABLED:
+        return None
+    return _latency.percentile(settings.GEMINI_HEDGE_PERCENTILE)
+
+
+def _count_hedge(stat):
+    with _hedge_lock:
+        _hedge_stats[stat] += 1
+
+
+def _record_upstream_error(error):
+    if isinstance(error, CredentialsExhausted):
+        # Our own key budgets ran out; upstream was never asked
+        _breaker.release()
+    elif is_upstream_failure(error):
+        _breaker.record_failure()
+    else:
+        # Upstream answered; the request itself was bad
+        _breaker.record_success()
+
+
+def upstream_stats():
+    """Breaker state, latency, hedging, API key health and model routing for this process"""
+    with _hedge_lock:
+        hedging = dict(_hedge_stats)
+    return {
+        "circuit_breaker": _breaker.stats(),
+        "latency_seconds": _latency.stats(),
+        "hedging": hedging,
+        "api_keys": _credentials.stats(),
+        "routing": _router.stats(),
+    }
+
+
+_detector = None
+_detector_pid = None
+_detector_lock = threading.Lock()
+
+
+def get_detector():
+    """
+    Process-wide AbuseDetector shared by every request and thread, so the
+    client is configured and models are built once per worker
+    """
+    global _detector, _detector_pid
+    
+    # gRPC channels do not survive fork; a forked worker builds its own
+    if _detector is None or _detector_pid != os.getpid():
+        with _detector_lock:
+            if _detector is None or _detector_pid != os.getpid():
+                _detector = AbuseDetector()
+                _detector_pid = os.getpid()
+    return _detector
+
+
+class AbuseDetector:
+    def __init__(self):
+        self.api_key = _credentials.credentials[0].api_key if len(_credentials) else None
+        if self.api_key:
+            genai.configure(api_key=self.api_key)
+        else:
+            logger.warning("GEMINI_API_KEY is not set. AI detection will not work.")
+        
+        # One client per API key, shared by every model on that key
+        self._clients = {}
+        self._models = {}
+        self._models_lock = threading.Lock()
+        # grpc.aio channels are bound to the event loop they were created on
+        self._async_models = weakref.WeakKeyDictionary()
+    
+    def _model(self, model_name, credential):
+        key = (credential.name, model_name)
+        model = self._models.get(key)
+        if model is None:
+            with self._models_lock:
+                model = self._models.get(key)
+                if model is None:
+                    client = self._clients.get(credential.name)
+                    if client is None:
+                        client = glm.GenerativeServiceClient(client_options={"api_key": credential.api_key})
+                        self._clients[credential.name] = client
+                    model = genai.GenerativeModel(model_name)
+                    model._client = client
+                    self._models[key] = model
+        return model
+    
+    def _async_model(self, model_name, credential):
+        loop_models = self._async_models.setdefault(asyncio.get_running_loop(), {})
+        model = loop_models.get((credential.name, model_name))
+        if model is None:
+            client = loop_models.get(credential.name)
+            if client is None:
+                client = glm.GenerativeServiceAsyncClient(client_options={"api_key": credential.api_key})
+                loop_models[credential.name] = client
+            model = genai.GenerativeModel(model_name)
+            model._async_client = client
+            loop_models[credential.name, model_name] = model
+        return model
+    
+    def warm_up(self):
+        """Open the upstream channel of every API key now instead of on the first request"""
+        for credential in _credentials.credentials:
+            try:
+                self._model(settings.GEMINI_MODEL, credential).count_tokens("warm-up")
+                logger.info("Gemini client warmed up (%s)", credential.name)
+            except Exception as e:
+                logger.warning("Warm-up error (%s): %s", credential.name, e)
+    
+    def analyze_text(self, text, language="en"):
+        triaged = self._triage(text)
+        if triaged:
+            return triaged
+        
+        if not self.api_key:
+            return self._fallback_analysis(text, language)
+        
+        try:
+            route = self._route_text(text, language)
+            result = self._escalated(
+                route,
+                self._text_answer(route, text),
+                lambda escalation: self._text_answer(escalation, text),
+            )
+            self._record_verdicts([text], [result], language)
+            return result
+            
+        except Exception as e:
+            logger.warning("AI analysis error: %s", e)
+            return self._fallback_analysis(text, language)
+    
+    def _text_answer(self, route, text):
+        structured = settings.GEMINI_STRUCTURED_OUTPUT
+        response = self._generate(
+            route,
+            self._build_text_prompt(text, structured),
+            self._generation_config(structured_output.ANALYSIS_RESPONSE_SCHEMA, structured),
+        )
+        return self._parse_answer(response.text, structured)
+    
+    async def _text_answer_async(self, route, text):
+        structured = settings.GEMINI_STRUCTURED_OUTPUT
+        response = await self._generate_async(
+            route,
+            self._build_text_prompt(text, structured),
+            self._generation_config(structured_output.ANALYSIS_RESPONSE_SCHEMA, structured),
+        )
+        return self._parse_answer(response.text, structured)
+    
+    def _route_text(self, text, language):
+        """Model route for a text, pre-scored with the lexicon when routing is on"""
+        pre_score = None
+        if settings.GEMINI_ROUTING_ENABLED and text:
+            matches = get_lexicon(language).match(text)
+            pre_score = matches[0][0]["risk_level"] if matches else None
+        return _router.route(text, pre_score=pre_score)
+    
+    def _escalated(self, route, result, answer):
+        """
+        Re-run answer(route) one tier up when the router finds result too
+        uncertain for its risk; the first result stands if that call fails
+        """
+        escalation = _router.escalate(route, result)
+        if escalation is None:
+            return result
+        try:
+            return answer(escalation)
+        except Exception as e:
+            logger.warning("Escalation to %s failed: %s", escalation.model, e)
+            return result
+    
+    async def _escalated_async(self, route, result, answer):
+        """Async counterpart of _escalated; answer returns an awaitable"""
+        escalation = _router.escalate(route, result)
+        if escalation is None:
+            return result
+        try:
+            return await answer(escalation)
+        except Exception as e:
+            logger.warning("Escalation to %s failed: %s", escalation.model, e)
+            return result
+    
+    async def analyze_text_async(self, text, language="en"):
+        """Async variant of analyze_text for ASGI views"""
+        triaged = self._triage(text)
+        if triaged:
+            return triaged
+        
+        if not self.api_key:
+            return self._fallback_analysis(text, language)
+        
+        try:
+            route = self._route_text(text, language)
+            result = await self._escalated_async(
+                route,
+                await self._text_answer_async(route, text),
+                lambda escalation: self._text_answer_async(escalation, text),
+            )
+            await sync_to_async(self._record_verdicts)([text], [result], language)
+            return result
+            
+        except Exception as e:
+            logger.warning("AI analysis error: %s", e)
+            return self._fallback_analysis(text, language)
+    
+    def stream_text(self, text, language="en"):
+        """
+        Analyze text with a streaming model call, yielding (field, value) as
+        each line of the answer arrives and finally ("result", result).
+        Fields already sent cannot be taken back, so streams are not escalated.
+        """
+        triaged = self._triage(text)
+        if triaged or not self.api_key:
+            result = triaged or self._fallback_analysis(text, language)
+            yield from result.items()
+            yield "result", result
+            return
+        
+        result = self._empty_result()
+        emitted = set()
+        try:
+            pending = ""
+            route = self._route_text(text, language)
+            for chunk in self._generate_stream(route, self._build_text_prompt(text)):
+                pending += chunk
+                *lines, pending = pending.split("\n")
+                for line in lines:
+                    field = self._parse_line(line, result)
+                    if field:
+                        emitted.add(field)
+                        yield field, result[field]
             
-            # Prepare image for Gemini
-            image_part = {
-                "mime_type": image_file.content_type,
-                "data": image_bytes
-            }
+            field = self._parse_line(pending, result)
+            if field:
+                emitted.add(field)
+                yield field, result[field]
             
-            response = model.generate_content([prompt, image_part])
-            return self._parse_response(response.text)
+            if not result['immediate_actions'] or all(action == '' for action in result['immediate_actions']):
+                result['immediate_actions'] = self._get_fallback_actions(result['risk_level'])
+                yield 'immediate_actions', result['immediate_actions']
+            self._count_model_verdict(result)
+            if 'risk_level' in emitted:
+                self._record_verdicts([text], [result], language)
+        
+        except Exception as e:
+            logger.warning("AI analysis error: %s", e)
+            # Replace whatever was streamed so far with the fallback verdict
+            result = self._fallback_analysis(text, language)
+            yield from result.items()
+        
+        yield "result", result
+    
+    def analyze_text_batch(self, texts, language="en"):
+        """
+        Analyze many texts, packing as many as the token budget allows into
+        each model call (texts routed to the same model tier share calls).
+        Results are returned in the same order as texts.
+        """
+        results = [self._triage(text) for text in texts]
+        pending = [index for index, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+        
+        if not self.api_key:
+            return [result or self._fallback_analysis(text, language) for text, result in zip(texts, results)]
+        
+        structured = settings.GEMINI_STRUCTURED_OUTPUT
+        routes = {index: self._route_text(texts[index], language) for index in pending}
+        tiers = {}
+        for index in pending:
+            tiers.setdefault(routes[index].tier, []).append(index)
+        
+        for indexes in tiers.values():
+            for batch in self._pack_batches(texts, indexes):
+                try:
+                    response = self._generate(
+                        routes[batch[0]],
+                        self._build_batch_prompt(batch, texts, structured),
+                        self._generation_config(structured_output.BATCH_RESPONSE_SCHEMA, structured),
+                    )
+                    parsed = self._parse_batch_answer(response.text, structured)
+                    parsed = {index: parsed[index] for index in batch if index in parsed}
+                except Exception as e:
+                    logger.warning("Batch analysis error: %s", e)
+                    parsed = {}
+                
+                for index in batch:
+                    results[index] = parsed.get(index)
+                    if index in parsed:
+                        self._count_model_verdict(parsed[index])
+                        # Uncertain items leave the batch for a call one tier up
+                        results[index] = self._escalated(
+                            routes[index],
+                            parsed[index],
+                            lambda escalation, text=texts[index]: self._text_answer(escalation, text),
+                        )
+                self._record_verdicts(
+                    [texts[index] for index in parsed],
+                    [results[index] for index in parsed],
+                    language,
+                )
+        
+        # Items the model skipped or mangled get a dedicated call
+        for index, result in enumerate(results):
+            if result is None:
+                results[index] = self.analyze_text(texts[index], language)
+        
+        return results
+    
+    def analyze_text_chunks(self, chunks, language="en"):
+        """Analyze the chunks of one long text in parallel, in chunk order"""
+        return list(_chunk_pool.map(lambda chunk: self.analyze_text(chunk, language), chunks))
+    
+    def analyze_conversation(self, summary, earlier_messages, new_messages, language="en"):
+        """
+        Verdict for the new messages of a conversation, judged in the context
+        of a rolling summary and the last few earlier messages. The result
+        carries an updated "summary" to send with the next messages.
+        """
+        if not self.api_key:
+            result = self._fallback_analysis("\n".join(new_messages), language)
+            result["summary"] = summary
+            return result
+        
+        try:
+            route = self._route_text("\n".join(new_messages), language)
+            return self._escalated(
+                route,
+                self._conversation_answer(route, summary, earlier_messages, new_messages),
+                lambda escalation: self._conversation_answer(escalation, summary, earlier_messages, new_messages),
+            )
             
         except Exception as e:
-            print(f"Image analysis error: {e}")
-            return self._fallback_analysis("")
+            logger.warning("Conversation analysis error: %s", e)
+            result = self._fallback_analysis("\n".join(new_messages), language)
+            result["summary"] = summary
+            return result
     
-    def _parse_response(self, response_text):
+    def _conversation_answer(self, route, summary, earlier_messages, new_messages):
+        structured = settings.GEMINI_STRUCTURED_OUTPUT
+        response = self._generate(
+            route,
+            self._build_conversation_prompt(summary, earlier_messages, new_messages, structured),
+            self._generation_config(structured_output.CONVERSATION_RESPONSE_SCHEMA, structured),
+        )
+        with metrics.timed("parse_response"):
+            result = None
+            if structured:
+                result = structured_output.parse_analysis(
+                    response.text, structured_output.ConversationAnalysisResult
+                )
+            if result is None:
+                result = self._parse_response(response.text)
+                match = CONVERSATION_SUMMARY_LINE.search(response.text)
+                result["summary"] = match.group(1).strip() if match else summary
+        self._count_model_verdict(result)
+        return result
+    
+    @metrics.timed("prompt_build")
+    def _build_conversation_prompt(self, summary, earlier_messages, new_messages, structured=False):
+        return "".join((
+            CONVERSATION_PROMPT_HEAD,
+            summary or "(none yet)",
+            CONVERSATION_PROMPT_CONTEXT,
+            "\n".join(earlier_messages) or "(none)",
+            CONVERSATION_PROMPT_NEW,
+            "\n".join(new_messages),
+            CONVERSATION_FORMAT_JSON if structured else CONVERSATION_FORMAT_LINES,
+            CONVERSATION_PROMPT_RULES,
+        ))
+    
+    def _pack_batches(self, texts, indexes):
+        """Group text indexes so each group fits the per-call token budget"""
+        batches = []
+        current = []
+        current_tokens = 0
+        
+        for index in indexes:
+            tokens = _estimate_tokens(texts[index]) + BATCH_ITEM_OVERHEAD_TOKENS
+            if current and (
+                current_tokens + tokens > settings.BATCH_TOKEN_BUDGET
+                or len(current) >= settings.BATCH_MAX_ITEMS_PER_CALL
+            ):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(index)
+            current_tokens += tokens
+        
+        if current:
+            batches.append(current)
+        return batches
+    
+    def _generate(self, route, contents, generation_config=None):
+        """
+        Call the model of route through the circuit breaker, within the
+        per-request deadline, hedging the call if it runs slower than usual
+        """
+        if not _breaker.allow():
+            raise CircuitOpenError("Gemini circuit breaker is open")
+        
+        deadline = Deadline(settings.GEMINI_REQUEST_DEADLINE)
+        started = time.monotonic()
+        try:
+            with metrics.timed("model_call"):
+                response = self._hedged_call(
+                    lambda: self._keyed_call(
+                        contents,
+                        lambda credential: self._model(route.model, credential).generate_content(
+                            contents,
+                            generation_config=generation_config,
+                            request_options={"timeout": deadline.remaining()},
+                        ),
+                    ),
+                    deadline,
+                )
+        except Exception as e:
+            _record_upstream_error(e)
+            raise
+        except BaseException:
+            _breaker.release()
+            raise
+        
+        _breaker.record_success()
+        _latency.record(time.monotonic() - started)
+        _router.record(route, time.monotonic() - started)
+        return response
+    
+    async def _generate_async(self, route, contents, generation_config=None):
+        """Async counterpart of _generate, bounded by the in-flight limit"""
+        if not _breaker.allow():
+            raise CircuitOpenError("Gemini circuit breaker is open")
+        
+        deadline = Deadline(settings.GEMINI_REQUEST_DEADLINE)
+        try:
+            async with _upstream_slot():
+                started = time.monotonic()
+                with metrics.timed("model_call"):
+                    response = await self._hedged_call_async(
+                        lambda: self._keyed_call_async(
+                            contents,
+                            lambda credential: self._async_model(route.model, credential).generate_content_async(
+                                contents,
+                                generation_config=generation_config,
+                                request_options={"timeout": deadline.remaining()},
+                            ),
+                        ),
+                        deadline,
+                    )
+        except Exception as e:
+            _record_upstream_error(e)
+            raise
+        except BaseException:
+            _breaker.release()
+            raise
+        
+        _breaker.record_success()
+        _latency.record(time.monotonic() - started)
+        _router.record(route, time.monotonic() - started)
+        return response
+    
+    def _generate_stream(self, route, contents):
+        """
+        Streaming counterpart of _generate: yields answer text as it arrives.
+        Streams are not hedged nor moved to another API key once started;
+        the deadline bounds the whole stream.
+        """
+        if not _breaker.allow():
+            raise CircuitOpenError("Gemini circuit breaker is open")
+        
+        deadline = Deadline(settings.GEMINI_REQUEST_DEADLINE)
+        started = time.monotonic()
+        credential = None
         try:
+            credential = _credentials.acquire(_estimate_prompt_tokens(contents))
+            response = self._model(route.model, credential).generate_content(
+                contents,
+                stream=True,
+                request_options={"timeout": deadline.remaining()},
+            )
+            for chunk in response:
+                deadline.remaining()
+                yield chunk.text
+        except Exception as e:
+            if credential is not None:
+                _credentials.record_error(credential, e)
+            _record_upstream_error(e)
+            raise
+        except BaseException:
+            # Client went away mid-stream (GeneratorExit)
+            _breaker.release()
+            raise
+        
+        _credentials.record_success(credential)
+        _breaker.record_success()
+        _latency.record(time.monotonic() - started)
+        _router.record(route, time.monotonic() - started)
+        metrics.record_stage("model_call", time.monotonic() - started)
+    
+    def _keyed_call(self, contents, request):
+        """
+        Run request(credential) on the next API key in the pool. A key that
+        answers with a quota error is cooled down and the call moves on to
+        another key.
+        """
+        estimated = _estimate_prompt_tokens(contents)
+        tried = []
+        quota_error = None
+        while True:
+            try:
+                credential = _credentials.acquire(estimated, exclude=tried)
+            except CredentialsExhausted:
+                # No other key to retry on: report the upstream quota error
+                if quota_error is None:
+                    raise
+                raise quota_error
+            try:
+                response = request(credential)
+            except Exception as e:
+                _credentials.record_error(credential, e)
+                tried.append(credential)
+                if is_quota_error(e) and len(tried) < len(_credentials):
+                    quota_error = e
+                    continue
+                raise
+            _credentials.record_success(credential, _extra_tokens(response, estimated))
+            return response
+    
+    async def _keyed_call_async(self, contents, request):
+        """Async counterpart of _keyed_call; request returns an awaitable"""
+        estimated = _estimate_prompt_tokens(contents)
+        tried = []
+        quota_error = None
+        while True:
+            try:
+                credential = _credentials.acquire(estimated, exclude=tried)
+            except CredentialsExhausted:
+                # No other key to retry on: report the upstream quota error
+                if quota_error is None:
+                    raise
+                raise quota_error
+            try:
+                response = await request(credential)
+            except Exception as e:
+                _credentials.record_error(credential, e)
+                tried.append(credential)
+                if is_quota_error(e) and len(tried) < len(_credentials):
+                    quota_error = e
+                    continue
+                raise
+            _credentials.record_success(credential, _extra_tokens(response, estimated))
+            return response
+    
+    def _hedged_call(self, call, deadline):
+        """
+        Run call(); if it has not answered by the usual tail latency, fire a
+        second identical call and take whichever succeeds first
+        """
+        hedge_after = _hedge_delay()
+        if hedge_after is None:
+            return call()
+        
+        first = _hedge_pool.submit(call)
+        done, _ = wait([first], timeout=min(hedge_after, deadline.remaining()))
+        if done:
+            return first.result()
+        
+        _count_hedge("hedged_calls")
+        attempts = [first, _hedge_pool.submit(call)]
+        error = None
+        while attempts:
+            done, pending = wait(attempts, timeout=deadline.remaining(), return_when=FIRST_COMPLETED)
+            if not done:
+                raise DeadlineExceeded("Request deadline exceeded")
+            for attempt in done:
+                if attempt.exception() is None:
+                    if attempt is not first:
+                        _count_hedge("hedge_wins")
+                    return attempt.result()
+                error = attempt.exception()
+            attempts = list(pending)
+        raise error
+    
+    async def _hedged_call_async(self, call, deadline):
+        """Async counterpart of _hedged_call; the losing attempt is cancelled"""
+        hedge_after = _hedge_delay()
+        if hedge_after is None:
+            return await asyncio.wait_for(call(), deadline.remaining())
+        
+        first = asyncio.ensure_future(call())
+        attempts = {first}
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=min(hedge_after, deadline.remaining()))
+            if not done:
+                _count_hedge("hedged_calls")
+                attempts.add(asyncio.ensure_future(call()))
             
+            error = None
+            while attempts:
+                done, attempts = await asyncio.wait(
+                    attempts, timeout=deadline.remaining(), return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    raise DeadlineExceeded("Request deadline exceeded")
+                for attempt in done:
+                    if attempt.exception() is None:
+                        if attempt is not first:
+                            _count_hedge("hedge_wins")
+                        return attempt.result()
+                    error = attempt.exception()
+            raise error
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+    
+    def _triage(self, text):
+        """Answer locally when the triage model is confident, else None"""
+        classifier = get_triage_classifier()
+        if classifier is None or not text:
+            return None
+        
+        verdict = classifier.triage(text)
+        if verdict is None:
+            return None
+        verdict["immediate_actions"] = self._get_fallback_actions(verdict["risk_level"])
+        metrics.VERDICTS.inc("triage")
+        return verdict
+    
+    def _record_verdicts(self, texts, results, language):
+        """Keep Gemini text verdicts as training data for the triage model"""
+        if not settings.TRIAGE_RECORD_VERDICTS:
+            return
+        
+        try:
+            AnalysisVerdict.objects.bulk_create([
+                AnalysisVerdict(
+                    text=text,
+                    language=language,
+                    risk_level=result["risk_level"],
+                    category=result["category"][:100],
+                    confidence=max(0, min(100, result["confidence"])),
+                )
+                for text, result in zip(texts, results)
+                if result["risk_level"] in RISK_LEVELS
+            ])
+        except Exception as e:
+            logger.warning("Verdict recording error: %s", e)
+    
+    @metrics.timed("prompt_build")
+    def _build_batch_prompt(self, batch, texts, structured=False):
+        items = "\n".join(
+            f'<item id="{index}">\n{BATCH_ITEM_TAG.sub("&lt;", texts[index])}\n</item>'
+            for index in batch
+        )
+        tail = BATCH_PROMPT_TAIL_JSON if structured else BATCH_PROMPT_TAIL
+        return "".join((BATCH_PROMPT_HEAD, items, tail))
+    
+    @metrics.timed("parse_response")
+    def _parse_batch_answer(self, response_text, structured):
+        """Validate a JSON batch answer, falling back to the ITEM marker parser"""
+        if structured:
+            parsed = structured_output.parse_batch(response_text)
+            if parsed is not None:
+                return parsed
+        return self._parse_batch_response(response_text)
+    
+    def _parse_batch_response(self, response_text):
+        """Split a batch answer on its ITEM markers and parse every block"""
+        parsed = {}
+        parts = BATCH_ITEM_MARKER.split(response_text)
+        
+        # parts = [preamble, id, block, id, block, ...]
+        for item_id, block in zip(parts[1::2], parts[2::2]):
+            if "RISK_LEVEL:" not in block:
+                continue
+            parsed[int(item_id)] = self._parse_response(block)
+        return parsed
+    
+    def analyze_image(self, image_bytes, mime_type):
+        """Analyze image directly using Gemini Vision"""
+        if not self.api_key:
+            return self._fallback_analysis("")
+        
+        try:
+            route = _router.route(image=True)
+            return self._escalated(
+                route,
+                self._image_answer(route, image_bytes, mime_type),
+                lambda escalation: self._image_answer(escalation, image_bytes, mime_type),
+            )
+            
+        except Exception as e:
+            logger.warning("Image analysis error: %s", e)
+            return self._fallback_analysis("")
+    
+    async def analyze_image_async(self, image_bytes, mime_type):
+        """Async variant of analyze_image for ASGI views"""
+        if not self.api_key:
+            return self._fallback_analysis("")
+        
+        try:
+            route = _router.route(image=True)
+            return await self._escalated_async(
+                route,
+                await self._image_answer_async(route, image_bytes, mime_type),
+                lambda escalation: self._image_answer_async(escalation, image_bytes, mime_type),
+            )
             
-            lines = response_text.split('\n')
-            result = {
-                "risk_level": "UNKNOWN",
-                "category": "Unknown",
-                "confidence": 0,
-                "explanation": "Analysis unavailable",
-                "immediate_actions": [
-                    "Document all messages and evidence",
-                    "Block the sender immediately", 
-                    "Report to platform authorities",
-                    "Contact local support services"
-                ],
-            }        
+        except Exception as e:
+            logger.warning("Image analysis error: %s", e)
+            return self._fallback_analysis("")
+    
+    def _image_answer(self, route, image_bytes, mime_type):
+        # Prepare image for Gemini
+        image_part = {
+            "mime_type": mime_type,
+            "data": image_bytes
+        }
+        
+        structured = settings.GEMINI_STRUCTURED_OUTPUT
+        response = self._generate(route,
+            [IMAGE_PROMPT_JSON if structured else IMAGE_PROMPT, image_part],
+            self._generation_config(structured_output.ANALYSIS_RESPONSE_SCHEMA, structured),
+        )
+        return self._parse_answer(response.text, structured)
+    
+    async def _image_answer_async(self, route, image_bytes, mime_type):
+        image_part = {
+            "mime_type": mime_type,
+            "data": image_bytes
+        }
+        
+        structured = settings.GEMINI_STRUCTURED_OUTPUT
+        response = await self._generate_async(route,
+            [IMAGE_PROMPT_JSON if structured else IMAGE_PROMPT, image_part],
+            self._generation_config(structured_output.ANALYSIS_RESPONSE_SCHEMA, structured),
+        )
+        return self._parse_answer(response.text, structured)
+    
+    @metrics.timed("prompt_build")
+    def _build_text_prompt(self, text, structured=False):
+        tail = TEXT_PROMPT_TAIL_JSON if structured else TEXT_PROMPT_TAIL
+        return "".join((TEXT_PROMPT_HEAD, text, tail))
+    
+    def _generation_config(self, schema, structured):
+        return structured_output.generation_config(schema) if structured else None
+    
+    def _parse_answer(self, response_text, structured):
+        """Validate a JSON answer, falling back to the line-based parser"""
+        with metrics.timed("parse_response"):
+            result = None
+            if structured:
+                result = structured_output.parse_analysis(response_text)
+            if result is None:
+                result = self._parse_response(response_text)
+        self._count_model_verdict(result)
+        return result
+    
+    def _count_model_verdict(self, result):
+        metrics.VERDICTS.inc("model")
+        # An answer without a usable risk level means the parse failed
+        metrics.PARSES.inc("ok" if result["risk_level"] in RISK_LEVELS else "failed")
+    
+    def _parse_response(self, response_text):
+        try:
+            result = self._empty_result()
             
-            for line in lines:
-                line = line.strip()
-                if line.startswith("RISK_LEVEL:"):
-                    result['risk_level'] = line.split(":", 1)[1].strip()
-                elif line.startswith("CATEGORY:"):
-                    result["category"] = line.split(":", 1)[1].strip()
-                elif line.startswith("CONFIDENCE:"):
-                    try:
-                        confidence_str = line.split(":", 1)[1].strip()
-                        result['confidence'] = int(confidence_str)
-                    except (ValueError, IndexError):
-                        result['confidence'] = 50
-                elif line.startswith("EXPLANATION:"):
-                    result['explanation'] = line.split(':', 1)[1].strip()
-                elif line.startswith('IMMEDIATE_ACTIONS:'):
-                    actions_text = line.split(':', 1)[1].strip()
-                    # Handle different action separators
-                    actions = []
-                    
-                    # Try comma-separated first
-                    if ',' in actions_text:
-                        actions = [action.strip() for action in actions_text.split(',') if action.strip()]
-                    # Try numbered actions (1. Action, 2. Action, etc.)
-                    elif any(char.isdigit() for char in actions_text):
-                        actions = re.split(r'\d+\.', actions_text)
-                        actions = [action.strip() for action in actions if action.strip()]
-                    # Fallback: split by any obvious delimiter
-                    else:
-                        actions = re.split(r'[,•\-]', actions_text)
-                        actions = [action.strip() for action in actions if action.strip()]
-                    
-                    # Filter out empty actions and ensure we have at least 3
-                    actions = [action for action in actions if action and action not in ['', '.']]
-                    
-                    if actions:
-                        result['immediate_actions'] = actions[:4]
-                    else:
-                        result['immediate_actions'] = self._get_fallback_actions(result.get('risk_level', 'UNKNOWN'))
+            for line in response_text.split('\n'):
+                self._parse_line(line, result)
             
             # Validate and ensure we have proper actions
             if not result['immediate_actions'] or all(action == '' for action in result['immediate_actions']):
@@ -174,9 +1089,72 @@ class AbuseDetector:
             return result
         
         except Exception as e:
-            print(f"Response parsing error: {e}")
+            logger.warning("Response parsing error: %s", e)
             return self._fallback_analysis("")
     
+    def _empty_result(self):
+        return {
+            "risk_level": "UNKNOWN",
+            "category": "Unknown",
+            "confidence": 0,
+            "explanation": "Analysis unavailable",
+            "immediate_actions": [
+                "Document all messages and evidence",
+                "Block the sender immediately", 
+                "Report to platform authorities",
+                "Contact local support services"
+            ],
+        }
+    
+    def _parse_line(self, line, result):
+        """
+        Apply one line of a model answer to result. Returns the result key it
+        set, or None if the line carries no field.
+        """
+        line = line.strip()
+        if line.startswith("RISK_LEVEL:"):
+            result['risk_level'] = line.split(":", 1)[1].strip()
+            return 'risk_level'
+        elif line.startswith("CATEGORY:"):
+            result["category"] = line.split(":", 1)[1].strip()
+            return 'category'
+        elif line.startswith("CONFIDENCE:"):
+            try:
+                confidence_str = line.split(":", 1)[1].strip()
+                result['confidence'] = int(confidence_str)
+            except (ValueError, IndexError):
+                result['confidence'] = 50
+            return 'confidence'
+        elif line.startswith("EXPLANATION:"):
+            result['explanation'] = line.split(':', 1)[1].strip()
+            return 'explanation'
+        elif line.startswith('IMMEDIATE_ACTIONS:'):
+            actions_text = line.split(':', 1)[1].strip()
+            # Handle different action separators
+            actions = []
+            
+            # Try comma-separated first
+            if ',' in actions_text:
+                actions = [action.strip() for action in actions_text.split(',') if action.strip()]
+            # Try numbered actions (1. Action, 2. Action, etc.)
+            elif any(char.isdigit() for char in actions_text):
+                actions = re.split(r'\d+\.', actions_text)
+                actions = [action.strip() for action in actions if action.strip()]
+            # Fallback: split by any obvious delimiter
+            else:
+                actions = re.split(r'[,•\-]', actions_text)
+                actions = [action.strip() for action in actions if action.strip()]
+            
+            # Filter out empty actions and ensure we have at least 3
+            actions = [action for action in actions if action and action not in ['', '.']]
+            
+            if actions:
+                result['immediate_actions'] = actions[:4]
+            else:
+                result['immediate_actions'] = self._get_fallback_actions(result.get('risk_level', 'UNKNOWN'))
+            return 'immediate_actions'
+        return None
+    
     def _get_fallback_actions(self, risk_level):
         """Provide fallback actions based on risk level"""
         base_actions = [
@@ -200,29 +1178,21 @@ class AbuseDetector:
         
         return base_actions[:4]
         
-    def _fallback_analysis(self, text):
-        text_lower = text.lower() if text else ""
-        
-        high_risk_keywords = ["kill you", "hurt you", "rape", "die", "suicide", "murder", "harm you"]
-        medium_risk_keywords = ["ugly", "stupid", "fat", "worthless", "nobody likes you", "hate you"]
-        sexual_keywords = ["nude", "naked", "sex", "body", "private", "sleep with"]
-        
+    def _fallback_analysis(self, text, language="en"):
+        metrics.VERDICTS.inc("fallback")
         risk_level = "LOW"
         category = "Unknown"
         confidence = 30
         
-        if any(keyword in text_lower for keyword in high_risk_keywords):
-            risk_level = "HIGH"
-            category = 'Threats of Violence'
-            confidence = 85
-        elif any(keyword in text_lower for keyword in sexual_keywords):
-            risk_level = 'MEDIUM'
-            category = 'Sexual Harassment'
-            confidence = 70
-        elif any(keyword in text_lower for keyword in medium_risk_keywords):
-            risk_level = 'MEDIUM'
-            category = 'Cyberbullying'
-            confidence = 65
+        # Categories come back in priority order; the first one that fired wins
+        matches = get_lexicon(language).match(text) if text else []
+        if matches:
+            matched_category, score, _ = matches[0]
+            risk_level = matched_category["risk_level"]
+            category = matched_category["name"]
+            threshold = matched_category.get("threshold", 1.0)
+            # Extra evidence beyond the threshold raises confidence a little
+            confidence = min(95, matched_category["confidence"] + int(5 * (score - threshold)))
             
         return {
             'risk_level': risk_level,
@@ -0,0 +1,122 @@
+import time
+import uuid
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .report import RISK_ORDER, risk_rank
+
+VERDICT_FIELDS = ("risk_level", "category", "confidence", "explanation", "immediate_actions")
+
+
+class SessionBusy(Exception):
+    """Raised when another request is still updating the same session"""
+
+
+def _store():
+    return caches[settings.CONVERSATION_CACHE_ALIAS]
+
+
+def _key(session_id):
+    return f"conversation_{session_id}"
+
+
+def create_session(language):
+    now = time.time()
+    session = {
+        "session_id": uuid.uuid4().hex,
+        "language": language,
+        "created_at": now,
+        "updated_at": now,
+        "message_count": 0,
+        "summary": "",
+        "recent_messages": [],
+        "verdict": None,
+        "evidence": [],
+    }
+    save_session(session)
+    return session
+
+
+def load_session(session_id):
+    return _store().get(_key(session_id))
+
+
+def save_session(session):
+    # Every save restarts the idle timer; idle sessions simply expire
+    _store().set(_key(session["session_id"]), session, settings.CONVERSATION_IDLE_TIMEOUT)
+
+
+def delete_session(session_id):
+    return _store().delete(_key(session_id))
+
+
+@contextmanager
+def session_lock(session_id):
+    """
+    Serialize updates to one session across threads and worker processes.
+    The lock expires on its own in case its holder dies mid-update; each
+    holder only ever releases its own lock, never one taken after it expired.
+    """
+    lock_key = f"{_key(session_id)}_lock"
+    token = uuid.uuid4().hex
+    store = _store()
+    give_up_at = time.monotonic() + settings.CONVERSATION_LOCK_WAIT
+    while not store.add(lock_key, token, settings.CONVERSATION_LOCK_TIMEOUT):
+        if time.monotonic() >= give_up_at:
+            raise SessionBusy(f"Session {session_id} is being updated")
+        time.sleep(0.05)
+    try:
+        yield
+    finally:
+        _release(store, lock_key, token)
+
+
+def _release(store, lock_key, token):
+    if hasattr(store, "delete_if_equal"):
+        store.delete_if_equal(lock_key, token)
+    elif store.get(lock_key) == token:
+        # Backends without compare-and-delete leave a tiny race window
+        store.delete(lock_key)
+
+
+def apply_verdict(session, new_messages, result):
+    """
+    Fold the verdict for new_messages into the session. Only a bounded tail
+    of messages, a capped summary and the last few flagged updates are
+    kept, so a session's size does not grow with the conversation.
+    Returns the verdict for the new messages.
+    """
+    first = session["message_count"]
+    session["message_count"] += len(new_messages)
+    session["updated_at"] = time.time()
+
+    max_chars = settings.CONVERSATION_MESSAGE_MAX_CHARS
+    recent = session["recent_messages"] + [message[:max_chars] for message in new_messages]
+    session["recent_messages"] = recent[-settings.CONVERSATION_CONTEXT_MESSAGES:]
+    session["summary"] = (result.get("summary") or session["summary"])[:settings.CONVERSATION_SUMMARY_MAX_CHARS]
+
+    update = {field: result[field] for field in VERDICT_FIELDS}
+    update["messages"] = [first, session["message_count"] - 1]
+
+    if RISK_ORDER.get(update["risk_level"], -1) > RISK_ORDER["LOW"]:
+        session["evidence"].append(update)
+        session["evidence"] = session["evidence"][-settings.CONVERSATION_MAX_EVIDENCE:]
+
+    # Highest risk seen so far is the session's verdict
+    if session["verdict"] is None or risk_rank(update) >= risk_rank(session["verdict"]):
+        session["verdict"] = update
+    return update
+
+
+def public_view(session):
+    """Session state as returned by the API (without the stored context)"""
+    return {
+        "session_id": session["session_id"],
+        "language": session["language"],
+        "message_count": session["message_count"],
+        "summary": session["summary"],
+        "verdict": session["verdict"],
+        "evidence": session["evidence"],
+    }
@@ -0,0 +1,175 @@
+import threading
+import time
+
+from google.api_core import exceptions as google_exceptions
+
+from . import metrics
+
+KEY_CALLS = metrics.Counter(
+    "safeguard_gemini_key_calls_total",
+    "Gemini calls per API key and outcome (ok, quota or error)",
+    ("key", "outcome"),
+)
+metrics.register(KEY_CALLS)
+
+
+class CredentialsExhausted(Exception):
+    """Raised when every API key is cooling down or out of its per-minute budget"""
+
+
+def is_quota_error(error):
+    # ResourceExhausted (gRPC) is a TooManyRequests (HTTP 429)
+    return isinstance(error, google_exceptions.TooManyRequests)
+
+
+def retry_delay(error):
+    """Seconds upstream asked us to wait (gRPC RetryInfo or Retry-After), or None"""
+    for detail in getattr(error, "details", None) or ():
+        delay = getattr(detail, "retry_delay", None)
+        if delay is not None:
+            if hasattr(delay, "total_seconds"):
+                return delay.total_seconds()
+            return delay.seconds + delay.nanos / 1e9
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers["Retry-After"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class Credential:
+    def __init__(self, name, api_key, weight=1):
+        self.name = name
+        self.api_key = api_key
+        self.weight = weight
+        self.requests = 0
+        self.tokens = 0
+        self.errors = 0
+        self.quota_errors = 0
+        self.consecutive_quota_errors = 0
+        self.cooldown_until = 0.0
+        # Smooth weighted round-robin state
+        self.current_weight = 0
+        # Fixed one-minute window for the per-key budgets
+        self.window_start = 0.0
+        self.window_requests = 0
+        self.window_tokens = 0
+
+
+class CredentialPool:
+    """
+    Several Gemini API keys (or projects) used in weighted round-robin.
+    A key that answers with a quota error is cooled down for as long as
+    upstream asks, or for longer on each consecutive quota error, unless it
+    is the last usable key: then only the failing call degrades. Keys can
+    also be held to a per-minute request and token budget so they are
+    skipped before upstream refuses.
+    """
+
+    def __init__(self, credentials, cooldown=60, max_cooldown=900, rpm_limit=0, tpm_limit=0):
+        self.credentials = credentials
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.rpm_limit = rpm_limit
+        self.tpm_limit = tpm_limit
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_keys(cls, keys, **options):
+        """keys are "API_KEY" or "API_KEY:WEIGHT" strings"""
+        credentials = []
+        for index, entry in enumerate(keys, 1):
+            api_key, _, weight = entry.partition(":")
+            credentials.append(Credential(f"key{index}", api_key.strip(), int(weight or 1)))
+        return cls(credentials, **options)
+
+    def __len__(self):
+        return len(self.credentials)
+
+    def _usable(self, credential, now, estimated_tokens):
+        if credential.cooldown_until > now:
+            return False
+        if now - credential.window_start >= 60:
+            return True
+        if self.rpm_limit and credential.window_requests >= self.rpm_limit:
+            return False
+        if self.tpm_limit and credential.window_tokens + estimated_tokens > self.tpm_limit:
+            return False
+        return True
+
+    def acquire(self, estimated_tokens=0, exclude=()):
+        """
+        Pick the key for the next call and count the call against it.
+        Keys in exclude (already tried for this call) are skipped.
+        """
+        now = time.monotonic()
+        with self._lock:
+            usable = [
+                credential for credential in self.credentials
+                if credential not in exclude and self._usable(credential, now, estimated_tokens)
+            ]
+            if not usable:
+                raise CredentialsExhausted("No Gemini API key is available")
+
+            total = 0
+            for credential in usable:
+                credential.current_weight += credential.weight
+                total += credential.weight
+            chosen = max(usable, key=lambda credential: credential.current_weight)
+            chosen.current_weight -= total
+
+            if now - chosen.window_start >= 60:
+                chosen.window_start = now
+                chosen.window_requests = 0
+                chosen.window_tokens = 0
+            chosen.window_requests += 1
+            chosen.window_tokens += estimated_tokens
+            chosen.requests += 1
+            chosen.tokens += estimated_tokens
+            return chosen
+
+    def record_success(self, credential, extra_tokens=0):
+        """extra_tokens: tokens the answer used beyond the estimate counted at acquire"""
+        with self._lock:
+            credential.consecutive_quota_errors = 0
+            credential.tokens += extra_tokens
+            credential.window_tokens += extra_tokens
+        KEY_CALLS.inc(credential.name, "ok")
+
+    def record_error(self, credential, error):
+        if not is_quota_error(error):
+            with self._lock:
+                credential.errors += 1
+            KEY_CALLS.inc(credential.name, "error")
+            return
+        delay = retry_delay(error)
+        with self._lock:
+            credential.quota_errors += 1
+            credential.consecutive_quota_errors += 1
+            now = time.monotonic()
+            if any(
+                other is not credential and self._usable(other, now, 0)
+                for other in self.credentials
+            ):
+                if delay is None:
+                    delay = self.cooldown * 2 ** (credential.consecutive_quota_errors - 1)
+                credential.cooldown_until = now + min(self.max_cooldown, delay)
+        KEY_CALLS.inc(credential.name, "quota")
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    "key": credential.name,
+                    "weight": credential.weight,
+                    "requests": credential.requests,
+                    "tokens": credential.tokens,
+                    "errors": credential.errors,
+                    "quota_errors": credential.quota_errors,
+                    "cooling_down_seconds": round(max(0.0, credential.cooldown_until - now), 1),
+                    "requests_this_minute": credential.window_requests if now - credential.window_start < 60 else 0,
+                    "tokens_this_minute": credential.window_tokens if now - credential.window_start < 60 else 0,
+                }
+                for credential in self.credentials
+            ]
@@ -0,0 +1,92 @@
+import gzip
+import hashlib
+import json
+
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_vary_headers
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is served alone without it
+    brotli = None
+
+# Preferred first when a client accepts several
+ENCODINGS = ("br", "gzip")
+
+
+def render_json(data):
+    """JSON bytes exactly as DRF's JSONRenderer would produce them"""
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class CachedBody:
+    """
+    A rendered JSON body with its compressed variants and strong ETags,
+    computed once. Each content coding gets its own ETag as required for
+    strong validators; any of them revalidates the same content.
+    """
+
+    def __init__(self, body):
+        digest = hashlib.blake2b(body, digest_size=16).hexdigest()
+        self.variants = {"identity": body}
+        compressed = {"gzip": gzip.compress(body, 9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(body, quality=11)
+        for encoding, data in compressed.items():
+            # Tiny bodies can grow when compressed
+            if len(data) < len(body):
+                self.variants[encoding] = data
+
+        self.etags = {
+            encoding: f'"{digest}"' if encoding == "identity" else f'"{digest}-{encoding}"'
+            for encoding in self.variants
+        }
+        self._known_etags = set(self.etags.values())
+
+    @classmethod
+    def from_data(cls, data):
+        return cls(render_json(data))
+
+    def matches(self, if_none_match):
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        # Weak comparison, as RFC 9110 requires for If-None-Match
+        tags = (tag.strip().removeprefix("W/") for tag in if_none_match.split(","))
+        return any(tag in self._known_etags for tag in tags)
+
+    def choose_encoding(self, accept_encoding):
+        accepted = {}
+        for part in accept_encoding.lower().split(","):
+            coding, _, params = part.strip().partition(";")
+            quality = 1.0
+            if params.strip().startswith("q="):
+                try:
+                    quality = float(params.strip()[2:])
+                except ValueError:
+                    quality = 0.0
+            accepted[coding.strip()] = quality
+        for encoding in ENCODINGS:
+            if encoding in self.variants and accepted.get(encoding, accepted.get("*", 0)) > 0:
+                return encoding
+        return "identity"
+
+
+def cached_json_response(request, cached, cache_control):
+    """
+    Serve a CachedBody: 304 when the client's copy is current, otherwise
+    the smallest variant the client accepts
+    """
+    encoding = cached.choose_encoding(request.headers.get("Accept-Encoding", ""))
+    if cached.matches(request.headers.get("If-None-Match")):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(cached.variants[encoding], content_type="application/json")
+        if encoding != "identity":
+            response["Content-Encoding"] = encoding
+
+    response["ETag"] = cached.etags[encoding]
+    response["Cache-Control"] = cache_control
+    patch_vary_headers(response, ("Accept-Encoding",))
+    return response
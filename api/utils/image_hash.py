@@ -0,0 +1,142 @@
+import io
+import logging
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+HASH_SIZE = 16
+HASH_BITS = HASH_SIZE * HASH_SIZE
+
+
+def dhash(image_bytes, hash_size=HASH_SIZE):
+    """
+    Difference hash of an image: a hash_size² bit (256 by default)
+    fingerprint that survives recompression, resizing and small crops.
+    Returns None if the bytes cannot be decoded.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.draft("L", (hash_size * 8, hash_size * 8))  # fast JPEG downscale
+            pixels = list(
+                image.convert("L")
+                .resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+                .getdata()
+            )
+    except Exception as e:
+        logger.warning("Perceptual hash error: %s", e)
+        return None
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming_distance(a, b):
+    return (a ^ b).bit_count()
+
+
+class NearDuplicateIndex:
+    """
+    Maps perceptual hashes to result cache keys and finds the closest stored
+    hash within a Hamming-distance threshold whose content fingerprint (e.g.
+    the image's OCR text) is the same as the query's. A perceptual hash
+    cannot tell two screenshots of the same layout apart, so it is never
+    trusted alone.
+
+    Uses a multi-index hash table: each hash is split into threshold + 1
+    bands, and by the pigeonhole principle any hash within the threshold
+    matches at least one band exactly, so only those buckets are scanned.
+    The index is LRU-bounded to max_entries.
+    """
+
+    def __init__(self, threshold=10, max_entries=10000, hash_bits=HASH_BITS):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        band_count = threshold + 1
+        width, extra = divmod(hash_bits, band_count)
+        self._bands = []
+        shift = 0
+        for band in range(band_count):
+            bits = width + (1 if band < extra else 0)
+            self._bands.append((shift, (1 << bits) - 1))
+            shift += bits
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._tables = [{} for _ in self._bands]
+        self._stats = {"hits": 0, "near_hits": 0, "misses": 0, "content_mismatches": 0}
+        self._distances = [0] * (threshold + 1)
+
+    def _band_values(self, phash):
+        return [(phash >> shift) & mask for shift, mask in self._bands]
+
+    def add(self, phash, cache_key, content):
+        with self._lock:
+            if phash in self._entries:
+                self._entries.move_to_end(phash)
+                self._entries[phash] = (cache_key, content)
+                return
+            self._entries[phash] = (cache_key, content)
+            for table, value in zip(self._tables, self._band_values(phash)):
+                table.setdefault(value, set()).add(phash)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def discard(self, phash):
+        with self._lock:
+            if phash in self._entries:
+                self._remove(phash)
+
+    def _remove(self, phash):
+        del self._entries[phash]
+        for table, value in zip(self._tables, self._band_values(phash)):
+            bucket = table.get(value)
+            if bucket is not None:
+                bucket.discard(phash)
+                if not bucket:
+                    del table[value]
+
+    def lookup(self, phash, content):
+        """
+        Return (stored_hash, cache_key, distance) of the closest match with
+        the same content fingerprint, or None
+        """
+        with self._lock:
+            best = None
+            mismatched = False
+            for table, value in zip(self._tables, self._band_values(phash)):
+                for candidate in table.get(value, ()):
+                    distance = hamming_distance(phash, candidate)
+                    if distance > self.threshold:
+                        continue
+                    if self._entries[candidate][1] != content:
+                        mismatched = True
+                    elif best is None or distance < best[1]:
+                        best = (candidate, distance)
+
+            if best is None:
+                self._stats["content_mismatches" if mismatched else "misses"] += 1
+                return None
+
+            candidate, distance = best
+            self._stats["hits" if distance == 0 else "near_hits"] += 1
+            self._distances[distance] += 1
+            self._entries.move_to_end(candidate)
+            return candidate, self._entries[candidate][0], distance
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = len(self._entries)
+            stats["threshold"] = self.threshold
+            # How far matches were from the query; use this to tune the threshold
+            stats["distance_histogram"] = {
+                str(distance): count for distance, count in enumerate(self._distances)
+            }
+        return stats
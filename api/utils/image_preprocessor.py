@@ -0,0 +1,120 @@
+import io
+import logging
+import threading
+
+from django.conf import settings
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+# Output formats we can encode, mapped to the MIME type sent to Gemini
+OUTPUT_MIME_TYPES = {
+    "WEBP": "image/webp",
+    "JPEG": "image/jpeg",
+    "PNG": "image/png",
+}
+
+# Let Pillow itself refuse anything beyond our own limit
+Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
+
+_stats_lock = threading.Lock()
+_stats = {
+    "images": 0,
+    "rejected": 0,
+    "bytes_in": 0,
+    "bytes_out": 0,
+}
+
+
+class ImageRejected(ValueError):
+    """Raised for uploads that cannot or must not be decoded"""
+
+
+def check_image(image_bytes):
+    """
+    Validate an upload from its header alone, before any pixel data is
+    decoded. Rejects unreadable files and decompression bombs. Returns the
+    MIME type of the image format found.
+    """
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            width, height = image.size
+            mime_type = Image.MIME.get(image.format, "application/octet-stream")
+    except Image.DecompressionBombError:
+        _count_rejected()
+        raise ImageRejected("Image dimensions are too large")
+    except Exception:
+        _count_rejected()
+        raise ImageRejected("File is not a readable image")
+
+    if width * height > settings.IMAGE_MAX_PIXELS:
+        _count_rejected()
+        raise ImageRejected("Image dimensions are too large")
+    return mime_type
+
+
+def normalize_image(image_bytes, content_type):
+    """
+    Shrink an upload before it is sent to the vision model: honour the EXIF
+    orientation, cap the longest side, drop metadata and re-encode in
+    IMAGE_UPLOAD_FORMAT. Returns (bytes, mime_type); the original is kept
+    when re-encoding would not make it smaller.
+    """
+    check_image(image_bytes)
+    output_format = settings.IMAGE_UPLOAD_FORMAT.upper()
+    max_side = settings.IMAGE_MAX_SIDE
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        has_metadata = bool(image.info.get("exif") or image.getexif())
+        image.draft("RGB", (max_side, max_side))  # cheap JPEG downscale on decode
+        image = ImageOps.exif_transpose(image)
+        resized = max(image.size) > max_side
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+
+        if output_format == "JPEG" or image.mode not in ("RGB", "RGBA", "L"):
+            image = _flatten(image) if output_format == "JPEG" else image.convert("RGBA")
+
+        buffer = io.BytesIO()
+        image.save(
+            buffer,
+            output_format,
+            quality=settings.IMAGE_UPLOAD_QUALITY,
+            optimize=True,
+        )
+        normalized = buffer.getvalue()
+
+    if len(normalized) >= len(image_bytes) and not (resized or has_metadata):
+        normalized, mime_type = image_bytes, content_type
+    else:
+        mime_type = OUTPUT_MIME_TYPES[output_format]
+
+    with _stats_lock:
+        _stats["images"] += 1
+        _stats["bytes_in"] += len(image_bytes)
+        _stats["bytes_out"] += len(normalized)
+    logger.debug("Image normalized: %d -> %d bytes (%s)", len(image_bytes), len(normalized), mime_type)
+
+    return normalized, mime_type
+
+
+def _flatten(image):
+    """Composite transparency onto white; JPEG has no alpha channel"""
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, (255, 255, 255))
+        background.paste(image, mask=image.getchannel("A"))
+        return background
+    return image.convert("RGB")
+
+
+def _count_rejected():
+    with _stats_lock:
+        _stats["rejected"] += 1
+
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    result["bytes_saved"] = result["bytes_in"] - result["bytes_out"]
+    result["size_ratio"] = result["bytes_out"] / result["bytes_in"] if result["bytes_in"] else 1.0
+    return result
@@ -0,0 +1,110 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F
+from django.utils import timezone
+
+from ..models import AnalysisJob
+
+PRIORITIES = {"low": -10, "normal": 0, "high": 10}
+
+
+def submit(kind, cache_key, priority=0, **inputs):
+    """
+    Queue an analysis and return its job. A result already in the cache
+    gives a finished job at once; an identical job still waiting or
+    running is returned instead of queueing the same work twice.
+    """
+    cached_result = cache.get(cache_key)
+    if cached_result:
+        return AnalysisJob.objects.create(
+            kind=kind,
+            cache_key=cache_key,
+            priority=priority,
+            status=AnalysisJob.DONE,
+            result=cached_result,
+            finished_at=timezone.now(),
+        )
+
+    existing = AnalysisJob.objects.filter(
+        cache_key=cache_key, status__in=(AnalysisJob.QUEUED, AnalysisJob.RUNNING)
+    ).first()
+    if existing:
+        if priority > existing.priority:
+            AnalysisJob.objects.filter(pk=existing.pk, status=AnalysisJob.QUEUED).update(priority=priority)
+        return existing
+
+    return AnalysisJob.objects.create(kind=kind, cache_key=cache_key, priority=priority, **inputs)
+
+
+def requeue_expired():
+    """
+    Put back jobs whose worker died (or was restarted) mid-run, failing
+    those that have used up their attempts
+    """
+    now = timezone.now()
+    expired = AnalysisJob.objects.filter(status=AnalysisJob.RUNNING, lease_expires_at__lt=now)
+    expired.filter(attempts__gte=settings.JOB_MAX_ATTEMPTS).update(
+        status=AnalysisJob.FAILED, error="Worker did not finish the job", finished_at=now
+    )
+    return expired.update(status=AnalysisJob.QUEUED, lease_expires_at=None)
+
+
+def claim(limit):
+    """
+    Lease up to limit queued jobs, highest priority first. The status check
+    in each UPDATE makes the claim safe with several worker processes.
+    """
+    candidates = list(
+        AnalysisJob.objects.filter(status=AnalysisJob.QUEUED)
+        .order_by("-priority", "created_at")
+        .values_list("pk", flat=True)[:limit]
+    )
+    now = timezone.now()
+    lease_expires_at = now + timedelta(seconds=settings.JOB_LEASE_SECONDS)
+    claimed = [
+        pk for pk in candidates
+        if AnalysisJob.objects.filter(pk=pk, status=AnalysisJob.QUEUED).update(
+            status=AnalysisJob.RUNNING,
+            started_at=now,
+            lease_expires_at=lease_expires_at,
+            attempts=F("attempts") + 1,
+        )
+    ]
+    return list(AnalysisJob.objects.filter(pk__in=claimed).order_by("-priority", "created_at"))
+
+
+def complete(job, result):
+    AnalysisJob.objects.filter(pk=job.pk).update(
+        status=AnalysisJob.DONE,
+        result=result,
+        finished_at=timezone.now(),
+        text="",
+        payload=None,
+    )
+
+
+def fail(job, error):
+    """Retry the job later, or give up once it has used all its attempts"""
+    if job.attempts < settings.JOB_MAX_ATTEMPTS:
+        AnalysisJob.objects.filter(pk=job.pk).update(
+            status=AnalysisJob.QUEUED, error=str(error), lease_expires_at=None
+        )
+        return
+    AnalysisJob.objects.filter(pk=job.pk).update(
+        status=AnalysisJob.FAILED,
+        error=str(error),
+        finished_at=timezone.now(),
+        text="",
+        payload=None,
+    )
+
+
+def prune():
+    """Delete finished jobs older than JOB_RETENTION seconds"""
+    cutoff = timezone.now() - timedelta(seconds=settings.JOB_RETENTION)
+    deleted, _ = AnalysisJob.objects.filter(
+        status__in=(AnalysisJob.DONE, AnalysisJob.FAILED), finished_at__lt=cutoff
+    ).delete()
+    return deleted
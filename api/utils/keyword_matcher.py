@@ -0,0 +1,166 @@
+import json
+import re
+import threading
+from collections import deque
+from pathlib import Path
+
+from django.conf import settings
+
+from .text_processor import TextProcessor
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton over a set of phrases. One pass over the text
+    reports every phrase occurrence that sits on word boundaries.
+
+    A phrase ending in "*" is a prefix match ("suicid*" matches "suicidal").
+    """
+
+    def __init__(self, phrases):
+        # phrases: iterable of (phrase, payload)
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+
+        for phrase, payload in phrases:
+            phrase = TextProcessor.canonicalize_text(phrase)
+            is_prefix = phrase.endswith("*")
+            phrase = phrase.rstrip("*")
+            if not phrase:
+                continue
+            node = 0
+            for char in phrase:
+                next_node = self._goto[node].get(char)
+                if next_node is None:
+                    next_node = len(self._goto)
+                    self._goto[node][char] = next_node
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._output.append([])
+                node = next_node
+            self._output[node].append((len(phrase), is_prefix, payload))
+
+        self._build_failure_links()
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[child] = self._goto[fail].get(char, 0)
+                if self._fail[child] == child:
+                    self._fail[child] = 0
+                # Inherit the matches of the longest proper suffix
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find(self, text):
+        """Yield (start, end, payload) for every whole-word match in text"""
+        goto, fail, output = self._goto, self._fail, self._output
+        length = len(text)
+        node = 0
+        for index, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if not output[node]:
+                continue
+            end = index + 1
+            for phrase_length, is_prefix, payload in output[node]:
+                start = end - phrase_length
+                if start > 0 and text[start - 1].isalnum():
+                    continue
+                if not is_prefix and end < length and text[end].isalnum():
+                    continue
+                yield start, end, payload
+
+
+class Lexicon:
+    """
+    Weighted keyword categories loaded from the JSON lexicon files.
+
+    Categories are listed in priority order; a category fires when the
+    summed weight of its distinct matched keywords reaches its threshold.
+    """
+
+    def __init__(self, categories):
+        self.categories = categories
+        self._matcher = KeywordMatcher(
+            (keyword, (index, keyword, weight))
+            for index, category in enumerate(categories)
+            for keyword, weight in category["keywords"].items()
+        )
+
+    def match(self, text):
+        """
+        Return [(category, score, matched_keywords)] for every category that
+        reached its threshold, in priority order
+        """
+        matched = [dict() for _ in self.categories]
+        for _, _, (index, keyword, weight) in self._matcher.find(TextProcessor.canonicalize_text(text)):
+            matched[index][keyword] = weight
+
+        results = []
+        for category, keywords in zip(self.categories, matched):
+            score = sum(keywords.values())
+            if keywords and score >= category.get("threshold", 1.0):
+                results.append((category, score, sorted(keywords)))
+        return results
+
+
+LANGUAGE_CODE = re.compile(r"[a-z]{2,3}")
+
+_lexicons = {}
+_lexicons_lock = threading.Lock()
+_shipped_languages = None
+
+
+def _lexicon_language(language):
+    """
+    The language whose lexicon file will be loaded: the client's language
+    code (e.g. "sw" for "sw-KE") if a lexicon ships for it, else "en"
+    """
+    global _shipped_languages
+    if _shipped_languages is None:
+        _shipped_languages = {path.stem for path in Path(settings.LEXICON_DIR).glob("*.json")}
+    language = (language or "en").lower().split("-")[0]
+    if LANGUAGE_CODE.fullmatch(language) and language in _shipped_languages:
+        return language
+    return "en"
+
+
+def _load_categories(language):
+    path = Path(settings.LEXICON_DIR) / f"{language}.json"
+    if not path.is_file():
+        return None
+    with open(path, encoding="utf-8") as lexicon_file:
+        return json.load(lexicon_file)["categories"]
+
+
+def get_lexicon(language="en"):
+    """
+    Compiled lexicon for a language, built once per process. Non-English
+    lexicons are merged with the English one since code-switching is common.
+    Unknown or malformed languages get the English lexicon.
+    """
+    language = _lexicon_language(language)
+    lexicon = _lexicons.get(language)
+    if lexicon is not None:
+        return lexicon
+
+    with _lexicons_lock:
+        lexicon = _lexicons.get(language)
+        if lexicon is None:
+            categories = {category["name"]: category for category in _load_categories("en") or []}
+            if language != "en":
+                for category in _load_categories(language) or []:
+                    merged = categories.setdefault(category["name"], dict(category, keywords={}))
+                    merged["keywords"] = {**merged["keywords"], **category["keywords"]}
+            ordered = sorted(categories.values(), key=lambda category: -category.get("priority", 0))
+            lexicon = Lexicon(ordered)
+            _lexicons[language] = lexicon
+    return lexicon
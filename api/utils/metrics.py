@@ -0,0 +1,255 @@
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import ContextDecorator
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers a cache lookup up to a slow vision call
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30)
+
+
+class Counter:
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), value] for labels, value in self._values.items()]
+
+    @staticmethod
+    def merge(into, snapshot):
+        for labels, value in snapshot:
+            into[tuple(labels)] = into.get(tuple(labels), 0) + value
+
+    def render(self, merged):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(merged.items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value:g}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._values = {}  # labels -> [bucket counts..., count, sum]
+
+    def observe(self, value, *labels):
+        with self._lock:
+            values = self._values.get(labels)
+            if values is None:
+                values = self._values[labels] = [0] * (len(self.buckets) + 2)
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[index] += 1
+            values[-2] += 1
+            values[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), list(values)] for labels, values in self._values.items()]
+
+    @staticmethod
+    def merge(into, snapshot):
+        for labels, values in snapshot:
+            merged = into.setdefault(tuple(labels), [0] * len(values))
+            for index, value in enumerate(values):
+                merged[index] += value
+
+    def render(self, merged):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = (*self.labelnames, "le")
+        for labels, values in sorted(merged.items()):
+            for bound, count in zip(self.buckets, values):
+                lines.append(f"{self.name}_bucket{_labels(names, (*labels, f'{bound:g}'))} {count:g}")
+            lines.append(f"{self.name}_bucket{_labels(names, (*labels, '+Inf'))} {values[-2]:g}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {values[-2]:g}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {values[-1]:g}")
+        return lines
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = (
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    )
+    return "{" + ",".join(pairs) + "}"
+
+
+STAGE_SECONDS = Histogram(
+    "safeguard_stage_duration_seconds",
+    "Time spent per request-handling stage",
+    ("stage",),
+)
+REQUEST_SECONDS = Histogram(
+    "safeguard_request_duration_seconds",
+    "Time to produce a response, per view",
+    ("view",),
+)
+REQUESTS = Counter(
+    "safeguard_requests_total",
+    "Responses served, per view and status code",
+    ("view", "status"),
+)
+CACHE_LOOKUPS = Counter(
+    "safeguard_cache_lookups_total",
+    "Analysis result cache lookups, per kind and result (hit or miss)",
+    ("kind", "result"),
+)
+VERDICTS = Counter(
+    "safeguard_verdicts_total",
+    "Verdicts produced, per source (model, triage or fallback)",
+    ("source",),
+)
+PARSES = Counter(
+    "safeguard_response_parses_total",
+    "Model answers parsed, per outcome (ok or failed)",
+    ("outcome",),
+)
+
+_METRICS = [STAGE_SECONDS, REQUEST_SECONDS, REQUESTS, CACHE_LOOKUPS, VERDICTS, PARSES]
+
+
+def register(metric):
+    """Expose a metric defined in another module"""
+    _METRICS.append(metric)
+
+
+# Stage timings of the request being handled, for its Server-Timing header
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+
+
+class timed(ContextDecorator):
+    """
+    Time a stage (as a with-block or a function decorator), recording it in
+    the stage histogram and in the current request's Server-Timing header
+    """
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._started = None
+
+    def _recreate_cm(self):
+        # A decorated function may run in several threads at once
+        return timed(self.stage)
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        record_stage(self.stage, time.perf_counter() - self._started)
+        return False
+
+
+def record_stage(stage, seconds):
+    STAGE_SECONDS.observe(seconds, stage)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+def start_request():
+    """Collect stage timings for a new request; returns the token for end_request"""
+    return _request_timings.set({})
+
+
+def end_request(token):
+    """Stop collecting and return {stage: seconds} for the request"""
+    timings = _request_timings.get() or {}
+    _request_timings.reset(token)
+    return timings
+
+
+def server_timing(timings, total):
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def _snapshot():
+    return {metric.name: metric.snapshot() for metric in _METRICS}
+
+
+_flush_lock = threading.Lock()
+_flushed_at = 0.0
+
+
+def flush(force=False):
+    """
+    Write this process's metrics to METRICS_DIR (at most every
+    METRICS_FLUSH_INTERVAL seconds) so any worker can serve the totals
+    """
+    global _flushed_at
+    if not settings.METRICS_DIR:
+        return
+    now = time.monotonic()
+    if not force and now - _flushed_at < settings.METRICS_FLUSH_INTERVAL:
+        return
+    with _flush_lock:
+        if not force and now - _flushed_at < settings.METRICS_FLUSH_INTERVAL:
+            return
+        _flushed_at = now
+        path = os.path.join(settings.METRICS_DIR, f"{os.getpid()}.json")
+        try:
+            os.makedirs(settings.METRICS_DIR, exist_ok=True)
+            with open(f"{path}.tmp", "w") as metrics_file:
+                json.dump(_snapshot(), metrics_file)
+            # Atomic swap so a scrape never reads a half-written file
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.warning("Metrics flush error: %s", e)
+
+
+def _snapshots():
+    if not settings.METRICS_DIR:
+        return [_snapshot()]
+    flush(force=True)
+    snapshots = []
+    try:
+        names = os.listdir(settings.METRICS_DIR)
+    except OSError:
+        return [_snapshot()]
+    for name in names:
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(settings.METRICS_DIR, name)) as metrics_file:
+                snapshots.append(json.load(metrics_file))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def render():
+    """
+    Prometheus text exposition of all metrics, summed over every worker
+    process that has written to METRICS_DIR (or this process alone)
+    """
+    snapshots = _snapshots()
+    lines = []
+    for metric in _METRICS:
+        merged = {}
+        for snapshot in snapshots:
+            metric.merge(merged, snapshot.get(metric.name, []))
+        lines.extend(metric.render(merged))
+    return "\n".join(lines) + "\n"
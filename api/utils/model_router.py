@@ -0,0 +1,125 @@
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+
+from . import metrics
+from .resilience import LatencyTracker
+
+TIERS = ("lite", "standard", "pro")
+
+ROUTED_CALLS = metrics.Counter(
+    "safeguard_model_calls_total",
+    "Gemini calls per model tier and reason (routed or escalated)",
+    ("tier", "reason"),
+)
+MODEL_SECONDS = metrics.Histogram(
+    "safeguard_model_call_duration_seconds",
+    "Successful Gemini call time per model tier",
+    ("tier",),
+)
+metrics.register(ROUTED_CALLS)
+metrics.register(MODEL_SECONDS)
+
+# tier: index into TIERS; pre_score: risk level from the lexicon, or None
+Route = namedtuple("Route", ("tier", "model", "pre_score", "escalated"))
+
+SEVERE = ("HIGH", "CRITICAL")
+
+
+def _models():
+    return {
+        "lite": settings.GEMINI_MODEL_LITE,
+        "standard": settings.GEMINI_MODEL,
+        "pro": settings.GEMINI_MODEL_PRO,
+    }
+
+
+class ModelRouter:
+    """
+    Picks the cheapest Gemini model tier an input can safely go to, from its
+    length, modality and lexicon pre-score, stepping down a tier when the
+    chosen one is currently slower than the latency budget. Severe but
+    low-confidence verdicts are escalated one tier up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # Latencies expire, so a tier stepped down for being slow (and hence
+        # barely called) is tried again once its old samples have aged out
+        self._latency = {
+            tier: LatencyTracker(max_age=settings.GEMINI_ROUTING_LATENCY_WINDOW) for tier in TIERS
+        }
+        self._calls = {tier: 0 for tier in TIERS}
+        self._escalations = {tier: 0 for tier in TIERS}
+
+    def _route(self, tier, pre_score, escalated=False):
+        return Route(TIERS.index(tier), _models()[tier], pre_score, escalated)
+
+    def route(self, text="", image=False, pre_score=None):
+        if not settings.GEMINI_ROUTING_ENABLED:
+            return self._route("standard", pre_score)
+
+        severe = pre_score in SEVERE
+        if image:
+            tier = "standard"
+        elif severe and len(text) >= settings.GEMINI_ROUTING_PRO_MIN_CHARS:
+            tier = "pro"
+        elif not pre_score and len(text) <= settings.GEMINI_ROUTING_LITE_MAX_CHARS:
+            tier = "lite"
+        else:
+            tier = "standard"
+
+        # Inputs the lexicon flags as severe never go below the standard tier
+        floor = 1 if severe or image else 0
+        index = TIERS.index(tier)
+        while index > floor and self._too_slow(TIERS[index]):
+            index -= 1
+        return self._route(TIERS[index], pre_score)
+
+    def _too_slow(self, tier):
+        budget = settings.GEMINI_ROUTING_LATENCY_BUDGET
+        if not budget:
+            return False
+        p95 = self._latency[tier].percentile(95)
+        return p95 is not None and p95 > budget
+
+    def escalate(self, route, result):
+        """
+        The route to re-run on when result is severe but uncertain, or
+        contradicts a severe pre-score with low confidence; else None
+        """
+        if not settings.GEMINI_ROUTING_ENABLED or route.tier == len(TIERS) - 1:
+            return None
+        uncertain = result.get("confidence", 0) < settings.GEMINI_ESCALATION_CONFIDENCE
+        severe = result.get("risk_level") in SEVERE
+        if not uncertain or not (severe or route.pre_score in SEVERE):
+            return None
+        with self._lock:
+            self._escalations[TIERS[route.tier]] += 1
+        return self._route(TIERS[route.tier + 1], route.pre_score, escalated=True)
+
+    def record(self, route, seconds):
+        """Count a successful call on route and its latency"""
+        tier = TIERS[route.tier]
+        self._latency[tier].record(seconds)
+        with self._lock:
+            self._calls[tier] += 1
+        ROUTED_CALLS.inc(tier, "escalated" if route.escalated else "routed")
+        MODEL_SECONDS.observe(seconds, tier)
+
+    def stats(self):
+        models = _models()
+        with self._lock:
+            return {
+                "enabled": settings.GEMINI_ROUTING_ENABLED,
+                "tiers": {
+                    tier: {
+                        "model": models[tier],
+                        "calls": self._calls[tier],
+                        "escalated_from": self._escalations[tier],
+                        "latency_seconds": self._latency[tier].stats(),
+                    }
+                    for tier in TIERS
+                },
+            }
@@ -0,0 +1,167 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+import pytesseract
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from .text_processor import TextProcessor
+
+logger = logging.getLogger(__name__)
+
+_stats_lock = threading.Lock()
+_stats = {
+    "images": 0,
+    "text_heavy": 0,
+    "timeouts": 0,
+    "errors": 0,
+}
+
+
+def _ocr_worker(image_bytes, languages, max_side):
+    """
+    Runs in a pool process. Returns the recognized text, line by line, with
+    the number of recognized words and their mean confidence (0-100).
+    """
+    TextProcessor._tesseract_available()  # picks up TESSERACT_CMD in this process
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_side, max_side))
+        data = pytesseract.image_to_data(
+            image.convert("L"), lang=languages, output_type=pytesseract.Output.DICT
+        )
+
+    lines = {}
+    confidences = []
+    for word, confidence, block, paragraph, line in zip(
+        data["text"], data["conf"], data["block_num"], data["par_num"], data["line_num"]
+    ):
+        confidence = float(confidence)
+        if confidence < 0 or not word.strip():
+            continue
+        lines.setdefault((block, paragraph, line), []).append(word.strip())
+        confidences.append(confidence)
+
+    return {
+        "text": "\n".join(" ".join(words) for words in lines.values()),
+        "words": len(confidences),
+        "confidence": sum(confidences) / len(confidences) if confidences else 0.0,
+    }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+_available = None
+
+
+def _get_pool():
+    """
+    Process-wide OCR pool. Tesseract is CPU-bound, so it runs in separate
+    processes rather than on request threads. Pool processes are spawned,
+    not forked, so they never inherit a worker's threads or connections.
+    """
+    global _pool, _pool_pid
+    if _pool is None or _pool_pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool_pid != os.getpid():
+                _pool = ProcessPoolExecutor(
+                    max_workers=settings.OCR_MAX_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                _pool_pid = os.getpid()
+    return _pool
+
+
+def _reset_pool(broken):
+    global _pool
+    with _pool_lock:
+        if _pool is broken:
+            _pool = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+def is_available():
+    global _available
+    if _available is None:
+        _available = TextProcessor._tesseract_available()
+        if not _available:
+            logger.warning("OCR disabled: tesseract is not installed or not in PATH.")
+    return _available
+
+
+def _submit(pool, image_bytes):
+    return pool.submit(_ocr_worker, image_bytes, settings.OCR_LANGUAGES, settings.OCR_MAX_SIDE)
+
+
+def _count(stat):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def _handle_error(pool, error):
+    if isinstance(error, (FutureTimeout, asyncio.TimeoutError)):
+        _count("timeouts")
+        logger.warning("OCR Error: timed out")
+        return
+    _count("errors")
+    logger.warning("OCR Error: %s", error)
+    if isinstance(error, BrokenProcessPool):
+        _reset_pool(pool)
+
+
+def extract_text(image_bytes):
+    """OCR an image on the process pool; None when OCR is unavailable or fails"""
+    if not is_available():
+        return None
+    _count("images")
+    pool = _get_pool()
+    future = None
+    try:
+        future = _submit(pool, image_bytes)
+        return future.result(timeout=settings.OCR_TIMEOUT)
+    except Exception as e:
+        if future is not None:
+            future.cancel()
+        _handle_error(pool, e)
+        return None
+
+
+async def aextract_text(image_bytes):
+    """Async counterpart of extract_text; the event loop is never blocked"""
+    if not is_available():
+        return None
+    _count("images")
+    pool = _get_pool()
+    try:
+        future = _submit(pool, image_bytes)
+        return await asyncio.wait_for(asyncio.wrap_future(future), settings.OCR_TIMEOUT)
+    except Exception as e:
+        _handle_error(pool, e)
+        return None
+
+
+def is_text_heavy(ocr_result, count=True):
+    """Whether an image is mostly readable text (a screenshot of a chat...)"""
+    text_heavy = (
+        ocr_result["words"] >= settings.OCR_MIN_WORDS
+        and ocr_result["confidence"] >= settings.OCR_MIN_CONFIDENCE
+    )
+    if text_heavy and count:
+        _count("text_heavy")
+    return text_heavy
+
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    result["available"] = bool(_available)
+    return result
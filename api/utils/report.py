@@ -0,0 +1,33 @@
+RISK_ORDER = {"UNKNOWN": -1, "LOW": 0, "MEDIUM": 1, "HIGH": 2, "CRITICAL": 3}
+
+
+def risk_rank(result):
+    """Sort key: risk level first, then the model's confidence"""
+    return RISK_ORDER.get(result.get("risk_level"), -1), result.get("confidence", 0)
+
+
+def combine_verdicts(results, sources):
+    """
+    Merge the verdicts for the parts of one submission (chunks of a long
+    text, files of an upload...) into a single report. Highest risk wins:
+    the riskiest part supplies the verdict and actions, and every part
+    above LOW is listed under "evidence" together with its source dict.
+    """
+    worst = max(range(len(results)), key=lambda index: risk_rank(results[index]))
+    report = dict(results[worst])
+    report["evidence"] = [
+        {
+            **source,
+            "risk_level": result["risk_level"],
+            "category": result["category"],
+            "confidence": result["confidence"],
+            "explanation": result["explanation"],
+        }
+        for result, source in zip(results, sources)
+        if RISK_ORDER.get(result["risk_level"], -1) > RISK_ORDER["LOW"]
+    ]
+    if len(report["evidence"]) > 1:
+        report["explanation"] = (
+            f"{report['explanation']} ({len(report['evidence'])} of {len(results)} parts flagged)"
+        )
+    return report
@@ -0,0 +1,143 @@
+import threading
+import time
+from collections import deque
+
+from google.api_core import exceptions as google_exceptions
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling upstream while the circuit breaker is open"""
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a request has used up its time budget"""
+
+
+def is_upstream_failure(error):
+    """
+    Whether an error says something about upstream health. Client errors
+    (bad request, payload too large...) are the caller's fault and must not
+    trip the breaker; rate limiting (429) is an upstream problem.
+    """
+    if isinstance(error, google_exceptions.ClientError):
+        return isinstance(error, google_exceptions.TooManyRequests)
+    return True
+
+
+class CircuitBreaker:
+    """
+    Per-process circuit breaker.
+
+    closed:    calls flow; failure_threshold consecutive failures open it
+    open:      calls are rejected until reset_timeout has passed
+    half_open: a single probe call is let through; success closes the
+               breaker, failure opens it again
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._trips = 0
+        self._rejected = 0
+
+    def allow(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+
+            self._rejected += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._trips += 1
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def release(self):
+        """Forget a half-open probe that ended without telling us anything"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self._state,
+                "consecutive_failures": self._failures,
+                "trips": self._trips,
+                "rejected_calls": self._rejected,
+            }
+
+
+class LatencyTracker:
+    """
+    Sliding window of recent call latencies (seconds). With max_age,
+    samples older than max_age seconds are dropped as well.
+    """
+
+    def __init__(self, window=500, min_samples=20, max_age=None):
+        self.min_samples = min_samples
+        self.max_age = max_age
+        self._samples = deque(maxlen=window)  # (monotonic time, seconds)
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append((time.monotonic(), seconds))
+
+    def percentile(self, percent):
+        """Latency at the given percentile, or None until enough samples exist"""
+        with self._lock:
+            if self.max_age is not None:
+                oldest = time.monotonic() - self.max_age
+                while self._samples and self._samples[0][0] < oldest:
+                    self._samples.popleft()
+            if len(self._samples) < self.min_samples:
+                return None
+            ordered = sorted(seconds for _, seconds in self._samples)
+        index = min(len(ordered) - 1, int(len(ordered) * percent / 100))
+        return ordered[index]
+
+    def stats(self):
+        return {
+            f"p{percent}": self.percentile(percent) for percent in (50, 95, 99)
+        }
+
+
+class Deadline:
+    """Time budget shared by every attempt made for one request"""
+
+    def __init__(self, seconds):
+        self._expires_at = time.monotonic() + seconds
+
+    def remaining(self):
+        remaining = self._expires_at - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded("Request deadline exceeded")
+        return remaining
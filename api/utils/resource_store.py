@@ -0,0 +1,107 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from cachetools import LRUCache
+from django.conf import settings
+
+from .http_cache import CachedBody
+
+logger = logging.getLogger(__name__)
+
+
+class ResourceStore:
+    """
+    Support-resource directory indexed by country and by category, with
+    every (country, category) response rendered and compressed up front
+    """
+
+    def __init__(self, data):
+        self.default_country = data["default_country"]
+        self.by_country = {}
+        self._bodies = {}
+
+        for country, resources in data["countries"].items():
+            country = country.upper()
+            self.by_country[country] = resources
+            self._bodies[country, None] = CachedBody.from_data(resources)
+            for category in {resource["category"] for resource in resources}:
+                matching = [resource for resource in resources if resource["category"] == category]
+                self._bodies[country, category] = CachedBody.from_data(matching)
+
+        self._empty = CachedBody.from_data([])
+        # Multi-country responses are built on first request
+        self._combined = LRUCache(maxsize=256)
+        self._combined_lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as data_file:
+            return cls(json.load(data_file))
+
+    def resolve_country(self, country):
+        """Unknown countries get the default country's resources"""
+        country = (country or "").upper()
+        return country if country in self.by_country else self.default_country
+
+    def body(self, country, category=None):
+        """Pre-rendered JSON list for one country, optionally one category"""
+        return self._bodies.get((self.resolve_country(country), category), self._empty)
+
+    def combined_body(self, countries, category=None):
+        """Pre-rendered JSON object keyed by country, for several countries"""
+        countries = tuple(dict.fromkeys(self.resolve_country(country) for country in countries))
+        key = (countries, category)
+        with self._combined_lock:
+            body = self._combined.get(key)
+        if body is None:
+            body = CachedBody(b"{%s}" % b",".join(
+                b'"%s":%s' % (country.encode(), self.body(country, category).variants["identity"])
+                for country in countries
+            ))
+            with self._combined_lock:
+                self._combined[key] = body
+        return body
+
+
+_store = None
+_store_mtime = None
+_store_checked_at = 0.0
+_store_lock = threading.Lock()
+
+
+def get_resource_store():
+    """
+    Process-wide store. The data file is stat'ed at most once every
+    SUPPORT_RESOURCES_RELOAD_INTERVAL seconds and reloaded when it changed,
+    so edits go live without a restart.
+    """
+    global _store, _store_mtime, _store_checked_at
+
+    now = time.monotonic()
+    if _store is not None and now - _store_checked_at < settings.SUPPORT_RESOURCES_RELOAD_INTERVAL:
+        return _store
+
+    with _store_lock:
+        if _store is not None and now - _store_checked_at < settings.SUPPORT_RESOURCES_RELOAD_INTERVAL:
+            return _store
+        _store_checked_at = now
+        try:
+            mtime = os.stat(settings.SUPPORT_RESOURCES_PATH).st_mtime
+        except OSError as e:
+            logger.warning("Support resources unavailable: %s", e)
+            mtime = None
+
+        if _store is None or (mtime is not None and mtime != _store_mtime):
+            try:
+                _store = ResourceStore.load(settings.SUPPORT_RESOURCES_PATH)
+                _store_mtime = mtime
+            except (OSError, ValueError, KeyError) as e:
+                # Keep serving the last good copy if an edit broke the file
+                logger.error("Support resources load error: %s", e)
+                if _store is None:
+                    raise
+                _store_mtime = mtime
+    return _store
@@ -0,0 +1,78 @@
+import asyncio
+import threading
+
+
+class SingleFlightTimeout(Exception):
+    """Raised when a caller gives up waiting on another caller's in-flight work"""
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent calls that share a key: the first caller (the leader)
+    runs the work, everyone else arriving before it finishes waits for and
+    shares its result instead of repeating it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._futures = {}
+
+    def do(self, key, fn, timeout=None):
+        with self._lock:
+            call = self._calls.get(key)
+            is_leader = call is None
+            if is_leader:
+                call = _Call()
+                self._calls[key] = call
+
+        if not is_leader:
+            if not call.done.wait(timeout):
+                raise SingleFlightTimeout(key)
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e if isinstance(e, Exception) else SingleFlightTimeout(key)
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    async def ado(self, key, coroutine_fn, timeout=None):
+        """Async counterpart of do(); coroutine_fn is called only by the leader"""
+        # Futures belong to one event loop, so scope in-flight calls by loop
+        flight_key = (asyncio.get_running_loop(), key)
+        future = self._futures.get(flight_key)
+
+        if future is not None:
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), timeout)
+            except asyncio.TimeoutError:
+                raise SingleFlightTimeout(key)
+
+        future = asyncio.get_running_loop().create_future()
+        # Nobody may be waiting; mark the exception as retrieved either way
+        future.add_done_callback(lambda f: f.exception())
+        self._futures[flight_key] = future
+        try:
+            result = await coroutine_fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e if isinstance(e, Exception) else SingleFlightTimeout(key))
+            raise
+        finally:
+            self._futures.pop(flight_key, None)
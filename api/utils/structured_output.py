@@ -0,0 +1,137 @@
+import json
+import re
+import threading
+from typing import List, Literal
+
+from pydantic import BaseModel, ConfigDict, Field, ValidationError, field_validator
+
+RiskLevel = Literal["LOW", "MEDIUM", "HIGH", "CRITICAL"]
+
+# Some answers still arrive wrapped in a markdown code fence
+CODE_FENCE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL)
+
+
+class AnalysisResult(BaseModel):
+    """Structured model answer; mirrors AnalysisResponseSerializer"""
+
+    model_config = ConfigDict(extra="ignore", str_strip_whitespace=True)
+
+    risk_level: RiskLevel
+    category: str = Field(min_length=1)
+    confidence: int = Field(ge=0, le=100)
+    explanation: str
+    immediate_actions: List[str] = Field(min_length=1)
+
+    @field_validator("risk_level", mode="before")
+    @classmethod
+    def _upper_risk_level(cls, value):
+        return value.strip().upper() if isinstance(value, str) else value
+
+    @field_validator("immediate_actions")
+    @classmethod
+    def _clean_actions(cls, actions):
+        actions = [action for action in actions if action and action != "."][:4]
+        if not actions:
+            raise ValueError("no usable actions")
+        return actions
+
+
+class BatchAnalysisItem(AnalysisResult):
+    item: int
+
+
+class ConversationAnalysisResult(AnalysisResult):
+    summary: str = ""
+
+
+_FIELD_SCHEMAS = {
+    "risk_level": {"type": "string", "format": "enum", "enum": list(RiskLevel.__args__)},
+    "category": {"type": "string"},
+    "confidence": {"type": "integer"},
+    "explanation": {"type": "string"},
+    "immediate_actions": {"type": "array", "items": {"type": "string"}},
+}
+
+ANALYSIS_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": _FIELD_SCHEMAS,
+    "required": list(_FIELD_SCHEMAS),
+}
+
+CONVERSATION_RESPONSE_SCHEMA = {
+    "type": "object",
+    "properties": {**_FIELD_SCHEMAS, "summary": {"type": "string"}},
+    "required": [*_FIELD_SCHEMAS, "summary"],
+}
+
+BATCH_RESPONSE_SCHEMA = {
+    "type": "array",
+    "items": {
+        "type": "object",
+        "properties": {"item": {"type": "integer"}, **_FIELD_SCHEMAS},
+        "required": ["item", *_FIELD_SCHEMAS],
+    },
+}
+
+_stats_lock = threading.Lock()
+_stats = {"parsed": 0, "failed": 0}
+
+
+def generation_config(schema):
+    """Fresh config per call; the SDK rewrites the schema dict it is given"""
+    return {"response_mime_type": "application/json", "response_schema": schema}
+
+
+def _strip_fence(text):
+    match = CODE_FENCE.match(text)
+    return match.group(1) if match else text
+
+
+def _count(stat):
+    with _stats_lock:
+        _stats[stat] += 1
+
+
+def parse_analysis(response_text, model=AnalysisResult):
+    """Validated result dict, or None if the answer does not match the schema"""
+    try:
+        result = model.model_validate_json(_strip_fence(response_text)).model_dump()
+    except ValidationError:
+        _count("failed")
+        return None
+    _count("parsed")
+    return result
+
+
+def parse_batch(response_text):
+    """
+    {item id: result dict} for every valid item, or None if the answer is
+    not a JSON array. Invalid items are dropped one by one, so a single bad
+    item does not cost the rest of the batch.
+    """
+    try:
+        items = json.loads(_strip_fence(response_text))
+    except ValueError:
+        items = None
+    if not isinstance(items, list):
+        _count("failed")
+        return None
+
+    parsed = {}
+    for item in items:
+        try:
+            item = BatchAnalysisItem.model_validate(item)
+        except ValidationError:
+            _count("failed")
+            continue
+        _count("parsed")
+        parsed[item.item] = item.model_dump(exclude={"item"})
+    return parsed
+
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    total = result["parsed"] + result["failed"]
+    result["failure_rate"] = result["failed"] / total if total else 0.0
+    return result
@@ -0,0 +1,86 @@
+import re
+
+from django.conf import settings
+
+# First line of a chat export message, e.g. WhatsApp
+#   12/01/2024, 21:15 - Name: ...       (Android)
+#   [12/01/24, 9:15:02 PM] Name: ...    (iOS)
+# and most other exporters that start each message with a date
+MESSAGE_START = re.compile(
+    r"^\u200e?\[?\d{1,4}[./-]\d{1,2}[./-]\d{1,4},?\s+\d{1,2}:\d{2}(?::\d{2})?(?:\s?[APap]\.?[Mm]\.?)?\]?\s*[-–:]?\s",
+    re.MULTILINE,
+)
+BLANK_LINES = re.compile(r"\n\s*\n")
+
+
+def is_long_text(text):
+    """Texts past LONG_TEXT_THRESHOLD are analyzed chunk by chunk"""
+    return len(text) > settings.LONG_TEXT_THRESHOLD
+
+
+def split_messages(text):
+    """
+    Split text into messages: one per chat export message when the text
+    looks like an export, otherwise one per paragraph
+    """
+    starts = [match.start() for match in MESSAGE_START.finditer(text)]
+    if len(starts) >= 2:
+        if starts[0] != 0:
+            starts.insert(0, 0)  # export header
+        bounds = zip(starts, starts[1:] + [len(text)])
+        messages = [text[start:end] for start, end in bounds]
+    else:
+        messages = BLANK_LINES.split(text)
+    return [message.strip() for message in messages if message.strip()]
+
+
+def _split_oversized(message, max_chars):
+    """Break a message longer than max_chars into its lines, cutting long lines at whitespace"""
+    if len(message) <= max_chars:
+        return [message]
+
+    pieces = []
+    for line in message.split("\n"):
+        line = line.strip()
+        while len(line) > max_chars:
+            cut = line.rfind(" ", 0, max_chars)
+            if cut <= 0:
+                cut = max_chars
+            pieces.append(line[:cut].strip())
+            line = line[cut:].strip()
+        if line:
+            pieces.append(line)
+    return pieces
+
+
+def chunk_text(text, max_chars, overlap=2):
+    """
+    Pack whole messages into chunks of at most max_chars, in order. Each
+    chunk after the first repeats the last `overlap` messages of the one
+    before it so a threat split across a boundary keeps its context.
+
+    Packing is greedy from the start of the text, so appending lines to an
+    export only changes the last chunk(s) and earlier chunks stay
+    byte-identical (and cached).
+    """
+    messages = []
+    for message in split_messages(text):
+        messages.extend(_split_oversized(message, max_chars))
+
+    chunks = []
+    current = []
+    size = 0
+    for message in messages:
+        if current and size + len(message) + 1 > max_chars:
+            chunks.append(current)
+            # Carry context over, but never so much that nothing new fits
+            current = current[-overlap:] if overlap else []
+            size = sum(len(m) + 1 for m in current)
+            while current and size + len(message) + 1 > max_chars:
+                size -= len(current.pop(0)) + 1
+        current.append(message)
+        size += len(message) + 1
+
+    if current:
+        chunks.append(current)
+    return ["\n".join(chunk) for chunk in chunks]
@@ -1,8 +1,24 @@
+import logging
 import os
 import shutil
 import pytesseract
 from PIL import Image
 import io
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+
+# Common Cyrillic/Greek lookalikes of Latin letters; NFKC leaves these alone
+CONFUSABLES = str.maketrans({
+    "а": "a", "е": "e", "о": "o", "р": "p", "с": "c", "у": "y", "х": "x",
+    "і": "i", "ј": "j", "ѕ": "s", "һ": "h", "ԁ": "d", "ԛ": "q", "ԝ": "w",
+    "А": "A", "В": "B", "Е": "E", "К": "K", "М": "M", "Н": "H", "О": "O",
+    "Р": "P", "С": "C", "Т": "T", "Х": "X",
+    "α": "a", "ο": "o", "ν": "v", "ι": "i", "κ": "k", "ρ": "p", "τ": "t", "υ": "u",
+    "Α": "A", "Β": "B", "Ε": "E", "Η": "H", "Ι": "I", "Κ": "K", "Μ": "M",
+    "Ν": "N", "Ο": "O", "Ρ": "P", "Τ": "T", "Χ": "X", "Υ": "Y", "Ζ": "Z",
+})
 
 
 class TextProcessor:
@@ -12,13 +28,12 @@ class TextProcessor:
         cmd = os.environ.get("TESSERACT_CMD")
         if cmd:
             pytesseract.pytesseract.tesseract_cmd = cmd
+        return shutil.which(pytesseract.pytesseract.tesseract_cmd) is not None
 
     @staticmethod
     def extract_text_from_image(image_file):
-        TextProcessor._tesseract_available()
-
         if not TextProcessor._tesseract_available():
-            print("OCR Error: tesseract is not installed or not in PATH.")
+            logger.warning("OCR Error: tesseract is not installed or not in PATH.")
             return ""
 
         try:
@@ -26,10 +41,24 @@ class TextProcessor:
             text = pytesseract.image_to_string(image)
             return text.strip()
         except Exception as e:
-            print(f"OCR Error: {e}")
+            logger.warning("OCR Error: %s", e)
             return ""
 
     @staticmethod
     def preprocess_text(text):
         text = " ".join(text.split())
         return text
+
+    @staticmethod
+    def canonicalize_text(text):
+        """
+        Reduce text to a canonical form for cache keys so that variants
+        differing only in width, invisible characters, lookalike letters,
+        whitespace or case collapse to the same key
+        """
+        text = unicodedata.normalize("NFKC", text)
+        # Zero-width spaces/joiners, BOMs, bidi marks, soft hyphens...
+        text = "".join(ch for ch in text if unicodedata.category(ch) != "Cf")
+        text = text.translate(CONFUSABLES)
+        text = TextProcessor.preprocess_text(text)
+        return text.casefold()
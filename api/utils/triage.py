@@ -0,0 +1,222 @@
+import json
+import logging
+import math
+import os
+import re
+import threading
+import zlib
+from collections import Counter
+
+from django.conf import settings
+
+from .text_processor import TextProcessor
+
+logger = logging.getLogger(__name__)
+
+RISK_LEVELS = ["LOW", "MEDIUM", "HIGH", "CRITICAL"]
+HIGH_RISK_LEVELS = ("HIGH", "CRITICAL")
+
+N_FEATURES = 2 ** 18
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def hashed_features(text, n_features=N_FEATURES):
+    """
+    Bag of hashed word unigrams and bigrams. crc32 keeps bucket ids stable
+    across processes (unlike hash()), so a model trained offline is valid
+    in every worker.
+    """
+    words = WORD_PATTERN.findall(TextProcessor.canonicalize_text(text))
+    grams = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+    return Counter(zlib.crc32(gram.encode()) % n_features for gram in grams)
+
+
+class NaiveBayes:
+    """Multinomial naive Bayes over sparse hashed feature counts"""
+
+    def __init__(self, classes, alpha=1.0, n_features=N_FEATURES):
+        self.classes = list(classes)
+        self.alpha = alpha
+        self.n_features = n_features
+        self.class_counts = [0] * len(self.classes)
+        self.feature_totals = [0] * len(self.classes)
+        self.feature_counts = {}
+        self._prepare()
+
+    def fit(self, samples):
+        """samples: iterable of (features Counter, class label)"""
+        index = {label: position for position, label in enumerate(self.classes)}
+        for features, label in samples:
+            position = index[label]
+            self.class_counts[position] += 1
+            for bucket, count in features.items():
+                counts = self.feature_counts.setdefault(bucket, [0] * len(self.classes))
+                counts[position] += count
+                self.feature_totals[position] += count
+        self._prepare()
+        return self
+
+    def _prepare(self):
+        """Precompute log probabilities so prediction is lookups and sums"""
+        total = sum(self.class_counts)
+        self._log_prior = [
+            math.log((count + 1) / (total + len(self.classes))) for count in self.class_counts
+        ]
+        self._log_denominator = [
+            math.log(feature_total + self.alpha * self.n_features)
+            for feature_total in self.feature_totals
+        ]
+        self._log_likelihood = {
+            bucket: [
+                math.log(count + self.alpha) - denominator
+                for count, denominator in zip(counts, self._log_denominator)
+            ]
+            for bucket, counts in self.feature_counts.items()
+        }
+        self._log_unseen = [math.log(self.alpha) - denominator for denominator in self._log_denominator]
+
+    def predict_proba(self, features):
+        scores = list(self._log_prior)
+        for bucket, count in features.items():
+            likelihood = self._log_likelihood.get(bucket, self._log_unseen)
+            for position in range(len(scores)):
+                scores[position] += count * likelihood[position]
+        top = max(scores)
+        weights = [math.exp(score - top) for score in scores]
+        total = sum(weights)
+        return {label: weight / total for label, weight in zip(self.classes, weights)}
+
+    def to_dict(self):
+        return {
+            "classes": self.classes,
+            "alpha": self.alpha,
+            "n_features": self.n_features,
+            "class_counts": self.class_counts,
+            "feature_totals": self.feature_totals,
+            "feature_counts": {str(bucket): counts for bucket, counts in self.feature_counts.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        model = cls(data["classes"], data["alpha"], data["n_features"])
+        model.class_counts = data["class_counts"]
+        model.feature_totals = data["feature_totals"]
+        model.feature_counts = {int(bucket): counts for bucket, counts in data["feature_counts"].items()}
+        model._prepare()
+        return model
+
+
+class TriageClassifier:
+    """
+    Local first-pass classifier trained on stored Gemini verdicts. It only
+    answers when it is confident the text is benign or high-risk; everything
+    in between still goes to Gemini.
+    """
+
+    def __init__(self, risk_model, category_model=None):
+        self.risk_model = risk_model
+        self.category_model = category_model
+
+    @classmethod
+    def train(cls, samples):
+        """samples: iterable of (text, risk_level, category)"""
+        featurized = [
+            (hashed_features(text), risk_level, category)
+            for text, risk_level, category in samples
+            if risk_level in RISK_LEVELS
+        ]
+        risk_model = NaiveBayes(RISK_LEVELS).fit(
+            (features, risk_level) for features, risk_level, _ in featurized
+        )
+
+        # The category is only reported for confident high-risk answers
+        high_risk = [
+            (features, category) for features, risk_level, category in featurized
+            if risk_level in HIGH_RISK_LEVELS
+        ]
+        category_model = None
+        if high_risk:
+            categories = sorted({category for _, category in high_risk})
+            category_model = NaiveBayes(categories).fit(high_risk)
+        return cls(risk_model, category_model)
+
+    def predict(self, text):
+        features = hashed_features(text)
+        return features, self.risk_model.predict_proba(features)
+
+    def triage(self, text):
+        """Return a local verdict dict, or None when Gemini should decide"""
+        features, probabilities = self.predict(text)
+
+        if probabilities["LOW"] >= settings.TRIAGE_BENIGN_THRESHOLD:
+            return {
+                "risk_level": "LOW",
+                "category": "None",
+                "confidence": int(probabilities["LOW"] * 100),
+                "explanation": "Local triage model: no abusive content detected.",
+            }
+
+        high_risk = sum(probabilities[level] for level in HIGH_RISK_LEVELS)
+        if high_risk >= settings.TRIAGE_CRITICAL_THRESHOLD and self.category_model is not None:
+            risk_level = max(HIGH_RISK_LEVELS, key=probabilities.get)
+            categories = self.category_model.predict_proba(features)
+            return {
+                "risk_level": risk_level,
+                "category": max(categories, key=categories.get),
+                "confidence": int(high_risk * 100),
+                "explanation": "Local triage model: this content closely matches previously confirmed abusive messages.",
+            }
+
+        return None
+
+    def save(self, path):
+        data = {
+            "risk_model": self.risk_model.to_dict(),
+            "category_model": self.category_model.to_dict() if self.category_model else None,
+        }
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as model_file:
+            json.dump(data, model_file)
+        # Atomic swap so running workers never read a half-written model
+        os.replace(temporary_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as model_file:
+            data = json.load(model_file)
+        category_model = data.get("category_model")
+        return cls(
+            NaiveBayes.from_dict(data["risk_model"]),
+            NaiveBayes.from_dict(category_model) if category_model else None,
+        )
+
+
+_classifier = None
+_classifier_mtime = None
+_classifier_lock = threading.Lock()
+
+
+def get_triage_classifier():
+    """
+    Process-wide classifier, reloaded when the model file is retrained.
+    Returns None when triage is disabled or no model has been trained yet.
+    """
+    global _classifier, _classifier_mtime
+
+    if not settings.TRIAGE_ENABLED:
+        return None
+    try:
+        mtime = os.stat(settings.TRIAGE_MODEL_PATH).st_mtime
+    except OSError:
+        return None
+
+    if mtime != _classifier_mtime:
+        with _classifier_lock:
+            if mtime != _classifier_mtime:
+                try:
+                    _classifier = TriageClassifier.load(settings.TRIAGE_MODEL_PATH)
+                except (OSError, ValueError, KeyError) as e:
+                    logger.warning("Triage model load error: %s", e)
+                    _classifier = None
+                _classifier_mtime = mtime
+    return _classifier
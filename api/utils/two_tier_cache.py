@@ -0,0 +1,252 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from cachetools import LRUCache
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+class TwoTierCache(BaseCache):
+    """
+    Cache backend with a small in-process LRU in front of a SQLite file
+    shared by every worker on the host.
+
+    LOCATION is the SQLite file path. OPTIONS:
+        MAX_ENTRIES        size bound of the shared SQLite tier
+        CULL_FREQUENCY     fraction (1/n) of entries evicted when it is full
+        LOCAL_MAX_ENTRIES  size of the in-process LRU (0 disables it)
+        LOCAL_TIMEOUT      max seconds an entry lives in the LRU, so deletes
+                           made by other workers are picked up eventually
+    """
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get("OPTIONS", {})
+        self._path = str(location)
+        self._local_timeout = float(options.get("LOCAL_TIMEOUT", 60))
+
+        local_max_entries = int(options.get("LOCAL_MAX_ENTRIES", 1000))
+        self._local = LRUCache(maxsize=local_max_entries) if local_max_entries > 0 else None
+        self._local_lock = threading.Lock()
+
+        self._connections = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "local_hits": 0,
+            "local_misses": 0,
+            "shared_hits": 0,
+            "shared_misses": 0,
+        }
+
+    # -- shared tier -------------------------------------------------------
+
+    def _connection(self):
+        connection = getattr(self._connections, "connection", None)
+        # Forked workers must not reuse the parent's connection
+        if connection is None or self._connections.pid != os.getpid():
+            connection = sqlite3.connect(self._path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS cache_entries ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, "
+                "expires REAL, accessed REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS cache_entries_accessed ON cache_entries (accessed)"
+            )
+            self._connections.connection = connection
+            self._connections.pid = os.getpid()
+        return connection
+
+    def _shared_get(self, key):
+        now = time.time()
+        row = self._connection().execute(
+            "SELECT value, expires FROM cache_entries WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return self._missing_key, None
+        value, expires = row
+        if expires is not None and expires <= now:
+            self._connection().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            return self._missing_key, None
+        self._connection().execute(
+            "UPDATE cache_entries SET accessed = ? WHERE key = ?", (now, key)
+        )
+        return pickle.loads(value), expires
+
+    def _shared_set(self, key, value, expires, only_if_missing=False):
+        connection = self._connection()
+        now = time.time()
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            if only_if_missing:
+                row = connection.execute(
+                    "SELECT expires FROM cache_entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and (row[0] is None or row[0] > now):
+                    connection.execute("COMMIT")
+                    return False
+            connection.execute(
+                "INSERT OR REPLACE INTO cache_entries (key, value, expires, accessed) "
+                "VALUES (?, ?, ?, ?)",
+                (key, data, expires, now),
+            )
+            self._cull(connection, now)
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return True
+
+    def _cull(self, connection, now):
+        count = connection.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+        if count <= self._max_entries:
+            return
+        connection.execute("DELETE FROM cache_entries WHERE expires <= ?", (now,))
+        count = connection.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+        if count <= self._max_entries:
+            return
+        if self._cull_frequency == 0:
+            connection.execute("DELETE FROM cache_entries")
+            return
+        # Evict the least recently used fraction of the table
+        connection.execute(
+            "DELETE FROM cache_entries WHERE key IN ("
+            "SELECT key FROM cache_entries ORDER BY accessed LIMIT ?)",
+            (count // self._cull_frequency,),
+        )
+
+    # -- local tier --------------------------------------------------------
+
+    def _local_get(self, key):
+        if self._local is None:
+            return self._missing_key
+        with self._local_lock:
+            entry = self._local.get(key)
+            if entry is None:
+                return self._missing_key
+            expires, value = entry
+            if expires <= time.time():
+                del self._local[key]
+                return self._missing_key
+            return value
+
+    def _local_set(self, key, value, expires):
+        if self._local is None:
+            return
+        local_expires = time.time() + self._local_timeout
+        if expires is not None:
+            local_expires = min(local_expires, expires)
+        with self._local_lock:
+            self._local[key] = (local_expires, value)
+
+    def _local_delete(self, key):
+        if self._local is None:
+            return
+        with self._local_lock:
+            self._local.pop(key, None)
+
+    def _count(self, stat):
+        with self._stats_lock:
+            self._stats[stat] += 1
+
+    # -- cache API ---------------------------------------------------------
+
+    def get(self, key, default=None, version=None):
+        key = self.make_and_validate_key(key, version=version)
+
+        value = self._local_get(key)
+        if value is not self._missing_key:
+            self._count("local_hits")
+            return value
+        self._count("local_misses")
+
+        value, expires = self._shared_get(key)
+        if value is self._missing_key:
+            self._count("shared_misses")
+            return default
+        self._count("shared_hits")
+        self._local_set(key, value, expires)
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        expires = self.get_backend_timeout(timeout)
+        self._shared_set(key, value, expires)
+        self._local_set(key, value, expires)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        expires = self.get_backend_timeout(timeout)
+        if not self._shared_set(key, value, expires, only_if_missing=True):
+            return False
+        self._local_set(key, value, expires)
+        return True
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        expires = self.get_backend_timeout(timeout)
+        self._local_delete(key)
+        cursor = self._connection().execute(
+            "UPDATE cache_entries SET expires = ? WHERE key = ? "
+            "AND (expires IS NULL OR expires > ?)",
+            (expires, key, time.time()),
+        )
+        return cursor.rowcount > 0
+
+    def delete(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        self._local_delete(key)
+        cursor = self._connection().execute(
+            "DELETE FROM cache_entries WHERE key = ?", (key,)
+        )
+        return cursor.rowcount > 0
+
+    def delete_if_equal(self, key, value, version=None):
+        """Delete key only while it still holds value, atomically across workers"""
+        key = self.make_and_validate_key(key, version=version)
+        self._local_delete(key)
+        cursor = self._connection().execute(
+            "DELETE FROM cache_entries WHERE key = ? AND value = ?",
+            (key, pickle.dumps(value, pickle.HIGHEST_PROTOCOL)),
+        )
+        return cursor.rowcount > 0
+
+    def has_key(self, key, version=None):
+        key = self.make_and_validate_key(key, version=version)
+        if self._local_get(key) is not self._missing_key:
+            return True
+        row = self._connection().execute(
+            "SELECT 1 FROM cache_entries WHERE key = ? AND (expires IS NULL OR expires > ?)",
+            (key, time.time()),
+        ).fetchone()
+        return row is not None
+
+    def clear(self):
+        if self._local is not None:
+            with self._local_lock:
+                self._local.clear()
+        self._connection().execute("DELETE FROM cache_entries")
+
+    def close(self, **kwargs):
+        # Connections are per thread and reused across requests
+        pass
+
+    def stats(self):
+        """Per-tier hit/miss counters for this process plus tier sizes"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        local_lookups = stats["local_hits"] + stats["local_misses"]
+        shared_lookups = stats["shared_hits"] + stats["shared_misses"]
+        stats["local_hit_ratio"] = stats["local_hits"] / local_lookups if local_lookups else 0.0
+        stats["shared_hit_ratio"] = stats["shared_hits"] / shared_lookups if shared_lookups else 0.0
+        stats["local_entries"] = len(self._local) if self._local is not None else 0
+        stats["shared_entries"] = self._connection().execute(
+            "SELECT COUNT(*) FROM cache_entries"
+        ).fetchone()[0]
+        stats["pid"] = os.getpid()
+        return stats
@@ -0,0 +1,55 @@
+import posixpath
+import zipfile
+
+
+class ArchiveRejected(ValueError):
+    """Raised for archives that cannot be read or exceed the upload limits"""
+
+
+def iter_zip_members(archive_file, max_files, max_member_bytes, max_total_bytes):
+    """
+    Yield (name, content, error) for every file in a zip archive, reading
+    one member at a time so only the current member is held in memory.
+    content is None, with an error message, for members over the size limit.
+
+    Sizes in the zip headers can lie (zip bombs), so reads are bounded by
+    the limits whatever the headers say.
+    """
+    try:
+        archive = zipfile.ZipFile(archive_file)
+    except (zipfile.BadZipFile, OSError):
+        raise ArchiveRejected("File is not a readable zip archive")
+
+    total_bytes = 0
+    files = 0
+    with archive:
+        for info in archive.infolist():
+            name = info.filename
+            basename = posixpath.basename(name)
+            # Directories and macOS resource forks / dotfiles
+            if info.is_dir() or name.startswith("__MACOSX/") or basename.startswith("."):
+                continue
+
+            files += 1
+            if files > max_files:
+                raise ArchiveRejected(f"Archive holds more than {max_files} files")
+
+            if info.file_size > max_member_bytes:
+                yield name, None, "Image file is too large"
+                continue
+
+            try:
+                with archive.open(info) as member:
+                    content = member.read(max_member_bytes + 1)
+            except (zipfile.BadZipFile, RuntimeError, OSError, NotImplementedError):
+                # Corrupt, encrypted or unsupported compression
+                yield name, None, "File could not be extracted"
+                continue
+            if len(content) > max_member_bytes:
+                yield name, None, "Image file is too large"
+                continue
+
+            total_bytes += len(content)
+            if total_bytes > max_total_bytes:
+                raise ArchiveRejected("Archive contents are too large")
+            yield name, content, None
@@ -1,25 +1,372 @@
 from django.core.cache import cache
+import contextvars
 import hashlib
+import json
+import logging
+import re
+from concurrent.futures import ThreadPoolExecutor
 from rest_framework import status
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, renderer_classes
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from django.conf import settings
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_safe
 
+from .renderers import EventStreamRenderer
 from .serializers import (
-    AbuseAnalysisSerializer, AnalysisResponseSerializer
+    AbuseAnalysisSerializer, AnalysisResponseSerializer, BatchAnalysisSerializer,
+    ConversationMessagesSerializer, ConversationSessionSerializer, JobSubmitSerializer,
 )
+from .models import AnalysisJob
 
-from .utils.ai_detector import AbuseDetector
+from .utils.ai_detector import PROMPT_VERSION, get_detector, upstream_stats
 from .utils.text_processor import TextProcessor
+from .utils.single_flight import SingleFlight, SingleFlightTimeout
+from .utils import (
+    admission, conversation_sessions, http_cache, image_hash, image_preprocessor, job_queue, metrics, ocr,
+    report, resource_store, structured_output, text_chunker, upload_archive,
+)
+
+logger = logging.getLogger(__name__)
+
+_in_flight = SingleFlight()
+# Unique images of one multi-image upload are analyzed concurrently
+_image_pool = ThreadPoolExecutor(
+    max_workers=settings.MULTI_IMAGE_MAX_WORKERS,
+    thread_name_prefix="image-analysis",
+)
+_image_index = image_hash.NearDuplicateIndex(
+    threshold=settings.IMAGE_PHASH_THRESHOLD,
+    max_entries=settings.IMAGE_PHASH_MAX_ENTRIES,
+)
+
+_CACHE_KEY_SECRET = hashlib.blake2b(settings.CACHE_KEY_SECRET.encode(), digest_size=32).digest()
+
+def generate_cache_key(content, content_type='text', language=None):
+    """
+    Generate a unique cache key based on content and type.
+    Text is canonicalized first so trivially different variants share a key;
+    the language and prompt version are part of the key.
+    """
+    if isinstance(content, str):
+        content = TextProcessor.canonicalize_text(content).encode()
+    content_hash = hashlib.blake2b(content, key=_CACHE_KEY_SECRET, digest_size=16).hexdigest()
+    language = re.sub(r'[^a-z0-9-]', '', (language or 'any').lower())[:16] or 'any'
+    return f"safeguard_{content_type}_v{PROMPT_VERSION}_{language}_{content_hash}"
+
+def _cached_analysis(cache_key, analyze, fallback, label, similar=None, priority=None):
+    """
+    Return the cached result for cache_key, or run analyze() once per key
+    no matter how many requests miss on it at the same time.
+    similar() may supply the verdict of a near-identical input instead.
+    A miss charges the request's rate-limit tokens; with a priority,
+    analyze() also waits for admission first. Cache hits do neither.
+    """
+    with metrics.timed('cache_lookup'):
+        cached_result = cache.get(cache_key)
+    if cached_result:
+        metrics.CACHE_LOOKUPS.inc(label, 'hit')
+        logger.debug("Cache HIT for %s analysis: %s", label, cache_key)
+        return cached_result
+    
+    metrics.CACHE_LOOKUPS.inc(label, 'miss')
+    logger.debug("Cache MISS for %s analysis: %s", label, cache_key)
+    admission.charge()
+    
+    def analyze_and_cache():
+        # A previous leader may have filled the cache since our lookup
+        analysis_result = cache.get(cache_key)
+        if not analysis_result:
+            analysis_result = similar and similar()
+            if not analysis_result:
+                if priority is None:
+                    analysis_result = analyze()
+                else:
+                    analysis_result = admission.run(analyze, priority)
+            cache.set(cache_key, analysis_result, settings.CACHE_TIMEOUT)
+        return analysis_result
+    
+    try:
+        return _in_flight.do(cache_key, analyze_and_cache, settings.SINGLE_FLIGHT_TIMEOUT)
+    except SingleFlightTimeout:
+        logger.warning("Timed out waiting for in-flight %s analysis: %s", label, cache_key)
+        return fallback()
+    except admission.Overloaded:
+        if not admission.degrades():
+            raise
+        # Shed: answer from keywords, but leave the cache for a real verdict
+        logger.warning("Shed %s analysis under load: %s", label, cache_key)
+        return fallback()
+
+async def _acached_analysis(cache_key, analyze, fallback, label, similar=None, priority=None):
+    """Async counterpart of _cached_analysis; analyze is a coroutine function"""
+    with metrics.timed('cache_lookup'):
+        cached_result = await cache.aget(cache_key)
+    if cached_result:
+        metrics.CACHE_LOOKUPS.inc(label, 'hit')
+        logger.debug("Cache HIT for %s analysis: %s", label, cache_key)
+        return cached_result
+    
+    metrics.CACHE_LOOKUPS.inc(label, 'miss')
+    logger.debug("Cache MISS for %s analysis: %s", label, cache_key)
+    await admission.acharge()
+    
+    async def analyze_and_cache():
+        analysis_result = await cache.aget(cache_key)
+        if not analysis_result and similar is not None:
+            analysis_result = await sync_to_async(similar)()
+        if not analysis_result:
+            if priority is None:
+                analysis_result = await analyze()
+            else:
+                analysis_result = await admission.arun(analyze, priority)
+            await cache.aset(cache_key, analysis_result, settings.CACHE_TIMEOUT)
+        return analysis_result
+    
+    try:
+        return await _in_flight.ado(cache_key, analyze_and_cache, settings.SINGLE_FLIGHT_TIMEOUT)
+    except SingleFlightTimeout:
+        logger.warning("Timed out waiting for in-flight %s analysis: %s", label, cache_key)
+        return fallback()
+    except admission.Overloaded:
+        if not admission.degrades():
+            raise
+        logger.warning("Shed %s analysis under load: %s", label, cache_key)
+        return fallback()
 
-def generate_cache_key(content, content_type='text'):
+def _similar_image_result(cache_key, image_content):
     """
-    Generate a unique cache key based on content and type
+    Return the cached verdict of a perceptually near-identical image
+    (recompressed, resized, lightly cropped) with the same OCR text, or
+    None. The image is indexed under cache_key either way.
+    
+    Screenshots sharing a layout hash alike whatever they say, so the
+    lookup only runs when OCR can vouch for the content (hybrid mode), and
+    never for text-heavy images: their verdict comes from the text cache.
+    """
+    if not _use_ocr():
+        return None
+    ocr_result = _ocr_image(image_content)
+    if ocr_result is None or ocr.is_text_heavy(ocr_result, count=False):
+        return None
+    phash = image_hash.dhash(image_content)
+    if phash is None:
+        return None
+    
+    content = generate_cache_key(ocr_result['text'], 'ocr_text')
+    analysis_result = None
+    match = _image_index.lookup(phash, content)
+    if match:
+        similar_hash, similar_key, distance = match
+        analysis_result = cache.get(similar_key)
+        if analysis_result:
+            logger.debug("Near-duplicate image HIT (distance %s): %s", distance, similar_key)
+        else:
+            # The verdict it pointed to has expired
+            _image_index.discard(similar_hash)
+    
+    _image_index.add(phash, cache_key, content)
+    return analysis_result
+
+def _prepare_image(image_content, content_type):
+    """
+    Normalized upload for the vision model, or the original bytes if the
+    image cannot be re-encoded
     """
-    content_hash = hashlib.md5(content.encode() if isinstance(content, str) else content).hexdigest()
-    return f"safeguard_{content_type}_{content_hash}"
+    try:
+        return image_preprocessor.normalize_image(image_content, content_type)
+    except Exception as e:
+        logger.warning("Image normalization error: %s", e)
+        return image_content, content_type
+
+def _use_ocr():
+    return settings.IMAGE_ANALYSIS_MODE == 'hybrid'
+
+def _ocr_image(image_content):
+    """OCR result for an image, cached by image hash; None if OCR is unavailable or failed"""
+    cache_key = generate_cache_key(image_content, 'ocr')
+    ocr_result = cache.get(cache_key)
+    if ocr_result is None:
+        ocr_result = ocr.extract_text(image_content)
+        if ocr_result is not None:
+            cache.set(cache_key, ocr_result, settings.CACHE_TIMEOUT)
+    return ocr_result
+
+async def _aocr_image(image_content):
+    cache_key = generate_cache_key(image_content, 'ocr')
+    ocr_result = await cache.aget(cache_key)
+    if ocr_result is None:
+        ocr_result = await ocr.aextract_text(image_content)
+        if ocr_result is not None:
+            await cache.aset(cache_key, ocr_result, settings.CACHE_TIMEOUT)
+    return ocr_result
+
+def _with_detected_text(analysis_result, ocr_result):
+    if ocr_result and ocr_result['text']:
+        # Cached results are shared; never modify them in place
+        return {**analysis_result, 'detected_text': ocr_result['text']}
+    return analysis_result
+
+def _analyze_image_hybrid(detector, image_content, content_type):
+    """
+    Screenshots that are mostly text are analyzed as text, through the text
+    cache; everything else goes to the vision model
+    """
+    ocr_result = _ocr_image(image_content) if _use_ocr() else None
+    if ocr_result and ocr.is_text_heavy(ocr_result):
+        text = ocr_result['text']
+        analysis_result = _cached_analysis(
+            generate_cache_key(text, 'text', 'en'),
+            lambda: detector.analyze_text(text),
+            lambda: detector._fallback_analysis(text),
+            'text',
+        )
+    else:
+        analysis_result = detector.analyze_image(*_prepare_image(image_content, content_type))
+    return _with_detected_text(analysis_result, ocr_result)
+
+def _long_text_chunks(text):
+    return text_chunker.chunk_text(text, settings.LONG_TEXT_CHUNK_CHARS, settings.LONG_TEXT_CHUNK_OVERLAP)
+
+def _too_many_chunks(text):
+    """Long texts fan out into one model call per chunk; refuse them past the cap"""
+    return text_chunker.is_long_text(text) and len(_long_text_chunks(text)) > settings.LONG_TEXT_MAX_CHUNKS
+
+TOO_MANY_CHUNKS = {'error': 'Text is too long to analyze; split it into smaller parts'}
+
+def _analyze_long_text(text, language):
+    """
+    Analyze a long text (e.g. a chat export) chunk by chunk and merge the
+    chunk verdicts into one report. Chunks are cached on their own, so
+    re-submitting an export with a few new lines only analyzes the chunks
+    that changed.
+    """
+    chunks = _long_text_chunks(text)
+    cache_keys = [generate_cache_key(chunk, 'text', language) for chunk in chunks]
+    with metrics.timed('cache_lookup'):
+        cached_results = cache.get_many(cache_keys)
+    
+    missing = {}
+    for cache_key, chunk in zip(cache_keys, chunks):
+        if cache_key not in cached_results:
+            missing.setdefault(cache_key, chunk)
+    
+    metrics.CACHE_LOOKUPS.inc('text', 'hit', amount=len(chunks) - len(missing))
+    metrics.CACHE_LOOKUPS.inc('text', 'miss', amount=len(missing))
+    logger.info("Long text analysis: %d chunks, %d cached", len(chunks), len(chunks) - len(missing))
+    
+    if missing:
+        detector = get_detector()
+        fresh_results = dict(zip(missing, detector.analyze_text_chunks(list(missing.values()), language)))
+        cache.set_many(fresh_results, settings.CACHE_TIMEOUT)
+        cached_results.update(fresh_results)
+    
+    results = [cached_results[cache_key] for cache_key in cache_keys]
+    sources = [{'chunk': index, 'excerpt': chunk[:160]} for index, chunk in enumerate(chunks)]
+    return report.combine_verdicts(results, sources)
+
+def analyze_text_content(text, language, cache_key=None, priority=None):
+    """
+    Cached analysis of one text, chunked when it is long. Shared by the
+    analyze views and the job worker (which passes no admission priority).
+    """
+    cache_key = cache_key or generate_cache_key(text, 'text', language)
+    detector = get_detector()
+    if text_chunker.is_long_text(text):
+        analyze = lambda: _analyze_long_text(text, language)
+    else:
+        analyze = lambda: detector.analyze_text(text, language)
+    return _cached_analysis(
+        cache_key,
+        analyze,
+        lambda: detector._fallback_analysis(text, language),
+        'text',
+        priority=priority,
+    )
+
+def analyze_text_contents(texts, language, priority=None):
+    """Cached analysis of many texts, packing cache misses into shared model calls"""
+    cache_keys = [generate_cache_key(text, 'text', language) for text in texts]
+    with metrics.timed('cache_lookup'):
+        cached_results = cache.get_many(cache_keys)
+    
+    # Unique misses only: duplicates inside one dump share a single analysis
+    missing = {}
+    for cache_key, text in zip(cache_keys, texts):
+        if cache_key not in cached_results:
+            missing.setdefault(cache_key, text)
+    
+    metrics.CACHE_LOOKUPS.inc('text', 'hit', amount=len(texts) - len(missing))
+    metrics.CACHE_LOOKUPS.inc('text', 'miss', amount=len(missing))
+    logger.info("Batch text analysis: %d items, %d cached", len(texts), len(texts) - len(missing))
+    
+    if missing:
+        detector = get_detector()
+        analyze = lambda: detector.analyze_text_batch(list(missing.values()), language)
+        try:
+            fresh_results = analyze() if priority is None else admission.run(analyze, priority)
+        except admission.Overloaded:
+            if not admission.degrades():
+                raise
+            logger.warning("Shed batch text analysis under load: %d items", len(missing))
+            cached_results.update(
+                (cache_key, detector._fallback_analysis(text, language)) for cache_key, text in missing.items()
+            )
+        else:
+            fresh_results = dict(zip(missing, fresh_results))
+            cache.set_many(fresh_results, settings.CACHE_TIMEOUT)
+            cached_results.update(fresh_results)
+    
+    return [cached_results[cache_key] for cache_key in cache_keys]
+
+def analyze_image_content(image_content, mime_type, cache_key=None, priority=None):
+    """Cached analysis of one already validated image"""
+    cache_key = cache_key or generate_cache_key(image_content, 'image')
+    return _analyze_uploaded_image(get_detector(), cache_key, image_content, mime_type, priority)
+
+def _sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def _stream_text_analysis(cache_key, text, language):
+    """
+    Server-sent events for a text analysis: one event per result field as
+    soon as the model produces it, then a final 'done' event with the
+    whole result. The result is cached like a regular analysis.
+    """
+    with metrics.timed('cache_lookup'):
+        analysis_result = cache.get(cache_key)
+    if analysis_result:
+        metrics.CACHE_LOOKUPS.inc('text', 'hit')
+        logger.debug("Cache HIT for text analysis: %s", cache_key)
+        for field, value in AnalysisResponseSerializer(analysis_result).data.items():
+            yield _sse_event(field, value)
+    else:
+        metrics.CACHE_LOOKUPS.inc('text', 'miss')
+        logger.debug("Cache MISS for text analysis: %s", cache_key)
+        detector = get_detector()
+        try:
+            with admission.admitted(admission.text_priority(text, language)):
+                for field, value in detector.stream_text(text, language):
+                    if field == 'result':
+                        analysis_result = value
+                    else:
+                        yield _sse_event(field, value)
+            cache.set(cache_key, analysis_result, settings.CACHE_TIMEOUT)
+        except admission.Overloaded:
+            # The stream has already started, so a 429 is no longer possible
+            logger.warning("Shed text analysis under load: %s", cache_key)
+            analysis_result = detector._fallback_analysis(text, language)
+            for field, value in AnalysisResponseSerializer(analysis_result).data.items():
+                yield _sse_event(field, value)
+    
+    yield _sse_event('done', AnalysisResponseSerializer(analysis_result).data)
 
 @api_view(['POST'])
+@renderer_classes([*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer])
+@admission.controlled()
 def analyze_text(request):
     serializer = AbuseAnalysisSerializer(data=request.data)
     
@@ -27,28 +374,49 @@ def analyze_text(request):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
     text = serializer.validated_data.get('text')
     language = serializer.validated_data.get("language", "en")
+    if _too_many_chunks(text):
+        return Response(TOO_MANY_CHUNKS, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
     
     # Generate cache key
-    cache_key = generate_cache_key(text, 'text')
-    
-    # Check cache first
-    cached_result = cache.get(cache_key)
+    cache_key = generate_cache_key(text, 'text', language)
     
-    if cached_result:
-        print(f"Cache HIT for text analysis: {cache_key}")
-        response_serializer = AnalysisResponseSerializer(cached_result)
-        return Response(response_serializer.data)
-    
-    print(f"Cache MISS for text analysis: {cache_key}")
+    # ?stream=1: push fields as server-sent events while the model answers.
+    # Long texts are chunked instead and always answered in one piece.
+    if request.query_params.get('stream') in ('1', 'true') and not text_chunker.is_long_text(text):
+        # Charged up front: once the stream has started a 429 is no longer possible
+        admission.charge()
+        response = StreamingHttpResponse(
+            _stream_text_analysis(cache_key, text, language),
+            content_type='text/event-stream',
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'  # don't let nginx buffer the stream
+        return response
     
-    detector = AbuseDetector()
-    analysis_result = detector.analyze_text(text)
-    cache.set(cache_key, analysis_result, settings.CACHE_TIMEOUT)
+    analysis_result = analyze_text_content(
+        text, language, cache_key, priority=admission.text_priority(text, language)
+    )
     
     response_serializer = AnalysisResponseSerializer(analysis_result)
     return Response(response_serializer.data)
 
 @api_view(['POST'])
+@admission.controlled(cost=2)
+def analyze_text_batch(request):
+    """Analyze a list of texts, packing cache misses into shared model calls"""
+    serializer = BatchAnalysisSerializer(data=request.data)
+    
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    texts = serializer.validated_data.get('texts')
+    language = serializer.validated_data.get('language', 'en')
+    
+    results = analyze_text_contents(texts, language, priority=admission.PRIORITY_NORMAL)
+    response_serializer = AnalysisResponseSerializer(results, many=True)
+    return Response({'results': response_serializer.data})
+
+@api_view(['POST'])
+@admission.controlled(cost=2)
 def analyze_image(request):
     """Analyze image content directly using Gemini Vision"""
     if 'image' not in request.FILES:
@@ -67,268 +435,445 @@ def analyze_image(request):
             status=status.HTTP_400_BAD_REQUEST
         )
     # Read image content for cache key
-    image_content = image_file.read()
-    image_file.seek(0)  # Reset file pointer for processing
+    with metrics.timed('upload_read'):
+        image_content = image_file.read()
+    
+    # Reject unreadable files and decompression bombs before decoding anything
+    try:
+        image_preprocessor.check_image(image_content)
+    except image_preprocessor.ImageRejected as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
     
     # Generate cache key from image content
     cache_key = generate_cache_key(image_content, 'image')
     
-    # Check cache first
-    cached_result = cache.get(cache_key)
-    if cached_result:
-        print(f"Cache HIT for image analysis: {cache_key}")
-        response_serializer = AnalysisResponseSerializer(cached_result)
-        return Response(response_serializer.data)
-    
-    print(f"Cache MISS for image analysis: {cache_key}")    
-    
     # Analyze image directly using AI vision
-    detector = AbuseDetector()
-    analysis_result = detector.analyze_image(image_file)
-    
-    cache.set(cache_key, analysis_result, settings.CACHE_TIMEOUT)
+    analysis_result = analyze_image_content(
+        image_content, image_file.content_type, cache_key, priority=admission.PRIORITY_NORMAL
+    )
     
     response_serializer = AnalysisResponseSerializer(analysis_result)
     return Response(response_serializer.data)
 
-@api_view(["GET"])
+def _iter_uploaded_images(request):
+    """
+    (name, content, error) for every file in 'images', then for every file
+    of the zip in 'archive', which is read one member at a time
+    """
+    max_bytes = settings.MULTI_IMAGE_MAX_BYTES
+    for image_file in request.FILES.getlist('images'):
+        if image_file.size > max_bytes:
+            yield image_file.name, None, 'Image file is too large'
+        else:
+            yield image_file.name, image_file.read(), None
+    
+    if 'archive' in request.FILES:
+        yield from upload_archive.iter_zip_members(
+            request.FILES['archive'],
+            settings.MULTI_IMAGE_MAX_FILES,
+            max_bytes,
+            settings.ARCHIVE_MAX_TOTAL_BYTES,
+        )
+
+def _analyze_uploaded_image(detector, cache_key, image_content, mime_type, priority=None):
+    return _cached_analysis(
+        cache_key,
+        lambda: _analyze_image_hybrid(detector, image_content, mime_type),
+        lambda: detector._fallback_analysis(""),
+        'image',
+        similar=lambda: _similar_image_result(cache_key, image_content),
+        priority=priority,
+    )
 
-def support_resources(request):
+@api_view(['POST'])
+@admission.controlled(cost=4)
+def analyze_images(request):
+    """
+    Analyze several images of one thread at once, uploaded as 'images'
+    files and/or an 'archive' zip. Identical images are analyzed once; the
+    response has a result per image and an overall thread verdict.
+    """
+    if 'images' not in request.FILES and 'archive' not in request.FILES:
+        return Response(
+            {'error': 'No image files or archive provided'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    detector = get_detector()
+    items = []
+    analyses = {}  # cache key -> future, one per unique image
+    try:
+        for name, image_content, error in _iter_uploaded_images(request):
+            if len(items) >= settings.MULTI_IMAGE_MAX_FILES:
+                raise upload_archive.ArchiveRejected(
+                    f"At most {settings.MULTI_IMAGE_MAX_FILES} images can be analyzed at once"
+                )
+            if error is None:
+                try:
+                    mime_type = image_preprocessor.check_image(image_content)
+                except image_preprocessor.ImageRejected as e:
+                    error = str(e)
+            if error is not None:
+                items.append({'name': name, 'error': error})
+                continue
+            
+            cache_key = generate_cache_key(image_content, 'image')
+            item = {'name': name, 'cache_key': cache_key}
+            if cache_key in analyses:
+                item['duplicate_of'] = analyses[cache_key][0]
+            else:
+                # Start analyzing while the rest of the upload is still being read,
+                # in this request's context so a miss charges its rate limit
+                analyses[cache_key] = (name, _image_pool.submit(
+                    contextvars.copy_context().run,
+                    _analyze_uploaded_image, detector, cache_key, image_content, mime_type,
+                    admission.PRIORITY_NORMAL,
+                ))
+            items.append(item)
+    except upload_archive.ArchiveRejected as e:
+        for _, future in analyses.values():
+            future.cancel()
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    logger.info("Multi-image analysis: %d files, %d unique images", len(items), len(analyses))
+    
+    results = {cache_key: future.result() for cache_key, (_, future) in analyses.items()}
+    for item in items:
+        cache_key = item.pop('cache_key', None)
+        if cache_key:
+            item['result'] = AnalysisResponseSerializer(results[cache_key]).data
     
-    country = request.GET.get("country", "KE")
-    
-    resources = {
-            "KE": [
-                {
-                "name": "Gender Violence Recovery Centre",
-                "phone": "+254-703-034-000",
-                "website": "https://gvrc.or.ke/",
-                "description": "Medical and psychological support for GBV survivors.",
-                "category": "medical"
-                },
-                {
-                "name": "FIDA Kenya",
-                "phone": "+254-20-2711535",
-                "website": "https://fidakenya.org",
-                "description": "Legal aid and support for women.",
-                "category": "legal"
-                },
-                {
-                "name": "Childline Kenya",
-                "phone": "116",
-                "website": "https://childlinekenya.co.ke",
-                "description": "National helpline for children affected by violence and abuse.",
-                "category": "emergency"
-                },
-                {
-                "name": "CREAW Kenya",
-                "phone": "+254-722-822-998",
-                "website": "https://creawkenya.org",
-                "description": "Rights-based organization supporting survivors of GBV.",
-                "category": "support"
-                }
-            ],
-
-            "NG": [
-                {
-                "name": "Women at Risk International Foundation (WARIF)",
-                "phone": "+234-803-334-5566",
-                "website": "https://warifng.org",
-                "description": "GBV prevention, rape crisis, and response services.",
-                "category": "support"
-                },
-                {
-                "name": "Mirabel Centre",
-                "phone": "+234-815-584-0000",
-                "website": "https://mirabelcentre.org",
-                "description": "Sexual assault referral centre providing free medical & counseling services.",
-                "category": "medical"
-                },
-                {
-                "name": "National GBV Hotline (Nigeria)",
-                "phone": "0800 033 33 33",
-                "website": "",
-                "description": "24/7 national helpline for reporting GBV cases.",
-                "category": "emergency"
-                }
-            ],
-
-            "ZA": [
-                {
-                "name": "GBV Command Centre",
-                "phone": "0800 428 428",
-                "website": "",
-                "description": "24/7 emergency support and counseling for GBV survivors.",
-                "category": "emergency"
-                },
-                {
-                "name": "TEARS Foundation South Africa",
-                "phone": "+27-10-590-5920",
-                "website": "https://tears.co.za",
-                "description": "Support for survivors of rape and sexual abuse.",
-                "category": "support"
-                },
-                {
-                "name": "People Opposing Women Abuse (POWA)",
-                "phone": "+27-11-642-4345",
-                "website": "https://powa.co.za",
-                "description": "Shelter, legal, and counseling services for abused women.",
-                "category": "legal"
-                }
-            ],
-
-            "UG": [
-                {
-                "name": "Uganda Child Helpline",
-                "phone": "116",
-                "website": "https://mglsd.go.ug",
-                "description": "National toll-free helpline for child and women protection.",
-                "category": "emergency"
-                },
-                {
-                "name": "Uganda Women’s Network (UWONET)",
-                "phone": "+256-414-286-063",
-                "website": "https://uwonet.or.ug",
-                "description": "Advocacy and support services for women survivors.",
-                "category": "support"
-                }
-            ],
-
-            "TZ": [
-                {
-                "name": "Tanzania National GBV Helpline",
-                "phone": "116",
-                "website": "",
-                "description": "Child and gender-based violence hotline.",
-                "category": "emergency"
-                },
-                {
-                "name": "Tanzania Gender Networking Programme",
-                "phone": "+255-22-266-4051",
-                "website": "https://tgnp.or.tz",
-                "description": "Support and advocacy for women and girls experiencing violence.",
-                "category": "support"
-                }
-            ],
-
-            "GH": [
-                {
-                "name": "Ghana Domestic Violence & Victim Support Unit (DOVVSU)",
-                "phone": "+233-302-777-395",
-                "website": "",
-                "description": "Police-led support for victims of domestic and sexual violence.",
-                "category": "emergency"
-                },
-                {
-                "name": "ARK Foundation Ghana",
-                "phone": "+233-302-911-385",
-                "website": "https://arkfoundationghana.org",
-                "description": "Shelter, legal, and counseling services for survivors.",
-                "category": "support"
-                }
-            ],
-
-            "RW": [
-                {
-                "name": "Isange One Stop Center",
-                "phone": "116",
-                "website": "https://npprwanda.gov.rw",
-                "description": "Free medical, legal, and psychosocial support to GBV victims.",
-                "category": "medical"
-                }
-            ],
-
-            "ET": [
-                {
-                "name": "Ethiopian Women Lawyers Association",
-                "phone": "+251-11-467-1750",
-                "website": "https://ewlaethiopia.org",
-                "description": "Legal assistance and advocacy for women survivors.",
-                "category": "legal"
-                },
-                {
-                "name": "Addis Ababa Women’s Shelter",
-                "phone": "+251-11-552-5995",
-                "website": "",
-                "description": "Shelter and support services for abused women.",
-                "category": "support"
-                }
-            ],
-
-            "ZM": [
-                {
-                "name": "Yamala Crisis Line Zambia",
-                "phone": "116",
-                "website": "",
-                "description": "GBV hotline for women, girls, and children.",
-                "category": "emergency"
-                },
-                {
-                "name": "Women and Law in Southern Africa (WLSA Zambia)",
-                "phone": "+260-211-255-539",
-                "website": "https://wlsazambia.org",
-                "description": "Legal services and protection programs for women survivors.",
-                "category": "legal"
-                }
-            ],
-
-            "ZW": [
-                {
-                "name": "Musasa Project",
-                "phone": "+263-24-279-303/4",
-                "website": "https://musasa.co.zw",
-                "description": "Counseling, shelters, and protection services for GBV survivors.",
-                "category": "support"
-                },
-                {
-                "name": "Zimbabwe National GBV Hotline",
-                "phone": "0808 00 33 333",
-                "website": "",
-                "description": "24/7 hotline for victims of gender-based violence.",
-                "category": "emergency"
-                }
-            ]
-            }
-
-    
-
-
-    country_resources = resources.get(country, resources['KE'])
-    return Response(country_resources)
+    verdict = None
+    if results:
+        verdict = report.combine_verdicts(
+            list(results.values()),
+            [{'image': name} for name, _ in analyses.values()],
+        )
+        verdict = AnalysisResponseSerializer(verdict).data
+    
+    return Response({
+        'images': items,
+        'unique_images': len(analyses),
+        'verdict': verdict,
+    })
 
-@api_view(['GET'])
-def safety_tips(request):
-    """Get digital safety tips"""
-    tips = {
-        'general': [
-            'Never share passwords or personal information online',
-            'Use two-factor authentication on all accounts',
-            'Be cautious about what you share on social media',
-            'Regularly check your privacy settings',
-            'Keep software and apps updated'
-        ],
-        'harassment': [
-            'Document all abusive messages with screenshots',
-            'Block the harasser immediately',
-            'Report to the platform and local authorities',
-            'Reach out to trusted friends or family',
-            'Contact support organizations for help'
-        ],
-        'emergency': [
-            'If in immediate danger, contact local emergency services',
-            'Save evidence of threats for legal purposes',
-            'Inform trusted contacts about your situation',
-            'Consider changing your online routines and accounts'
-        ]
+def _job_data(job):
+    data = {
+        'job_id': str(job.pk),
+        'kind': job.kind,
+        'status': job.status,
+        'created_at': job.created_at,
+        'finished_at': job.finished_at,
     }
+    if job.status == AnalysisJob.DONE:
+        data['result'] = AnalysisResponseSerializer(job.result).data
+    elif job.status == AnalysisJob.FAILED:
+        data['error'] = job.error
+    return data
+
+@api_view(['POST'])
+@admission.controlled()
+def submit_job(request):
+    """
+    Queue a text ('text') or image ('image' file) analysis and return its
+    job id at once; poll /api/jobs/<id>/ for the result
+    """
+    serializer = JobSubmitSerializer(data=request.data)
     
-    return Response(tips)
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    priority = job_queue.PRIORITIES[serializer.validated_data.get('priority', 'normal')]
+    
+    if 'image' in request.FILES:
+        image_file = request.FILES['image']
+        if not image_file.content_type.startswith('image/'):
+            return Response({'error': 'File must be an image'}, status=status.HTTP_400_BAD_REQUEST)
+        if image_file.size > settings.MULTI_IMAGE_MAX_BYTES:
+            return Response({'error': 'Image file is too large'}, status=status.HTTP_400_BAD_REQUEST)
+        image_content = image_file.read()
+        try:
+            image_preprocessor.check_image(image_content)
+        except image_preprocessor.ImageRejected as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Queued work is model work: charge the rate limit now
+        admission.charge()
+        job = job_queue.submit(
+            AnalysisJob.IMAGE,
+            generate_cache_key(image_content, 'image'),
+            priority,
+            payload=image_content,
+            mime_type=image_file.content_type,
+        )
+    elif serializer.validated_data.get('text'):
+        text = serializer.validated_data['text']
+        language = serializer.validated_data.get('language', 'en')
+        if _too_many_chunks(text):
+            return Response(TOO_MANY_CHUNKS, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        admission.charge()
+        job = job_queue.submit(
+            AnalysisJob.TEXT,
+            generate_cache_key(text, 'text', language),
+            priority,
+            text=text,
+            language=language,
+        )
+    else:
+        return Response({'error': 'Provide a text or an image file'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    return Response(_job_data(job), status=status.HTTP_202_ACCEPTED)
 
 @api_view(['GET'])
+def job_detail(request, job_id):
+    job = AnalysisJob.objects.filter(pk=job_id).defer('text', 'payload').first()
+    if job is None:
+        return Response({'error': 'Unknown job'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(_job_data(job))
+
+@api_view(['POST'])
+def create_conversation(request):
+    """Open a conversation session; messages are then appended to it"""
+    serializer = ConversationSessionSerializer(data=request.data)
+    
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    
+    session = conversation_sessions.create_session(serializer.validated_data.get('language', 'en'))
+    return Response(conversation_sessions.public_view(session), status=status.HTTP_201_CREATED)
+
+@api_view(['GET', 'DELETE'])
+def conversation_detail(request, session_id):
+    if request.method == 'DELETE':
+        conversation_sessions.delete_session(session_id)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    
+    session = conversation_sessions.load_session(session_id)
+    if session is None:
+        return Response({'error': 'Unknown or expired session'}, status=status.HTTP_404_NOT_FOUND)
+    return Response(conversation_sessions.public_view(session))
+
+@api_view(['POST'])
+@admission.controlled()
+def append_conversation_messages(request, session_id):
+    """
+    Analyze only the new messages of a conversation, in the context of the
+    session's rolling summary, and update the session's overall verdict
+    """
+    serializer = ConversationMessagesSerializer(data=request.data)
+    
+    if not serializer.is_valid():
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    messages = serializer.validated_data.get('messages')
+    
+    try:
+        with conversation_sessions.session_lock(session_id):
+            session = conversation_sessions.load_session(session_id)
+            if session is None:
+                return Response({'error': 'Unknown or expired session'}, status=status.HTTP_404_NOT_FOUND)
+            
+            # Shed appends get a 429: a keyword verdict would skew the session
+            result = admission.run(
+                lambda: get_detector().analyze_conversation(
+                    session['summary'],
+                    session['recent_messages'],
+                    messages,
+                    session['language'],
+                ),
+                admission.text_priority("\n".join(messages), session['language']),
+            )
+            update = conversation_sessions.apply_verdict(session, messages, result)
+            conversation_sessions.save_session(session)
+    except conversation_sessions.SessionBusy as e:
+        return Response({'error': str(e)}, status=status.HTTP_409_CONFLICT)
+    
+    return Response({'update': update, 'session': conversation_sessions.public_view(session)})
+
+def _request_data(request):
+    """
+    Parse a JSON or form-encoded body for the plain Django async views
+    """
+    if request.content_type == 'application/json':
+        try:
+            return json.loads(request.body or b'{}')
+        except ValueError:
+            return None
+    return request.POST
+
+@csrf_exempt
+@require_POST
+@admission.controlled()
+async def analyze_text_async(request):
+    """Async counterpart of analyze_text, served natively under ASGI"""
+    data = _request_data(request)
+    if data is None:
+        return JsonResponse({'error': 'Malformed JSON body'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = AbuseAnalysisSerializer(data=data)
+    if not serializer.is_valid():
+        return JsonResponse(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+    text = serializer.validated_data.get('text')
+    language = serializer.validated_data.get('language', 'en')
+    if _too_many_chunks(text):
+        return JsonResponse(TOO_MANY_CHUNKS, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+    
+    cache_key = generate_cache_key(text, 'text', language)
+    
+    detector = get_detector()
+    if text_chunker.is_long_text(text):
+        analyze = lambda: sync_to_async(_analyze_long_text)(text, language)
+    else:
+        analyze = lambda: detector.analyze_text_async(text, language)
+    analysis_result = await _acached_analysis(
+        cache_key,
+        analyze,
+        lambda: detector._fallback_analysis(text, language),
+        'text',
+        priority=admission.text_priority(text, language),
+    )
+    
+    return JsonResponse(AnalysisResponseSerializer(analysis_result).data)
+
+@csrf_exempt
+@require_POST
+@admission.controlled(cost=2)
+async def analyze_image_async(request):
+    """Async counterpart of analyze_image, served natively under ASGI"""
+    if 'image' not in request.FILES:
+        return JsonResponse(
+            {'error': 'No image file provided'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    
+    image_file = request.FILES['image']
+    if not image_file.content_type.startswith('image/'):
+        return JsonResponse(
+            {'error': 'File must be an image'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    with metrics.timed('upload_read'):
+        image_content = image_file.read()
+    
+    try:
+        image_preprocessor.check_image(image_content)
+    except image_preprocessor.ImageRejected as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    cache_key = generate_cache_key(image_content, 'image')
+    
+    detector = get_detector()
+    
+    async def analyze():
+        ocr_result = await _aocr_image(image_content) if _use_ocr() else None
+        if ocr_result and ocr.is_text_heavy(ocr_result):
+            text = ocr_result['text']
+            analysis_result = await _acached_analysis(
+                generate_cache_key(text, 'text', 'en'),
+                lambda: detector.analyze_text_async(text),
+                lambda: detector._fallback_analysis(text),
+                'text',
+            )
+        else:
+            # Re-encoding is CPU-bound; keep it off the event loop
+            image_bytes, mime_type = await sync_to_async(_prepare_image)(image_content, image_file.content_type)
+            analysis_result = await detector.analyze_image_async(image_bytes, mime_type)
+        return _with_detected_text(analysis_result, ocr_result)
+    
+    analysis_result = await _acached_analysis(
+        cache_key,
+        analyze,
+        lambda: detector._fallback_analysis(""),
+        'image',
+        similar=lambda: _similar_image_result(cache_key, image_content),
+        priority=admission.PRIORITY_NORMAL,
+    )
+    
+    return JsonResponse(AnalysisResponseSerializer(analysis_result).data)
+
+def _static_cache_control():
+    return (
+        f"public, max-age={settings.STATIC_RESPONSE_MAX_AGE}, "
+        f"stale-while-revalidate={settings.STATIC_RESPONSE_STALE_WHILE_REVALIDATE}"
+    )
+
+@require_safe
+def support_resources(request):
+    """
+    Support organisations for ?country= (default KE), optionally narrowed
+    to one ?category=. Several countries (?country=KE,NG or a repeated
+    parameter) return an object keyed by country. Responses are rendered
+    and compressed once, and revalidated with ETags.
+    """
+    store = resource_store.get_resource_store()
+    countries = [
+        country.strip()
+        for value in request.GET.getlist("country")
+        for country in value.split(",")
+        if country.strip()
+    ]
+    category = request.GET.get("category") or None
+    
+    if len(countries) <= 1:
+        body = store.body(countries[0] if countries else None, category)
+    else:
+        body = store.combined_body(countries, category)
+    return http_cache.cached_json_response(request, body, _static_cache_control())
+
+SAFETY_TIPS = {
+    'general': [
+        'Never share passwords or personal information online',
+        'Use two-factor authentication on all accounts',
+        'Be cautious about what you share on social media',
+        'Regularly check your privacy settings',
+        'Keep software and apps updated'
+    ],
+    'harassment': [
+        'Document all abusive messages with screenshots',
+        'Block the harasser immediately',
+        'Report to the platform and local authorities',
+        'Reach out to trusted friends or family',
+        'Contact support organizations for help'
+    ],
+    'emergency': [
+        'If in immediate danger, contact local emergency services',
+        'Save evidence of threats for legal purposes',
+        'Inform trusted contacts about your situation',
+        'Consider changing your online routines and accounts'
+    ]
+}
+_safety_tips_body = http_cache.CachedBody.from_data(SAFETY_TIPS)
+
+@require_safe
+def safety_tips(request):
+    """Get digital safety tips"""
+    return http_cache.cached_json_response(request, _safety_tips_body, _static_cache_control())
+
+_health_body = http_cache.CachedBody.from_data({
+    'status': 'healthy',
+    'service': 'SafeguardAI Backend',
+    'version': '1.0.0'
+})
+
+@require_safe
 def health_check(request):
     """Health check endpoint"""
-    return Response({
-        'status': 'healthy',
-        'service': 'SafeguardAI Backend',
-        'version': '1.0.0'
-    })
\ No newline at end of file
+    # Probes must reach the service, never a cache; no-cache still allows 304s
+    return http_cache.cached_json_response(request, _health_body, "no-cache")
+
+@api_view(['GET'])
+def service_stats(request):
+    """Runtime counters for this worker process"""
+    stats = {}
+    if hasattr(cache, 'stats'):
+        stats['cache'] = cache.stats()
+    stats['image_near_duplicates'] = _image_index.stats()
+    stats['image_preprocessing'] = image_preprocessor.stats()
+    stats['ocr'] = ocr.stats()
+    stats['structured_output'] = structured_output.stats()
+    stats['admission'] = admission.stats()
+    stats['gemini'] = upstream_stats()
+    return Response(stats)
+
+@require_safe
+def prometheus_metrics(request):
+    """Request, stage-latency, cache and verdict metrics in Prometheus text format"""
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
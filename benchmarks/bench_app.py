@@ -0,0 +1,19 @@
+"""
+WSGI and ASGI entry points for load-test servers: the real application
+with Gemini replaced by the local fake.
+
+    gunicorn benchmarks.bench_app:application
+    gunicorn -k uvicorn.workers.UvicornWorker benchmarks.bench_app:asgi_application
+"""
+import os
+
+from benchmarks import fake_gemini
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "benchmarks.bench_settings")
+fake_gemini.install()
+
+from django.core.asgi import get_asgi_application  # noqa: E402
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+
+application = get_wsgi_application()
+asgi_application = get_asgi_application()
@@ -0,0 +1,39 @@
+"""
+Settings for load-test servers: the app's settings with every file it
+writes (database, caches, rate-limit buckets, metrics) under BENCH_DIR,
+so a benchmark never touches the real data.
+"""
+import os
+import warnings
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+from safeguard_be.settings import *  # noqa: E402,F401,F403
+
+BENCH_DIR = os.environ["BENCH_DIR"]
+
+DEBUG = False
+ALLOWED_HOSTS = ["127.0.0.1", "localhost"]
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": os.path.join(BENCH_DIR, "db.sqlite3"),
+        "OPTIONS": {"timeout": 20},
+    }
+}
+CACHES["default"]["LOCATION"] = os.path.join(BENCH_DIR, "cache.sqlite3")  # noqa: F405
+CACHES["conversations"]["LOCATION"] = os.path.join(BENCH_DIR, "conversations.sqlite3")  # noqa: F405
+ADMISSION_DB_PATH = os.path.join(BENCH_DIR, "admission.sqlite3")
+METRICS_DIR = os.path.join(BENCH_DIR, "metrics")
+
+# Measure the analysis paths themselves unless a run asks otherwise
+ADMISSION_ENABLED = os.getenv("ADMISSION_ENABLED", "false").lower() == "true"
+TRIAGE_ENABLED = False
+TRIAGE_RECORD_VERDICTS = False
+# No tesseract on a plain CI box; images go to the (fake) vision model
+IMAGE_ANALYSIS_MODE = os.getenv("IMAGE_ANALYSIS_MODE", "vision")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "ERROR")
+LOGGING["loggers"]["api"]["level"] = LOG_LEVEL  # noqa: F405
+# Static files are never collected for a benchmark run
+warnings.filterwarnings("ignore", message="No directory at")
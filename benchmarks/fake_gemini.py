@@ -0,0 +1,157 @@
+"""
+Local stand-in for google.generativeai, for load tests that must not spend
+Gemini quota. install() swaps genai.GenerativeModel for a fake whose
+answers come from the recorded corpus in data/sample_responses.jsonl.
+
+Configured from the environment, so it works inside gunicorn workers:
+
+    FAKE_GEMINI_LATENCY     fixed:S | uniform:LO:HI | lognormal:MEDIAN:SIGMA
+                            seconds per call (default lognormal:0.8:0.4)
+    FAKE_GEMINI_ERROR_RATE  share of calls failing with 503 (default 0)
+    FAKE_GEMINI_SEED        seed for latencies and errors
+
+Prompts containing FAIL_MARKER always fail, so the fallback path can be
+driven on purpose.
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import threading
+import time
+import zlib
+
+import google.generativeai as genai
+from google.api_core import exceptions as google_exceptions
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+FAIL_MARKER = "[bench:fail]"
+
+BATCH_ITEM = re.compile(r'<item id="(\d+)">')
+
+_random = random.Random(os.getenv("FAKE_GEMINI_SEED"))
+_random_lock = threading.Lock()
+
+
+def _load_answers():
+    answers = {"lines": [], "json": []}
+    with open(os.path.join(DATA_DIR, "sample_responses.jsonl"), encoding="utf-8") as corpus_file:
+        for line in corpus_file:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            try:
+                # Keep well-formed JSON answers only; malformed ones are for the parser benchmark
+                if record["format"] == "json" and not isinstance(json.loads(record["text"]), dict):
+                    continue
+            except ValueError:
+                continue
+            answers[record["format"]].append(record["text"])
+    return answers
+
+
+_ANSWERS = _load_answers()
+
+
+def latency_sampler(spec):
+    """Sampler of call latencies in seconds from a FAKE_GEMINI_LATENCY spec"""
+    kind, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(":") if value]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        median, sigma = values
+        return lambda rng: median * rng.lognormvariate(0, sigma)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+_sample_latency = latency_sampler(os.getenv("FAKE_GEMINI_LATENCY", "lognormal:0.8:0.4"))
+_error_rate = float(os.getenv("FAKE_GEMINI_ERROR_RATE", 0))
+
+
+def _prompt_text(contents):
+    if isinstance(contents, str):
+        return contents
+    return "".join(part for part in contents if isinstance(part, str))
+
+
+def _plan_call(contents, request_options):
+    """(seconds to wait, error to raise or None) for one call"""
+    with _random_lock:
+        latency = _sample_latency(_random)
+        fails = _random.random() < _error_rate
+    timeout = (request_options or {}).get("timeout")
+    if timeout is not None and latency > timeout:
+        return timeout, google_exceptions.DeadlineExceeded("fake Gemini timed out")
+    if fails or FAIL_MARKER in _prompt_text(contents):
+        return latency, google_exceptions.ServiceUnavailable("fake Gemini outage")
+    return latency, None
+
+
+def _answer(contents, generation_config):
+    """A canned answer in the format the prompt asked for, stable per prompt"""
+    prompt = _prompt_text(contents)
+    structured = bool(generation_config)
+    pool = _ANSWERS["json" if structured else "lines"]
+    pick = zlib.crc32(prompt.encode())
+
+    items = BATCH_ITEM.findall(prompt)
+    if not items:
+        return pool[pick % len(pool)]
+    if structured:
+        return json.dumps([
+            {"item": int(item), **json.loads(pool[(pick + index) % len(pool)])}
+            for index, item in enumerate(items)
+        ])
+    return "\n".join(
+        f"ITEM {item}\n{pool[(pick + index) % len(pool)]}" for index, item in enumerate(items)
+    )
+
+
+class _Response:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name="gemini-2.5-flash", **kwargs):
+        self.model_name = model_name
+
+    def generate_content(self, contents, generation_config=None, request_options=None, stream=False, **kwargs):
+        delay, error = _plan_call(contents, request_options)
+        if stream:
+            return self._stream(contents, delay, error)
+        time.sleep(delay)
+        if error:
+            raise error
+        return _Response(_answer(contents, generation_config))
+
+    async def generate_content_async(self, contents, generation_config=None, request_options=None, **kwargs):
+        delay, error = _plan_call(contents, request_options)
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return _Response(_answer(contents, generation_config))
+
+    def _stream(self, contents, delay, error):
+        answer = _answer(contents, None)
+        lines = answer.splitlines(keepends=True)
+        # First chunk after most of the latency, the rest trickling in
+        time.sleep(delay * 0.6)
+        if error:
+            raise error
+        for line in lines:
+            time.sleep(delay * 0.4 / len(lines))
+            yield _Response(line)
+
+    def count_tokens(self, contents, **kwargs):
+        return None
+
+
+def install():
+    """Route every model the app creates to the fake"""
+    genai.GenerativeModel = FakeGenerativeModel
+    genai.configure = lambda **kwargs: None
@@ -0,0 +1,304 @@
+"""
+Load test: the analyze endpoints under gunicorn, with Gemini replaced by
+the local fake (see fake_gemini.py), so no quota is spent.
+
+For each worker class a fresh server is started on throwaway data, then
+each scenario is driven at the target concurrency for a fixed time:
+
+    hit       the same text over and over (result cache)
+    miss      a new text every request (model call)
+    image     a new image every request (vision model call)
+    fallback  a new text every request, with the model failing
+
+Throughput and p50/p95/p99 latency are printed per worker class and
+scenario. --output writes them as JSON; --compare checks them against a
+previous --output and exits non-zero on a regression, for CI.
+
+    python benchmarks/load_test.py [--worker-classes sync,gthread,uvicorn]
+        [--concurrency 16] [--duration 10] [--latency lognormal:0.8:0.4]
+        [--output results.json] [--compare baseline.json --tolerance 0.25]
+"""
+import argparse
+import http.client
+import importlib.util
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from benchmarks.fake_gemini import FAIL_MARKER  # noqa: E402
+
+SCENARIOS = ("hit", "miss", "image", "fallback")
+
+# Worker class -> (gunicorn -k value, app, text path, image path)
+WORKER_CLASSES = {
+    "sync": ("sync", "benchmarks.bench_app:application", "/api/analyze/text/", "/api/analyze/image/"),
+    "gthread": ("gthread", "benchmarks.bench_app:application", "/api/analyze/text/", "/api/analyze/image/"),
+    "uvicorn": (
+        "uvicorn.workers.UvicornWorker",
+        "benchmarks.bench_app:asgi_application",
+        "/api/async/analyze/text/",
+        "/api/async/analyze/image/",
+    ),
+}
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def start_server(worker_class, args, data_dir):
+    kind, app, _, _ = WORKER_CLASSES[worker_class]
+    port = free_port()
+    env = {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": "benchmarks.bench_settings",
+        "BENCH_DIR": data_dir,
+        "ALLOWED_ORIGINS": os.environ.get("ALLOWED_ORIGINS", "http://localhost"),
+        "FAKE_GEMINI_LATENCY": args.latency,
+        "FAKE_GEMINI_ERROR_RATE": str(args.error_rate),
+    }
+    command = [
+        sys.executable, "-m", "gunicorn", app,
+        "--chdir", BASE_DIR,
+        "--bind", f"127.0.0.1:{port}",
+        "--workers", str(args.workers),
+        "--worker-class", kind,
+        "--timeout", "120",
+        "--log-level", "warning",
+    ]
+    if worker_class == "gthread":
+        # gunicorn turns sync workers with several threads into gthread ones
+        command += ["--threads", str(args.threads)]
+    server = subprocess.Popen(command, env=env)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"gunicorn ({worker_class}) exited with {server.returncode}")
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            connection.request("GET", "/api/health/")
+            if connection.getresponse().status == 200:
+                return server, port
+        except OSError:
+            pass
+        time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"gunicorn ({worker_class}) did not come up")
+
+
+def stop_server(server):
+    server.terminate()
+    try:
+        server.wait(timeout=15)
+    except subprocess.TimeoutExpired:
+        server.kill()
+
+
+def text_request(path, text):
+    return path, json.dumps({"text": text}).encode(), "application/json"
+
+
+def image_request(path):
+    from PIL import Image
+
+    # Noise never matches a cached or near-duplicate image
+    image = Image.effect_noise((96, 96), 60).convert("RGB")
+    buffer = io.BytesIO()
+    image.save(buffer, "PNG")
+    boundary = uuid.uuid4().hex
+    body = b"".join((
+        f"--{boundary}\r\n".encode(),
+        b'Content-Disposition: form-data; name="image"; filename="bench.png"\r\n',
+        b"Content-Type: image/png\r\n\r\n",
+        buffer.getvalue(),
+        f"\r\n--{boundary}--\r\n".encode(),
+    ))
+    return path, body, f"multipart/form-data; boundary={boundary}"
+
+
+def request_factory(scenario, worker_class):
+    """Function building the next (path, body, content type) of a scenario"""
+    _, _, text_path, image_path = WORKER_CLASSES[worker_class]
+    if scenario == "hit":
+        return lambda: text_request(text_path, "See you at practice tomorrow, bring the ball")
+    if scenario == "miss":
+        return lambda: text_request(text_path, f"Are we still meeting later? ref {uuid.uuid4().hex}")
+    if scenario == "fallback":
+        return lambda: text_request(text_path, f"{FAIL_MARKER} you will regret this {uuid.uuid4().hex}")
+    if scenario == "image":
+        return lambda: image_request(image_path)
+    raise ValueError(scenario)
+
+
+def send(connection, request):
+    path, body, content_type = request
+    connection.request("POST", path, body=body, headers={"Content-Type": content_type})
+    response = connection.getresponse()
+    response.read()
+    return response.status
+
+
+def drive(port, make_request, concurrency, duration):
+    """Run clients for duration seconds; returns (latencies, errors, elapsed)"""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    started = time.monotonic()
+    stop_at = started + duration
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+        mine = []
+        failed = 0
+        while time.monotonic() < stop_at:
+            request = make_request()
+            sent = time.perf_counter()
+            try:
+                status = send(connection, request)
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+                status = None
+            if status == 200:
+                mine.append(time.perf_counter() - sent)
+            else:
+                failed += 1
+        connection.close()
+        with lock:
+            latencies.extend(mine)
+            errors[0] += failed
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return latencies, errors[0], time.monotonic() - started
+
+
+def percentile(ordered, share):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(share * len(ordered)))]
+
+
+def summarize(latencies, errors, elapsed):
+    ordered = sorted(latencies)
+    return {
+        "requests": len(ordered),
+        "errors": errors,
+        "throughput": len(ordered) / elapsed,
+        "p50_ms": percentile(ordered, 0.50) * 1000,
+        "p95_ms": percentile(ordered, 0.95) * 1000,
+        "p99_ms": percentile(ordered, 0.99) * 1000,
+    }
+
+
+def run_worker_class(worker_class, args):
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="safeguard-bench-") as data_dir:
+        server, port = start_server(worker_class, args, data_dir)
+        try:
+            for scenario in args.scenarios:
+                make_request = request_factory(scenario, worker_class)
+                if scenario == "hit":
+                    # Warm the cache so every timed request is a hit
+                    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+                    send(connection, make_request())
+                    connection.close()
+                results[scenario] = summarize(*drive(port, make_request, args.concurrency, args.duration))
+                print_row(worker_class, scenario, results[scenario])
+        finally:
+            stop_server(server)
+    return results
+
+
+def print_row(worker_class, scenario, result):
+    print(
+        f"{worker_class:<10} {scenario:<9} {result['requests']:>8} {result['errors']:>7} "
+        f"{result['throughput']:>9.1f} {result['p50_ms']:>9.1f} {result['p95_ms']:>9.1f} {result['p99_ms']:>9.1f}",
+        flush=True,
+    )
+
+
+def compare(results, baseline, tolerance):
+    """Regression messages: p95 or throughput more than tolerance worse than the baseline"""
+    regressions = []
+    for worker_class, scenarios in results.items():
+        for scenario, result in scenarios.items():
+            before = baseline.get(worker_class, {}).get(scenario)
+            if not before:
+                continue
+            if result["p95_ms"] > before["p95_ms"] * (1 + tolerance):
+                regressions.append(
+                    f"{worker_class}/{scenario}: p95 {result['p95_ms']:.1f} ms vs {before['p95_ms']:.1f} ms"
+                )
+            if result["throughput"] < before["throughput"] * (1 - tolerance):
+                regressions.append(
+                    f"{worker_class}/{scenario}: throughput {result['throughput']:.1f}/s "
+                    f"vs {before['throughput']:.1f}/s"
+                )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--worker-classes", default="sync,gthread,uvicorn")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--threads", type=int, default=8, help="threads per gthread worker")
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per scenario")
+    parser.add_argument("--latency", default="lognormal:0.8:0.4", help="fake Gemini latency distribution")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of fake Gemini calls failing")
+    parser.add_argument("--output", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON from an earlier --output")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args()
+
+    args.scenarios = [scenario for scenario in args.scenarios.split(",") if scenario]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    worker_classes = []
+    for worker_class in args.worker_classes.split(","):
+        if worker_class not in WORKER_CLASSES:
+            parser.error(f"unknown worker class: {worker_class}")
+        if worker_class == "uvicorn" and importlib.util.find_spec("uvicorn") is None:
+            print("Skipping uvicorn workers: uvicorn is not installed", file=sys.stderr)
+            continue
+        worker_classes.append(worker_class)
+
+    print(f"{'workers':<10} {'scenario':<9} {'requests':>8} {'errors':>7} "
+          f"{'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    results = {worker_class: run_worker_class(worker_class, args) for worker_class in worker_classes}
+
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            regressions = compare(results, json.load(baseline_file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Micro-benchmark: legacy line parser vs schema-validated JSON parsing.
+
+Replays a corpus of recorded model answers (JSON lines with "format"
+"lines" or "json" and the raw answer "text") through both parsers and
+reports time per answer and failure rate.
+
+    python benchmarks/parse_responses.py [--corpus FILE] [--repeat N]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "safeguard_be.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from api.utils import structured_output  # noqa: E402
+from api.utils.ai_detector import AbuseDetector  # noqa: E402
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "sample_responses.jsonl")
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as corpus_file:
+        return [json.loads(line) for line in corpus_file if line.strip()]
+
+
+RISK_LEVELS = ("LOW", "MEDIUM", "HIGH", "CRITICAL")
+
+
+def failed(result):
+    """An answer fails when nothing usable came out (the legacy parser yields UNKNOWN)"""
+    return result is None or result["risk_level"] not in RISK_LEVELS
+
+
+def run(name, answers, parse, repeat):
+    """Print time per answer and the share of answers that failed to parse"""
+    failures = sum(1 for answer in answers if failed(parse(answer)))
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for answer in answers:
+            parse(answer)
+    elapsed = time.perf_counter() - started
+    per_answer = elapsed / (repeat * len(answers)) * 1e6
+    print(f"{name:<24} {len(answers):>6} {per_answer:>10.1f} {failures / len(answers):>10.1%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="JSON lines file of recorded answers")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.corpus)
+    detector = AbuseDetector()
+
+    def structured_with_fallback(answer):
+        return detector._parse_answer(answer, structured=True)
+
+    line_answers = [record["text"] for record in corpus if record["format"] == "lines"]
+    json_answers = [record["text"] for record in corpus if record["format"] == "json"]
+
+    print(f"{'parser':<24} {'answers':>6} {'us/answer':>10} {'failures':>10}")
+    if line_answers:
+        run("legacy (line answers)", line_answers, detector._parse_response, args.repeat)
+    if json_answers:
+        run("pydantic (json answers)", json_answers, structured_output.parse_analysis, args.repeat)
+        run("pydantic + fallback", json_answers, structured_with_fallback, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
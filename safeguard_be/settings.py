@@ -49,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "api.middleware.ServerTimingMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     'whitenoise.middleware.WhiteNoiseMiddleware',
@@ -88,6 +89,8 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Web workers and job workers write concurrently; wait for locks
+        "OPTIONS": {"timeout": 20},
     }
 }
 
@@ -146,6 +149,75 @@ CORS_ALLOWED_ORIGINS = [
 # Google Gemini API
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
 
+# Several keys (or projects) to spread calls over, comma separated as KEY or
+# KEY:WEIGHT; replaces GEMINI_API_KEY when set. A key answering with a quota
+# error cools down for upstream's retry delay, or else doubling per consecutive
+# error up to the max, unless no other key is usable. Keys can be held under a
+# per-minute request/token budget (0 = no budget)
+GEMINI_API_KEYS = [key.strip() for key in os.getenv('GEMINI_API_KEYS', '').split(',') if key.strip()]
+GEMINI_KEY_COOLDOWN = float(os.getenv('GEMINI_KEY_COOLDOWN', 60))
+GEMINI_KEY_MAX_COOLDOWN = float(os.getenv('GEMINI_KEY_MAX_COOLDOWN', 900))
+GEMINI_KEY_RPM_LIMIT = int(os.getenv('GEMINI_KEY_RPM_LIMIT', 0))
+GEMINI_KEY_TPM_LIMIT = int(os.getenv('GEMINI_KEY_TPM_LIMIT', 0))
+
+# Model tiers. GEMINI_MODEL answers everything unless routing is enabled; then
+# short texts with no lexicon hit go to the lite model, long texts the lexicon
+# flags as HIGH/CRITICAL go to pro, and a tier whose p95 latency is over the
+# budget (seconds, 0 = ignore latency) hands its traffic one tier down. Only
+# latencies from the last LATENCY_WINDOW seconds count, so a slow tier gets
+# traffic again once its samples age out. HIGH/CRITICAL verdicts (or severe
+# lexicon hits) below the escalation confidence are re-run one tier up.
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash')
+GEMINI_MODEL_LITE = os.getenv('GEMINI_MODEL_LITE', 'gemini-2.5-flash-lite')
+GEMINI_MODEL_PRO = os.getenv('GEMINI_MODEL_PRO', 'gemini-2.5-pro')
+GEMINI_ROUTING_ENABLED = os.getenv('GEMINI_ROUTING_ENABLED', 'false').lower() == 'true'
+GEMINI_ROUTING_LITE_MAX_CHARS = int(os.getenv('GEMINI_ROUTING_LITE_MAX_CHARS', 280))
+GEMINI_ROUTING_PRO_MIN_CHARS = int(os.getenv('GEMINI_ROUTING_PRO_MIN_CHARS', 4000))
+GEMINI_ROUTING_LATENCY_BUDGET = float(os.getenv('GEMINI_ROUTING_LATENCY_BUDGET', 0))
+GEMINI_ROUTING_LATENCY_WINDOW = float(os.getenv('GEMINI_ROUTING_LATENCY_WINDOW', 300))
+GEMINI_ESCALATION_CONFIDENCE = int(os.getenv('GEMINI_ESCALATION_CONFIDENCE', 70))
+
+# Upper bound on in-flight Gemini calls per process for the async (ASGI) views
+GEMINI_MAX_CONCURRENT_REQUESTS = int(os.getenv('GEMINI_MAX_CONCURRENT_REQUESTS', 64))
+
+# Open the Gemini channel when each worker boots rather than on its first request.
+# Each worker warms its own client, so do not rely on this with gunicorn --preload.
+GEMINI_WARMUP = os.getenv('GEMINI_WARMUP', 'false').lower() == 'true'
+
+# Resilience around Gemini calls: per-request time budget, a per-process circuit
+# breaker (consecutive failures to open, seconds before a probe), and optional
+# hedging that fires a duplicate call once a call outlives the given percentile
+GEMINI_REQUEST_DEADLINE = float(os.getenv('GEMINI_REQUEST_DEADLINE', 20))
+GEMINI_BREAKER_FAILURE_THRESHOLD = int(os.getenv('GEMINI_BREAKER_FAILURE_THRESHOLD', 5))
+GEMINI_BREAKER_RESET_TIMEOUT = float(os.getenv('GEMINI_BREAKER_RESET_TIMEOUT', 30))
+GEMINI_HEDGE_ENABLED = os.getenv('GEMINI_HEDGE_ENABLED', 'false').lower() == 'true'
+GEMINI_HEDGE_PERCENTILE = float(os.getenv('GEMINI_HEDGE_PERCENTILE', 95))
+GEMINI_HEDGE_MAX_WORKERS = int(os.getenv('GEMINI_HEDGE_MAX_WORKERS', 32))
+
+# Ask Gemini for schema-constrained JSON answers (validated with pydantic);
+# the line-based parser is still used as a fallback and for streaming
+GEMINI_STRUCTURED_OUTPUT = os.getenv('GEMINI_STRUCTURED_OUTPUT', 'true').lower() == 'true'
+
+# Batch text analysis: texts accepted per request, and how misses are packed
+# into model calls (estimated prompt tokens and items per call). Batch items
+# are never chunked, so each is limited to LONG_TEXT_THRESHOLD characters;
+# longer texts go through /api/analyze/text/
+BATCH_MAX_TEXTS = int(os.getenv('BATCH_MAX_TEXTS', 100))
+BATCH_TOKEN_BUDGET = int(os.getenv('BATCH_TOKEN_BUDGET', 8000))
+BATCH_MAX_ITEMS_PER_CALL = int(os.getenv('BATCH_MAX_ITEMS_PER_CALL', 25))
+
+# Texts longer than LONG_TEXT_THRESHOLD characters (chat exports...) are split
+# into message-aligned chunks of LONG_TEXT_CHUNK_CHARS, each repeating the last
+# LONG_TEXT_CHUNK_OVERLAP messages of the previous one, and analyzed in parallel.
+# Every chunk is a model call, so texts are capped at TEXT_MAX_CHARS characters
+# (400) and LONG_TEXT_MAX_CHUNKS chunks (413)
+TEXT_MAX_CHARS = int(os.getenv('TEXT_MAX_CHARS', 100000))
+LONG_TEXT_MAX_CHUNKS = int(os.getenv('LONG_TEXT_MAX_CHUNKS', 25))
+LONG_TEXT_THRESHOLD = int(os.getenv('LONG_TEXT_THRESHOLD', 8000))
+LONG_TEXT_CHUNK_CHARS = int(os.getenv('LONG_TEXT_CHUNK_CHARS', 6000))
+LONG_TEXT_CHUNK_OVERLAP = int(os.getenv('LONG_TEXT_CHUNK_OVERLAP', 2))
+LONG_TEXT_MAX_WORKERS = int(os.getenv('LONG_TEXT_MAX_WORKERS', 8))
+
 PAYPAL_MODE = "sandbox"  # change to "live" when deploying
 PAYPAL_CLIENT_ID = os.getenv("PAYPAL_CLIENT_ID")
 PAYPAL_CLIENT_SECRET = os.getenv("PAYPAL_SECRET")
@@ -156,11 +228,169 @@ paypalrestsdk.configure({
     "client_secret": PAYPAL_CLIENT_SECRET
 })
 
+# Small per-worker LRU in front of a SQLite file shared by all workers on the host
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
-        'LOCATION': 'unique-safeguard-cache',
-    }
+        'BACKEND': 'api.utils.two_tier_cache.TwoTierCache',
+        'LOCATION': os.getenv('CACHE_DB_PATH', str(BASE_DIR / 'cache.sqlite3')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 50000)),
+            'LOCAL_MAX_ENTRIES': int(os.getenv('CACHE_LOCAL_MAX_ENTRIES', 1000)),
+            'LOCAL_TIMEOUT': 60,
+        },
+    },
+    # Conversation sessions: no in-process tier, so every worker sees the
+    # latest state. MAX_ENTRIES bounds the number of live sessions.
+    'conversations': {
+        'BACKEND': 'api.utils.two_tier_cache.TwoTierCache',
+        'LOCATION': os.getenv('CONVERSATION_DB_PATH', str(BASE_DIR / 'conversations.sqlite3')),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CONVERSATION_MAX_SESSIONS', 10000)),
+            'LOCAL_MAX_ENTRIES': 0,
+        },
+    },
+}
+
+CACHE_TIMEOUT = 300
+
+# Perceptual-hash near-duplicate lookup for images (hybrid mode only, and only
+# when the OCR text matches too): max Hamming distance (out of 256 bits)
+# treated as the same image, and index size per worker
+IMAGE_PHASH_THRESHOLD = int(os.getenv('IMAGE_PHASH_THRESHOLD', 10))
+IMAGE_PHASH_MAX_ENTRIES = int(os.getenv('IMAGE_PHASH_MAX_ENTRIES', 10000))
+
+# Uploads are downscaled and re-encoded before being sent to the vision model;
+# anything above IMAGE_MAX_PIXELS is rejected as a likely decompression bomb
+IMAGE_MAX_SIDE = int(os.getenv('IMAGE_MAX_SIDE', 1600))
+IMAGE_UPLOAD_FORMAT = os.getenv('IMAGE_UPLOAD_FORMAT', 'WEBP')
+IMAGE_UPLOAD_QUALITY = int(os.getenv('IMAGE_UPLOAD_QUALITY', 80))
+IMAGE_MAX_PIXELS = int(os.getenv('IMAGE_MAX_PIXELS', 40_000_000))
+
+# Multi-image uploads (/api/analyze/images/): files per request, bytes per image
+# and total uncompressed bytes of a zip archive; unique images are analyzed on
+# MULTI_IMAGE_MAX_WORKERS threads per process
+MULTI_IMAGE_MAX_FILES = int(os.getenv('MULTI_IMAGE_MAX_FILES', 50))
+MULTI_IMAGE_MAX_BYTES = int(os.getenv('MULTI_IMAGE_MAX_BYTES', 20 * 1024 * 1024))
+MULTI_IMAGE_MAX_WORKERS = int(os.getenv('MULTI_IMAGE_MAX_WORKERS', 4))
+ARCHIVE_MAX_TOTAL_BYTES = int(os.getenv('ARCHIVE_MAX_TOTAL_BYTES', 200 * 1024 * 1024))
+
+# Analysis job queue (/api/jobs/, run by `manage.py run_analysis_worker`).
+# A job not finished within JOB_LEASE_SECONDS is assumed lost and requeued,
+# up to JOB_MAX_ATTEMPTS times; finished jobs are kept for JOB_RETENTION seconds.
+JOB_WORKER_THREADS = int(os.getenv('JOB_WORKER_THREADS', 4))
+JOB_WORKER_BATCH_SIZE = int(os.getenv('JOB_WORKER_BATCH_SIZE', 20))
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 1))
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 300))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+JOB_RETENTION = int(os.getenv('JOB_RETENTION', 86400))
+
+# 'hybrid': OCR every image first and analyze text-heavy screenshots as text,
+# sending only the rest to the vision model. 'vision': always use vision.
+IMAGE_ANALYSIS_MODE = os.getenv('IMAGE_ANALYSIS_MODE', 'hybrid')
+
+# OCR (tesseract) runs on a per-worker process pool. An image counts as
+# text-heavy with at least OCR_MIN_WORDS words at OCR_MIN_CONFIDENCE mean confidence.
+OCR_MAX_WORKERS = int(os.getenv('OCR_MAX_WORKERS', 2))
+OCR_TIMEOUT = float(os.getenv('OCR_TIMEOUT', 15))
+OCR_LANGUAGES = os.getenv('OCR_LANGUAGES', 'eng')
+OCR_MAX_SIDE = int(os.getenv('OCR_MAX_SIDE', 3000))
+OCR_MIN_WORDS = int(os.getenv('OCR_MIN_WORDS', 8))
+OCR_MIN_CONFIDENCE = float(os.getenv('OCR_MIN_CONFIDENCE', 70))
+
+# Per-language keyword lexicons used when Gemini is unavailable
+LEXICON_DIR = os.getenv('LEXICON_DIR', str(BASE_DIR / 'api' / 'data' / 'lexicons'))
+
+# Support-resource directory served by /api/resources/support/; the file is
+# checked for changes at most every SUPPORT_RESOURCES_RELOAD_INTERVAL seconds
+SUPPORT_RESOURCES_PATH = os.getenv(
+    'SUPPORT_RESOURCES_PATH', str(BASE_DIR / 'api' / 'data' / 'support_resources.json')
+)
+SUPPORT_RESOURCES_RELOAD_INTERVAL = float(os.getenv('SUPPORT_RESOURCES_RELOAD_INTERVAL', 5))
+
+# Cache-Control for the read-only endpoints (support resources, safety tips):
+# clients and CDNs reuse a response for MAX_AGE seconds, then may serve it
+# stale while revalidating with its ETag
+STATIC_RESPONSE_MAX_AGE = int(os.getenv('STATIC_RESPONSE_MAX_AGE', 300))
+STATIC_RESPONSE_STALE_WHILE_REVALIDATE = int(os.getenv('STATIC_RESPONSE_STALE_WHILE_REVALIDATE', 86400))
+
+# Local triage classifier in front of Gemini (train with `manage.py train_triage`).
+# Texts at or above a threshold are answered locally; the rest go upstream.
+TRIAGE_ENABLED = os.getenv('TRIAGE_ENABLED', 'true').lower() == 'true'
+TRIAGE_MODEL_PATH = os.getenv('TRIAGE_MODEL_PATH', str(BASE_DIR / 'triage_model.json'))
+TRIAGE_BENIGN_THRESHOLD = float(os.getenv('TRIAGE_BENIGN_THRESHOLD', 0.98))
+TRIAGE_CRITICAL_THRESHOLD = float(os.getenv('TRIAGE_CRITICAL_THRESHOLD', 0.99))
+# Store Gemini text verdicts (including the text) as training data
+TRIAGE_RECORD_VERDICTS = os.getenv('TRIAGE_RECORD_VERDICTS', 'false').lower() == 'true'
+
+# Key for the keyed hash behind result cache keys
+CACHE_KEY_SECRET = os.getenv('CACHE_KEY_SECRET', SECRET_KEY)
+
+# Seconds a request waits on an identical in-flight analysis before falling
+# back to keyword detection
+SINGLE_FLIGHT_TIMEOUT = float(os.getenv('SINGLE_FLIGHT_TIMEOUT', 30))
+# Conversation sessions (/api/conversations/): sessions expire after
+# CONVERSATION_IDLE_TIMEOUT seconds without new messages. Only the last
+# CONVERSATION_CONTEXT_MESSAGES messages, a rolling summary and the last
+# CONVERSATION_MAX_EVIDENCE flagged updates are kept per session. Appended
+# messages longer than CONVERSATION_MESSAGE_MAX_CHARS are rejected (400).
+CONVERSATION_CACHE_ALIAS = 'conversations'
+CONVERSATION_IDLE_TIMEOUT = int(os.getenv('CONVERSATION_IDLE_TIMEOUT', 3600))
+CONVERSATION_CONTEXT_MESSAGES = int(os.getenv('CONVERSATION_CONTEXT_MESSAGES', 10))
+CONVERSATION_MESSAGE_MAX_CHARS = int(os.getenv('CONVERSATION_MESSAGE_MAX_CHARS', 1000))
+CONVERSATION_SUMMARY_MAX_CHARS = int(os.getenv('CONVERSATION_SUMMARY_MAX_CHARS', 1000))
+CONVERSATION_MAX_EVIDENCE = int(os.getenv('CONVERSATION_MAX_EVIDENCE', 20))
+CONVERSATION_MAX_MESSAGES_PER_APPEND = int(os.getenv('CONVERSATION_MAX_MESSAGES_PER_APPEND', 50))
+# Concurrent appends to one session wait up to LOCK_WAIT seconds, then get a 409
+CONVERSATION_LOCK_WAIT = float(os.getenv('CONVERSATION_LOCK_WAIT', 5))
+
+# Admission control for the analyze endpoints, off unless enabled. Each client
+# (by REMOTE_ADDR, or the first X-Forwarded-For hop when behind a trusted proxy)
+# gets a token bucket of BUCKET_CAPACITY tokens refilled at BUCKET_REFILL_RATE
+# per second, shared by all workers on the host through ADMISSION_DB_PATH and
+# charged only when a request misses the cache. Behind a reverse proxy, set
+# ADMISSION_TRUST_X_FORWARDED_FOR too, or every user shares the proxy's bucket.
+# At most MAX_ACTIVE model calls run per process; up to MAX_QUEUED more wait,
+# likely high-risk content first, for at most QUEUE_TIMEOUT seconds. Shed
+# requests get a 429 ('reject') or the keyword-only verdict ('fallback').
+ADMISSION_ENABLED = os.getenv('ADMISSION_ENABLED', 'false').lower() == 'true'
+ADMISSION_DB_PATH = os.getenv('ADMISSION_DB_PATH', str(BASE_DIR / 'admission.sqlite3'))
+ADMISSION_BUCKET_CAPACITY = float(os.getenv('ADMISSION_BUCKET_CAPACITY', 30))
+ADMISSION_BUCKET_REFILL_RATE = float(os.getenv('ADMISSION_BUCKET_REFILL_RATE', 0.5))
+ADMISSION_MAX_ACTIVE = int(os.getenv('ADMISSION_MAX_ACTIVE', 16))
+ADMISSION_MAX_QUEUED = int(os.getenv('ADMISSION_MAX_QUEUED', 64))
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv('ADMISSION_QUEUE_TIMEOUT', 10))
+ADMISSION_RETRY_AFTER = int(os.getenv('ADMISSION_RETRY_AFTER', 5))
+ADMISSION_SHED_MODE = os.getenv('ADMISSION_SHED_MODE', 'reject')
+ADMISSION_TRUST_X_FORWARDED_FOR = os.getenv('ADMISSION_TRUST_X_FORWARDED_FOR', 'false').lower() == 'true'
+
+# A conversation append holds its session lock through the admission queue wait,
+# the Gemini call and a possible escalation call (each within the request
+# deadline), so the lock outlives that worst case plus some slack
+CONVERSATION_LOCK_TIMEOUT = int(os.getenv(
+    'CONVERSATION_LOCK_TIMEOUT',
+    ADMISSION_QUEUE_TIMEOUT + 2 * GEMINI_REQUEST_DEADLINE + 10,
+))
+
+# Logging for the api app. Per-request cache hits and misses are logged at
+# DEBUG, so the default INFO level keeps stdout writes off the hot path.
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {'format': '%(asctime)s %(levelname)s %(name)s: %(message)s'},
+    },
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler', 'formatter': 'simple'},
+    },
+    'loggers': {
+        'api': {'handlers': ['console'], 'level': LOG_LEVEL, 'propagate': False},
+    },
 }
 
-CACHE_TIMEOUT = 300
\ No newline at end of file
+# Prometheus metrics served by /api/metrics/. With several worker processes,
+# set METRICS_DIR to a directory they share: each worker writes its counters
+# there at most every METRICS_FLUSH_INTERVAL seconds and a scrape sums them.
+# Unset, a scrape only sees the worker that answered it.
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 10))